@@ -0,0 +1,7 @@
+"""
+Benchmarks for the BitBraniac backend.
+
+Run from the ``bitbraniac-backend`` directory, e.g.::
+
+    python -m benchmarks.export_import --messages 1000000
+"""
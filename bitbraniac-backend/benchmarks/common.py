@@ -0,0 +1,140 @@
+"""
+Shared helpers for the benchmark scripts: data seeding, percentiles and
+result files.
+"""
+
+import json
+import math
+import os
+import resource
+import uuid
+from datetime import datetime, timedelta
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+SAMPLE_QUESTIONS = (
+    'Explain how a hash map resolves collisions.',
+    'What is the difference between a process and a thread?',
+    'How does binary search work on a sorted array?',
+    'Why is quicksort O(n log n) on average?',
+    'What does a database index actually store?',
+    'How do TCP and UDP differ?',
+)
+
+
+def max_rss_mb():
+    """Peak resident set size of this process in MB (Linux reports KB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize_latencies(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (milliseconds) for one run."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+
+def seed_users(db, User, count, password='benchmark', start=0):
+    """Create users sharing one password hash (hashing is deliberately slow)."""
+    template = User(email='template@bench.local')
+    template.set_password(password)
+    rows = [
+        {
+            'id': str(uuid.uuid4()),
+            'email': f'user{i}@bench.local',
+            'password_hash': template.password_hash,
+            'created_at': datetime.utcnow(),
+            'is_active': True
+        }
+        for i in range(start, start + count)
+    ]
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+    return [row['id'] for row in rows]
+
+
+def seed_history(db, ChatSession, ChatMessage, user_ids, sessions_per_user, messages_per_session, batch_size=10000):
+    """Insert synthetic sessions and messages with executemany batches.
+
+    Returns a mapping of user id to the ids of the sessions created for it.
+    """
+    start = datetime.utcnow() - timedelta(days=30)
+    sessions_by_user = {}
+    session_rows, message_rows = [], []
+
+    def flush():
+        if session_rows:
+            db.session.execute(ChatSession.__table__.insert(), session_rows)
+        if message_rows:
+            db.session.execute(ChatMessage.__table__.insert(), message_rows)
+        db.session.commit()
+        session_rows.clear()
+        message_rows.clear()
+
+    for user_id in user_ids:
+        sessions_by_user[user_id] = []
+        for s in range(sessions_per_user):
+            session_id = str(uuid.uuid4())
+            sessions_by_user[user_id].append(session_id)
+            session_rows.append({
+                'id': session_id, 'user_id': user_id, 'title': SAMPLE_QUESTIONS[s % len(SAMPLE_QUESTIONS)],
+                'created_at': start, 'updated_at': start + timedelta(minutes=s), 'is_active': True
+            })
+            for m in range(messages_per_session):
+                message_rows.append({
+                    'id': str(uuid.uuid4()), 'session_id': session_id,
+                    'message_type': 'user' if m % 2 == 0 else 'assistant',
+                    'content': f'{SAMPLE_QUESTIONS[m % len(SAMPLE_QUESTIONS)]} (message {m}) ' * 3,
+                    'created_at': start + timedelta(minutes=s, seconds=m)
+                })
+            if len(message_rows) >= batch_size:
+                flush()
+
+    flush()
+    return sessions_by_user
+
+
+def save_results(results, path=None, prefix='results'):
+    """Write results as JSON and return the file path."""
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{prefix}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_runs(current, baseline, threshold=0.2):
+    """Compare two run summaries; returns a list of (metric, baseline, current, change, regressed)."""
+    rows = []
+    for metric, higher_is_better in (('throughput_rps', True), ('p50_ms', False), ('p99_ms', False)):
+        old, new = baseline.get(metric), current.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = change < -threshold if higher_is_better else change > threshold
+        rows.append((metric, old, new, change, regressed))
+    return rows
@@ -0,0 +1,120 @@
+"""
+Conversation memory benchmark: resident bytes per active conversation.
+
+Loads ``--conversations`` conversations of ``--messages`` messages into:
+
+- ``langchain``: the ``ConversationBufferMemory`` plus
+  ``ConversationBufferWindowMemory`` pair the chatbot used to fill for every
+  session, one message object per buffer
+- ``ring``: ``ConversationBuffer`` entries only (role and content)
+- ``ring_prompted``: ``ConversationBuffer`` after a prompt was built, with
+  each entry holding its LangChain message
+
+Message text is created before measuring and is not counted, so the numbers
+are the overhead of each representation.
+
+    python -m benchmarks.conversation_memory --conversations 1000 --messages 20
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+import warnings
+
+from benchmarks.common import SAMPLE_QUESTIONS, save_results
+from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
+from src.services.conversation import AI, HUMAN, ConversationBuffer
+
+
+def conversation_texts(count, messages):
+    """Distinct message texts per conversation, alternating question and answer."""
+    return [
+        [
+            f"{SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]} ({conversation})" if i % 2 == 0
+            else f"An answer of a few sentences for conversation {conversation}. " * 12
+            for i in range(messages)
+        ]
+        for conversation in range(count)
+    ]
+
+
+def load_langchain(texts, window):
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True, input_key="input", output_key="output")
+    window_memory = ConversationBufferWindowMemory(
+        k=window, memory_key="recent_chat_history", return_messages=True, input_key="input", output_key="output"
+    )
+    for i, text in enumerate(texts):
+        for buffer in (memory, window_memory):
+            if i % 2 == 0:
+                buffer.chat_memory.add_user_message(text)
+            else:
+                buffer.chat_memory.add_ai_message(text)
+    return memory, window_memory
+
+
+def load_ring(texts, capacity, prompted=False):
+    conversation = ConversationBuffer(capacity)
+    for i, text in enumerate(texts):
+        conversation.append(HUMAN if i % 2 == 0 else AI, text)
+    if prompted:
+        conversation.messages()
+    return conversation
+
+
+def measure(build, texts):
+    """Bytes allocated and kept by ``build`` for every conversation."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(conversation) for conversation in texts]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--window', type=int, default=10, help='CONVERSATION_WINDOW_SIZE; the ring holds twice as many messages')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/conversation_memory-<timestamp>.json)')
+    args = parser.parse_args()
+
+    texts = conversation_texts(args.conversations, args.messages)
+    text_bytes = sum(len(text.encode('utf-8')) for conversation in texts for text in conversation)
+    capacity = args.window * 2
+
+    with warnings.catch_warnings():
+        # The LangChain memory classes are deprecated
+        warnings.simplefilter('ignore')
+        # Warm up so one-time setup is not counted
+        load_langchain(texts[0], args.window)
+        load_ring(texts[0], capacity, prompted=True)
+        representations = {
+            'langchain': lambda conversation: load_langchain(conversation, args.window),
+            'ring': lambda conversation: load_ring(conversation, capacity),
+            'ring_prompted': lambda conversation: load_ring(conversation, capacity, prompted=True)
+        }
+        results = {key: value for key, value in vars(args).items() if key != 'output'}
+        results['text_bytes_per_conversation'] = round(text_bytes / args.conversations)
+        for name, build in representations.items():
+            allocated = measure(build, texts)
+            results[name] = {
+                'bytes_per_conversation': round(allocated / args.conversations),
+                'bytes_per_message': round(allocated / args.conversations / args.messages, 1)
+            }
+
+    for name in ('ring', 'ring_prompted'):
+        results[name]['reduction'] = round(
+            results['langchain']['bytes_per_conversation'] / results[name]['bytes_per_conversation'], 1
+        )
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='conversation_memory')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Throughput benchmark for streaming NDJSON export and bulk import.
+
+Seeds a temporary SQLite database with synthetic history, streams it through
+``GET /api/sessions/export`` and feeds the result back into
+``POST /api/sessions/import``.
+
+    python -m benchmarks.export_import --messages 1000000 --messages-per-session 100
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import max_rss_mb, save_results, seed_history, seed_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--messages-per-session', type=int, default=100)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/export-import-<timestamp>.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bitbraniac-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['RETENTION_ENABLED'] = 'false'
+
+    from flask_jwt_extended import create_access_token
+    from src.main import create_app
+    from src.models import ChatMessage, ChatSession, User, db
+
+    app = create_app('production')
+    client = app.test_client()
+    export_path = os.path.join(workdir, 'export.ndjson')
+    results = {'messages': args.messages, 'messages_per_session': args.messages_per_session}
+
+    with app.app_context():
+        exporter_id, importer_id = seed_users(db, User, 2)
+        exporter = db.session.get(User, exporter_id)
+        importer = db.session.get(User, importer_id)
+
+        started = time.perf_counter()
+        sessions = -(-args.messages // args.messages_per_session)
+        seed_history(db, ChatSession, ChatMessage, [exporter.id], sessions, args.messages_per_session)
+        results['messages'] = sessions * args.messages_per_session
+        results['seed_seconds'] = round(time.perf_counter() - started, 2)
+
+        export_headers = {'Authorization': f'Bearer {create_access_token(identity=exporter)}'}
+        import_headers = {
+            'Authorization': f'Bearer {create_access_token(identity=importer)}',
+            'Content-Type': 'application/x-ndjson'
+        }
+
+    # Export
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    exported_bytes = 0
+    response = client.get('/api/sessions/export', headers=export_headers, buffered=False)
+    with open(export_path, 'wb') as f:
+        for chunk in response.response:
+            chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            exported_bytes += len(chunk)
+            f.write(chunk)
+    response.close()
+    elapsed = time.perf_counter() - started
+    results['export'] = {
+        'seconds': round(elapsed, 2),
+        'messages_per_second': round(results['messages'] / elapsed),
+        'mb_per_second': round(exported_bytes / elapsed / 1e6, 1),
+        'bytes': exported_bytes,
+        'peak_rss_growth_mb': round(max_rss_mb() - rss_before, 1)
+    }
+
+    # Import
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    with open(export_path, 'rb') as f:
+        response = client.post('/api/sessions/import', data=f, headers=import_headers)
+    elapsed = time.perf_counter() - started
+    results['import'] = {
+        'seconds': round(elapsed, 2),
+        'messages_per_second': round(response.get_json()['messages_imported'] / elapsed),
+        'result': response.get_json(),
+        'peak_rss_growth_mb': round(max_rss_mb() - rss_before, 1)
+    }
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='export-import')}")
+
+
+if __name__ == '__main__':
+    main()
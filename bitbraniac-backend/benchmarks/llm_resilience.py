@@ -0,0 +1,85 @@
+"""
+LLM client resilience benchmark: tail latency and error rate of chat model
+calls against the fake provider, with and without hedged requests.
+
+The fake provider fails a share of calls with a transient error and makes
+another share slow, so the plain, retrying and hedging clients can be
+compared on the same traffic.
+
+    python -m benchmarks.llm_resilience --calls 500 --tail-rate 0.05 --failure-rate 0.05
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize_latencies
+from src.services.llm_backends import FakeChatModel
+from src.services.llm_resilience import ResilientChatModel
+
+
+def run_calls(llm, calls, concurrency):
+    def call(i):
+        started = time.perf_counter()
+        try:
+            llm.invoke([HumanMessage(content=SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)])])
+            return time.perf_counter() - started, False
+        except Exception:
+            return time.perf_counter() - started, True
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - started
+
+    return summarize_latencies(
+        [latency for latency, failed in outcomes if not failed],
+        elapsed,
+        errors=sum(failed for _, failed in outcomes)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help='Normal first-token latency of the fake provider')
+    parser.add_argument('--tail-rate', type=float, default=0.05)
+    parser.add_argument('--tail-latency', type=float, default=1.0)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/llm_resilience-<timestamp>.json)')
+    args = parser.parse_args()
+
+    def provider():
+        return FakeChatModel(
+            latency=args.latency,
+            response_tokens=16,
+            failure_rate=args.failure_rate,
+            tail_rate=args.tail_rate,
+            tail_latency=args.tail_latency
+        )
+
+    clients = {
+        'plain': provider(),
+        'retry': ResilientChatModel(inner=provider(), model_name='retry', retry_base_delay=0.05),
+        'retry_hedge': ResilientChatModel(
+            inner=provider(), model_name='retry_hedge', retry_base_delay=0.05,
+            hedge_enabled=True, hedge_min_delay=args.latency
+        )
+    }
+
+    results = {key: value for key, value in vars(args).items() if key != 'output'}
+    for name, llm in clients.items():
+        results[name] = run_calls(llm, args.calls, args.concurrency)
+        if isinstance(llm, ResilientChatModel):
+            results[name]['hedge_delay_ms'] = round(llm.hedge_delay() * 1000, 2)
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='llm_resilience')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Offline load test for the BitBraniac backend.
+
+Boots ``create_app('testing')`` against a temporary SQLite file with the fake
+LLM backend, seeds synthetic users/sessions/messages, serves the app on a
+local threaded HTTP server and drives the auth, sessions and chat endpoints
+concurrently. Each scale adds users to the same database, so runs grow from
+small to large.
+
+    python -m benchmarks.loadtest --scales small,medium --concurrency 16 --duration 10
+    python -m benchmarks.loadtest --compare benchmarks/results/loadtest-<stamp>.json
+
+Real traffic captured with ``LLM_RECORD_PATH`` can be replayed instead of the
+fake model:
+
+    python -m benchmarks.loadtest --llm-backend replay --replay-path llm-recordings.zst --replay-latency-scale 1.0
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.common import (
+    SAMPLE_QUESTIONS, compare_runs, load_results, save_results, seed_history, seed_users,
+    summarize_latencies
+)
+
+
+# users, sessions per user, messages per session
+SCALES = {
+    'small': (20, 10, 40),
+    'medium': (200, 10, 40),
+    'large': (2000, 10, 40),
+}
+SCENARIOS = ('auth', 'sessions', 'session_detail', 'chat')
+PASSWORD = 'benchmark'
+
+
+class Client:
+    """Keep-alive HTTP client used by one worker thread."""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+def make_scenario(name, users):
+    """Return a callable(client, rng) that issues one request of the scenario."""
+
+    def auth(client, rng):
+        user = rng.choice(users)
+        return client.request('POST', '/api/auth/login', {'email': user['email'], 'password': PASSWORD})
+
+    def sessions(client, rng):
+        user = rng.choice(users)
+        return client.request('GET', '/api/sessions/', token=user['token'])
+
+    def session_detail(client, rng):
+        user = rng.choice(users)
+        return client.request('GET', f"/api/sessions/{rng.choice(user['sessions'])}", token=user['token'])
+
+    def chat(client, rng):
+        user = rng.choice(users)
+        body = {'message': rng.choice(SAMPLE_QUESTIONS), 'session_id': rng.choice(user['sessions'])}
+        return client.request('POST', '/api/chat/message', body, token=user['token'])
+
+    return {'auth': auth, 'sessions': sessions, 'session_detail': session_detail, 'chat': chat}[name]
+
+
+def run_scenario(port, scenario, concurrency, duration, seed):
+    """Run one scenario with a fixed number of closed-loop workers."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = Client(port)
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status, _ = scenario(client, rng)
+                ok = status < 400
+            except Exception:
+                ok = False
+            if ok:
+                local_latencies.append(time.perf_counter() - started)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize_latencies(latencies, time.perf_counter() - started, errors[0])
+
+
+def print_comparison(results, baseline, threshold):
+    regressions = 0
+    for scale, scenarios in results['scales'].items():
+        for name, summary in scenarios.items():
+            previous = baseline.get('scales', {}).get(scale, {}).get(name)
+            if not previous:
+                continue
+            for metric, old, new, change, regressed in compare_runs(summary, previous, threshold):
+                flag = '  REGRESSION' if regressed else ''
+                regressions += regressed
+                print(f'{scale:>7} {name:<15} {metric:<15} {old:>10} -> {new:>10} ({change:+.1%}){flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='small,medium', help=f"Comma separated, from {', '.join(SCALES)}")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per scenario')
+    parser.add_argument('--llm-backend', choices=('fake', 'replay'), default='fake')
+    parser.add_argument('--replay-path', help='Recording log for the replay backend')
+    parser.add_argument('--replay-latency-scale', type=float, default=1.0, help='0 replays instantly')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Fake LLM time to first token (s)')
+    parser.add_argument('--llm-tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--llm-response-tokens', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/loadtest-<timestamp>.json)')
+    parser.add_argument('--compare', help='Baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change flagged as a regression')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bitbraniac-loadtest-')
+    os.environ['TEST_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    os.environ['LLM_BACKEND'] = args.llm_backend
+    if args.llm_backend == 'replay':
+        if not args.replay_path:
+            parser.error('--replay-path is required with --llm-backend replay')
+        os.environ['LLM_REPLAY_PATH'] = args.replay_path
+        os.environ['LLM_REPLAY_LATENCY_SCALE'] = str(args.replay_latency_scale)
+    os.environ['FAKE_LLM_LATENCY'] = str(args.llm_latency)
+    os.environ['FAKE_LLM_TOKENS_PER_SECOND'] = str(args.llm_tokens_per_second)
+    os.environ['FAKE_LLM_RESPONSE_TOKENS'] = str(args.llm_response_tokens)
+
+    from flask_jwt_extended import create_access_token
+    from werkzeug.serving import make_server
+    from src.main import create_app
+    from src.models import ChatMessage, ChatSession, User, db
+
+    app = create_app('testing')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {
+        'config': {
+            'llm_backend': args.llm_backend,
+            'replay_latency_scale': args.replay_latency_scale if args.llm_backend == 'replay' else None,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'llm_latency': args.llm_latency,
+            'llm_tokens_per_second': args.llm_tokens_per_second,
+            'llm_response_tokens': args.llm_response_tokens
+        },
+        'scales': {}
+    }
+    users = []
+
+    try:
+        for scale in args.scales.split(','):
+            user_count, sessions_per_user, messages_per_session = SCALES[scale]
+
+            # Grow the database to this scale
+            with app.app_context():
+                started = time.perf_counter()
+                new_ids = seed_users(db, User, user_count - len(users), PASSWORD, start=len(users))
+                sessions_by_user = seed_history(db, ChatSession, ChatMessage, new_ids, sessions_per_user, messages_per_session)
+                for user in User.query.filter(User.id.in_(new_ids)).all():
+                    users.append({
+                        'email': user.email,
+                        'token': create_access_token(identity=user),
+                        'sessions': sessions_by_user[user.id]
+                    })
+                print(f"[{scale}] seeded {len(users)} users / "
+                      f"{len(users) * sessions_per_user * messages_per_session} messages "
+                      f"in {time.perf_counter() - started:.1f}s")
+
+            results['scales'][scale] = {}
+            for name in args.scenarios.split(','):
+                summary = run_scenario(server.port, make_scenario(name, users), args.concurrency, args.duration, args.seed)
+                results['scales'][scale][name] = summary
+                print(f"[{scale}] {name:<15} {summary['throughput_rps']:>8} req/s  "
+                      f"p50 {summary['p50_ms']:>8} ms  p99 {summary['p99_ms']:>8} ms  errors {summary['errors']}")
+    finally:
+        server.shutdown()
+
+    path = save_results(results, args.output, prefix='loadtest')
+    print(f'Results saved to {path}')
+
+    if args.compare:
+        regressions = print_comparison(results, load_results(args.compare), args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
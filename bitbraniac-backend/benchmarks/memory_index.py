@@ -0,0 +1,120 @@
+"""
+Long-term memory benchmark: incremental index updates, cold loads and
+recall latency for one user with a growing number of snippets.
+
+Snippets are appended in batches the way ``memory_index`` jobs add them,
+then the index is loaded and searched like ``MemoryService.recall``.
+
+    python -m benchmarks.memory_index --sizes 1000,10000,100000 --queries 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize_latencies
+from src.services.memory_service import MemoryStore, embed
+
+
+WORDS = (
+    'hash map binary search tree graph process thread mutex deadlock index query join '
+    'transaction socket packet router compiler parser closure recursion gradient model '
+    'exam project homework lecture python rust java sql linux kernel paging cache memory '
+    'struggle understand build implement debug explain compare prove optimize design'
+).split()
+
+
+def make_snippets(count, sessions, rng):
+    return [
+        {
+            'session_id': rng.choice(sessions),
+            'message_id': str(uuid.uuid4()),
+            'created_at': '2025-01-01T00:00:00',
+            'text': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+        }
+        for _ in range(count)
+    ]
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, files in os.walk(path) for name in files)
+
+
+def run_size(size, args, rng):
+    with tempfile.TemporaryDirectory(prefix='bitbraniac-memory-') as root:
+        store = MemoryStore(root, args.dimensions)
+        user_id = str(uuid.uuid4())
+        sessions = [str(uuid.uuid4()) for _ in range(max(size // 50, 1))]
+
+        append_times, cursor, added = [], None, 0
+        while added < size:
+            batch = make_snippets(min(args.batch, size - added), sessions, rng)
+            previous_cursor, cursor = cursor, {'created_at': '2025-01-01T00:00:00', 'id': str(added)}
+            started = time.perf_counter()
+            store.append(user_id, batch, cursor, previous_cursor)
+            append_times.append(time.perf_counter() - started)
+            added += len(batch)
+
+        load_times = []
+        for _ in range(args.loads):
+            fresh = MemoryStore(root, args.dimensions, cache_size=0)
+            started = time.perf_counter()
+            fresh.get(user_id)
+            load_times.append(time.perf_counter() - started)
+
+        latencies = []
+        started = time.perf_counter()
+        for i in range(args.queries):
+            query_started = time.perf_counter()
+            memory = store.get(user_id)
+            vector = embed([SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]], args.dimensions)[0]
+            memory.search(vector, args.top_k * 3, args.min_similarity)
+            latencies.append(time.perf_counter() - query_started)
+        elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        dropped = store.compact(user_id, set(sessions[::2]))
+        compact_seconds = time.perf_counter() - started
+
+        summary = summarize_latencies(latencies, elapsed)
+        summary.update({
+            'snippets': size,
+            'index_bytes': directory_bytes(root),
+            'append_batch_ms': round(statistics.median(append_times) * 1000, 3),
+            'append_total_ms': round(sum(append_times) * 1000, 2),
+            'load_ms': round(statistics.median(load_times) * 1000, 3),
+            'compact_ms': round(compact_seconds * 1000, 2),
+            'compact_dropped': dropped
+        })
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated snippets per user')
+    parser.add_argument('--batch', type=int, default=100, help='Snippets appended per index update')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--loads', type=int, default=10, help='Cold index loads timed per size')
+    parser.add_argument('--dimensions', type=int, default=1024)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--min-similarity', type=float, default=0.15)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/memory_index-<timestamp>.json)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {key: value for key, value in vars(args).items() if key not in ('output', 'sizes')}
+    for size in (int(value) for value in args.sizes.split(',')):
+        results[f'snippets_{size}'] = run_size(size, args, rng)
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='memory_index')}")
+
+
+if __name__ == '__main__':
+    main()
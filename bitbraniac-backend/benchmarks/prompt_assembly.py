@@ -0,0 +1,172 @@
+"""
+Prompt assembly benchmark: per-turn cost of building the prompt, and how much
+of each prompt repeats the previous turn's prefix (what provider-side prefix
+caching can reuse).
+
+Compares the earlier layout (a ``ChatPromptTemplate`` rendered every turn,
+with course notes in the system message and history rebuilt from dicts) with
+the chatbot's current one, with its history cache cold and warm.
+
+    python -m benchmarks.prompt_assembly --history 0,10,20,40 --turns 2000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import SAMPLE_QUESTIONS, save_results
+
+
+QUESTIONS = SAMPLE_QUESTIONS + (
+    'What causes a deadlock and how do I prevent it?',
+    'How should passwords be stored in a database?',
+    'What is the CAP theorem?',
+)
+
+
+def history_dicts(size):
+    """A conversation as ``get_session_messages_for_memory`` returns it."""
+    return [
+        {'type': 'human' if i % 2 == 0 else 'ai',
+         'content': QUESTIONS[i // 2 % len(QUESTIONS)] if i % 2 == 0 else 'An answer of a few sentences. ' * 12}
+        for i in range(size)
+    ]
+
+
+def to_messages(dicts):
+    from langchain.schema import AIMessage, HumanMessage
+    return [HumanMessage(content=d['content']) if d['type'] == 'human' else AIMessage(content=d['content']) for d in dicts]
+
+
+def template_prompt(system_prompt):
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages([
+        ('system', system_prompt + '{context}'),
+        MessagesPlaceholder(variable_name='chat_history'),
+        ('human', '{input}')
+    ]).partial(context='')
+
+
+def time_per_turn(build, turns, repeats):
+    """Median microseconds per call of ``build(i)`` over ``repeats`` runs of ``turns`` calls."""
+    runs = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for i in range(turns):
+            build(i)
+        runs.append((time.perf_counter() - started) / turns)
+    return round(statistics.median(runs) * 1e6, 2)
+
+
+def serialize(messages):
+    return ''.join(f'{message.type}\0{message.content}\0' for message in messages)
+
+
+def shared_prefix(previous, current):
+    length = 0
+    for a, b in zip(previous, current):
+        if a != b:
+            break
+        length += 1
+    return length
+
+
+def prefix_reuse(conversation, turns):
+    """Share of prompt characters repeating the previous prompt, over a conversation of ``turns`` turns."""
+    reused = total = 0
+    previous = ''
+    for turn in range(turns):
+        current = serialize(conversation(turn))
+        reused += shared_prefix(previous, current)
+        total += len(current)
+        previous = current
+    return round(reused / total, 3)
+
+
+def run(bot, args):
+    from langchain.schema import AIMessage, HumanMessage
+
+    template = template_prompt(bot.system_prompt)
+    contexts = [bot._message_context(question) for question in QUESTIONS]
+    results = {}
+    for size in (int(value) for value in args.history.split(',')):
+        dicts = history_dicts(size)
+        cached = tuple(to_messages(dicts))
+
+        def before(i):
+            return template.invoke({
+                'input': QUESTIONS[i % len(QUESTIONS)],
+                'context': '\n\n' + contexts[i % len(QUESTIONS)],
+                'chat_history': to_messages(dicts)
+            }).to_messages()
+
+        def cold(i):
+            return bot._prompt_messages(QUESTIONS[i % len(QUESTIONS)], to_messages(dicts), contexts[i % len(QUESTIONS)])
+
+        def warm(i):
+            return bot._prompt_messages(QUESTIONS[i % len(QUESTIONS)], cached, contexts[i % len(QUESTIONS)])
+
+        results[f'history_{size}'] = {
+            'template_us': time_per_turn(before, args.turns, args.repeats),
+            'cold_history_us': time_per_turn(cold, args.turns, args.repeats),
+            'cached_history_us': time_per_turn(warm, args.turns, args.repeats)
+        }
+        results[f'history_{size}']['speedup'] = round(
+            results[f'history_{size}']['template_us'] / results[f'history_{size}']['cached_history_us'], 1
+        )
+
+    # One conversation played turn by turn; history grows by each question and answer
+    answer = 'An answer of a few sentences. ' * 12
+
+    def history_until(turn):
+        history = []
+        for earlier in range(turn):
+            history += [HumanMessage(content=QUESTIONS[earlier % len(QUESTIONS)]), AIMessage(content=answer)]
+        return history
+
+    results['prefix_reuse'] = {
+        'template': prefix_reuse(lambda turn: template.invoke({
+            'input': QUESTIONS[turn % len(QUESTIONS)],
+            'context': '\n\n' + contexts[turn % len(QUESTIONS)],
+            'chat_history': history_until(turn)
+        }).to_messages(), args.conversation_turns),
+        'current': prefix_reuse(lambda turn: bot._prompt_messages(
+            QUESTIONS[turn % len(QUESTIONS)], history_until(turn), contexts[turn % len(QUESTIONS)]
+        ), args.conversation_turns)
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', default='0,10,20,40', help='Comma-separated history sizes (messages)')
+    parser.add_argument('--turns', type=int, default=2000, help='Prompts built per timed run')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--conversation-turns', type=int, default=10, help='Turns played for the prefix reuse share')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/prompt_assembly-<timestamp>.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bitbraniac-prompt-')
+    os.environ['TEST_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['RETRIEVAL_INDEX_DIR'] = os.path.join(workdir, 'retrieval')
+    os.environ['RETRIEVAL_AUTO_BUILD'] = 'true'
+
+    from src.main import create_app
+    from src.services.chatbot_service import BitBraniacChatbot
+
+    app = create_app('testing')
+    with app.app_context():
+        bot = BitBraniacChatbot(app.config)
+        results = {key: value for key, value in vars(args).items() if key != 'output'}
+        results.update(run(bot, args))
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='prompt_assembly')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Course notes retrieval benchmark: index build time and size, load time and
+search latency against the retrieval budget.
+
+The course notes can be replicated ``--scale`` times to see how build, load
+and search grow with a larger curriculum.
+
+    python -m benchmarks.retrieval --scale 1,10,100 --queries 5000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import SAMPLE_QUESTIONS, save_results, summarize_latencies
+from src.services.llm_backends import estimate_tokens
+from src.services.retrieval import DEFAULT_COURSE_DIR, RetrievalIndex, build_index
+
+
+QUESTIONS = SAMPLE_QUESTIONS + (
+    'Write a Python function that reverses a linked list.',
+    'Can you explain dynamic programming with the knapsack problem?',
+    'What causes a deadlock and how do I prevent it?',
+    'How should passwords be stored in a database?',
+    'What is the CAP theorem?',
+    'How does gradient descent train a neural network, step by step, and why can a large learning rate diverge?',
+    'thanks!',
+)
+
+
+def replicate_notes(course_dir, target, copies):
+    """Copy the notes ``copies`` times into target, one subdirectory per copy."""
+    for copy in range(copies):
+        shutil.copytree(course_dir, os.path.join(target, f'copy{copy:04d}'))
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, files in os.walk(path) for name in files)
+
+
+def run_scale(course_dir, scale, args):
+    with tempfile.TemporaryDirectory(prefix='bitbraniac-retrieval-') as workdir:
+        notes_dir = os.path.join(workdir, 'course')
+        replicate_notes(course_dir, notes_dir, scale)
+        index_dir = os.path.join(workdir, 'index')
+
+        started = time.perf_counter()
+        meta = build_index(notes_dir, index_dir, args.passage_words)
+        build_seconds = time.perf_counter() - started
+
+        load_times = []
+        for _ in range(args.loads):
+            started = time.perf_counter()
+            index = RetrievalIndex(index_dir, max_query_terms=args.max_query_terms, budget_ms=args.budget_ms)
+            load_times.append(time.perf_counter() - started)
+
+        latencies, notes_tokens, empty = [], [], 0
+        started = time.perf_counter()
+        for i in range(args.queries):
+            query_started = time.perf_counter()
+            passages = index.search(QUESTIONS[i % len(QUESTIONS)], args.top_k, args.min_score)
+            latencies.append(time.perf_counter() - query_started)
+            if passages:
+                notes_tokens.append(sum(estimate_tokens(p.title + p.text) for p in passages))
+            else:
+                empty += 1
+        elapsed = time.perf_counter() - started
+
+        summary = summarize_latencies(latencies, elapsed)
+        over_budget = sum(latency * 1000 > args.budget_ms for latency in latencies)
+        summary.update({
+            'passages': meta['passages'],
+            'terms': meta['terms'],
+            'postings': meta['postings'],
+            'notes_bytes': directory_bytes(notes_dir),
+            'index_bytes': directory_bytes(index_dir),
+            'build_ms': round(build_seconds * 1000, 2),
+            'load_ms': round(statistics.median(load_times) * 1000, 3),
+            'over_budget': over_budget,
+            'within_budget': over_budget == 0,
+            'questions_without_notes': empty,
+            'notes_tokens_mean': round(statistics.mean(notes_tokens), 1) if notes_tokens else 0
+        })
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--course-dir', default=DEFAULT_COURSE_DIR)
+    parser.add_argument('--scale', default='1,10,100', help='Comma-separated number of copies of the notes')
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--loads', type=int, default=20, help='Index loads timed per scale')
+    parser.add_argument('--top-k', type=int, default=2)
+    parser.add_argument('--min-score', type=float, default=4.0)
+    parser.add_argument('--passage-words', type=int, default=120)
+    parser.add_argument('--max-query-terms', type=int, default=32)
+    parser.add_argument('--budget-ms', type=float, default=5.0, help='Per-search latency budget')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/retrieval-<timestamp>.json)')
+    args = parser.parse_args()
+
+    results = {key: value for key, value in vars(args).items() if key not in ('output', 'course_dir', 'scale')}
+    for scale in (int(value) for value in args.scale.split(',')):
+        results[f'scale_{scale}'] = run_scale(args.course_dir, scale, args)
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='retrieval')}")
+
+
+if __name__ == '__main__':
+    main()
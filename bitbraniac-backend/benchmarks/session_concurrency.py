@@ -0,0 +1,178 @@
+"""
+Session concurrency stress test: many tabs sending to the same sessions at
+once, checking that turns of a session never interleave and measuring how
+turns of different sessions overlap.
+
+Each of ``--sessions`` sessions gets ``--tabs`` threads that each send
+``--turns`` messages, all against the fake model. Every prompt the model is
+given is recorded and checked against the session as stored: a turn must see
+exactly the messages of the turns saved before it, and the stored session
+must alternate question and answer. Modes:
+
+- ``striped``: the session locks (``--stripes`` lock files)
+- ``global``: one lock for every session, the only safe option before
+- ``none``: no locking, to show what goes wrong
+
+    python -m benchmarks.session_concurrency --sessions 16 --tabs 4 --turns 5 --llm-latency 0.05
+"""
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from benchmarks.common import save_results, seed_history, seed_users, summarize_latencies
+
+
+TAG_PATTERN = re.compile(r'\[(s\d+-t\d+-m\d+)\]')
+
+
+class _NoLock:
+    def release(self):
+        pass
+
+
+class NoSessionLocks:
+    """Lets every turn through at once."""
+
+    def acquire(self, session_id, turn=None):
+        return _NoLock()
+
+
+def tag_of(text):
+    match = TAG_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def run_mode(app, bot, locks, user_ids, args):
+    from src.models import ChatMessage, ChatSession, db
+
+    # Fresh sessions for every mode
+    with app.app_context():
+        sessions_by_user = seed_history(db, ChatSession, ChatMessage, user_ids, 1, 0)
+    sessions = [(user_id, sessions_by_user[user_id][0]) for user_id in user_ids]
+
+    app.extensions['session_locks'] = locks
+    prompts = []  # (question tag, tags of the questions in its history)
+    prompts_lock = threading.Lock()
+    build_prompt = type(bot)._prompt_messages
+
+    def recording_prompt(message, history, context=''):
+        with prompts_lock:
+            prompts.append((tag_of(message), [tag_of(m.content) for m in history if m.type == 'human']))
+        return build_prompt(bot, message, history, context)
+
+    bot._prompt_messages = recording_prompt
+    latencies, errors = [], []
+    results_lock = threading.Lock()
+
+    def tab(session_number, tab_number):
+        user_id, session_id = sessions[session_number]
+        with app.app_context():
+            for turn_number in range(args.turns):
+                message = f'Explain stacks and queues [s{session_number}-t{tab_number}-m{turn_number}]'
+                started = time.perf_counter()
+                result = bot.chat(message, session_id=session_id, user_id=user_id)
+                elapsed = time.perf_counter() - started
+                with results_lock:
+                    latencies.append(elapsed)
+                    if not result['success']:
+                        errors.append(result.get('error'))
+
+    threads = [
+        threading.Thread(target=tab, args=(s, t))
+        for s in range(len(sessions)) for t in range(args.tabs)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    del bot._prompt_messages
+
+    # A turn must have seen every question saved before its own, and nothing else
+    questions_by_session, malformed = {}, 0
+    with app.app_context():
+        for user_id, session_id in sessions:
+            stored = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at.asc()).all()
+            types = [message.message_type for message in stored]
+            if types != ['user', 'assistant'] * (len(types) // 2) or len(types) % 2:
+                malformed += 1
+            questions_by_session[session_id] = [tag_of(m.content) for m in stored if m.message_type == 'user']
+
+    position = {}
+    for questions in questions_by_session.values():
+        for index, tag in enumerate(questions):
+            position[tag] = (questions, index)
+    stale = sum(
+        1 for tag, history in prompts
+        if tag not in position or history != position[tag][0][:position[tag][1]]
+    )
+
+    summary = summarize_latencies(latencies, elapsed, errors=len(errors))
+    summary.update({
+        'turns': len(latencies),
+        'turns_per_session': args.tabs * args.turns,
+        'sessions_interleaved': malformed,
+        'turns_with_wrong_history': stale,
+        'ordered': malformed == 0 and stale == 0,
+        # One model call at a time per session is the floor for ordered turns
+        'serial_floor_seconds': round(args.tabs * args.turns * args.llm_latency, 2)
+    })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=16)
+    parser.add_argument('--tabs', type=int, default=4, help='Threads sending to each session')
+    parser.add_argument('--turns', type=int, default=5, help='Messages per tab')
+    parser.add_argument('--modes', default='striped,global,none')
+    parser.add_argument('--stripes', type=int, default=4096)
+    parser.add_argument('--llm-latency', type=float, default=0.05)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/session_concurrency-<timestamp>.json)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bitbraniac-sessions-')
+    os.environ['TEST_DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['FAKE_LLM_LATENCY'] = str(args.llm_latency)
+    os.environ['FAKE_LLM_RESPONSE_TOKENS'] = '20'
+    os.environ['FAKE_LLM_TOKENS_PER_SECOND'] = '100000'
+    os.environ['CACHE_RESPONSE_TTL'] = '0'
+    os.environ['MEMORY_ENABLED'] = 'false'
+    os.environ['RETRIEVAL_INDEX_DIR'] = os.path.join(workdir, 'retrieval')
+    # Every turn of a session fits in the window, so each turn's history is checkable
+    os.environ['CONVERSATION_WINDOW_SIZE'] = str(args.tabs * args.turns)
+
+    from src.main import create_app
+    from src.models import User, db
+    from src.routes.chat import get_chatbot
+    from src.services.session_locks import SessionLocks
+
+    app = create_app('testing')
+    with app.app_context():
+        user_ids = seed_users(db, User, args.sessions)
+        bot = get_chatbot()
+
+    lock_tables = {
+        'striped': lambda: SessionLocks(os.path.join(workdir, 'striped'), args.stripes),
+        'global': lambda: SessionLocks(os.path.join(workdir, 'global'), 1),
+        'none': NoSessionLocks
+    }
+    results = {key: value for key, value in vars(args).items() if key != 'output'}
+    for mode in args.modes.split(','):
+        results[mode] = summary = run_mode(app, bot, lock_tables[mode](), user_ids, args)
+        print(f"{mode:<8} {summary['throughput_rps']:>8} turns/s  p50 {summary['p50_ms']:>8} ms  "
+              f"p99 {summary['p99_ms']:>8} ms  ordered {summary['ordered']}")
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='session_concurrency')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Startup benchmark: import time, app creation and first-request latency.
+
+Each sample runs in a fresh interpreter, once with lazy chatbot construction
+(the default) and once with ``CHATBOT_WARMUP=true``. The fake LLM backend is
+used with zero latency so only Python-side startup cost is measured.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import save_results
+
+
+HEAVY_MODULES = ('langchain', 'langchain_core', 'langchain_google_genai')
+
+
+def child():
+    """Measure one cold start and print the timings as JSON."""
+    started = time.perf_counter()
+    from src.main import create_app
+    import_seconds = time.perf_counter() - started
+    heavy_after_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    started = time.perf_counter()
+    app = create_app('testing')
+    create_app_seconds = time.perf_counter() - started
+
+    client = app.test_client()
+    token = client.post('/api/auth/register', json={
+        'email': 'startup@bench.local', 'password': 'benchmark'
+    }).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    started = time.perf_counter()
+    client.get('/api/health')
+    first_health_seconds = time.perf_counter() - started
+
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        response = client.post('/api/chat/message', json={'message': 'What is a heap?'}, headers=headers)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_json()
+
+    print(json.dumps({
+        'import_seconds': import_seconds,
+        'create_app_seconds': create_app_seconds,
+        'first_health_seconds': first_health_seconds,
+        'first_chat_seconds': timings[0],
+        'second_chat_seconds': timings[1],
+        'heavy_modules_after_import': heavy_after_import
+    }))
+
+
+def run_child(warm):
+    env = dict(
+        os.environ,
+        LLM_BACKEND='fake',
+        FAKE_LLM_LATENCY='0',
+        FAKE_LLM_TOKENS_PER_SECOND='0',
+        CHATBOT_WARMUP='true' if warm else 'false'
+    )
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.startup', '--child'],
+        env=env, capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/startup-<timestamp>.json)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    results = {'runs': args.runs}
+    for mode, warm in (('lazy', False), ('warm', True)):
+        samples = [run_child(warm) for _ in range(args.runs)]
+        summary = {
+            key: round(statistics.median(sample[key] for sample in samples) * 1000, 2)
+            for key in ('import_seconds', 'create_app_seconds', 'first_health_seconds',
+                        'first_chat_seconds', 'second_chat_seconds')
+        }
+        summary = {key.replace('_seconds', '_ms'): value for key, value in summary.items()}
+        summary['heavy_modules_after_import'] = samples[0]['heavy_modules_after_import']
+        results[mode] = summary
+
+    print(json.dumps(results, indent=2))
+    print(f"Results saved to {save_results(results, args.output, prefix='startup')}")
+
+
+if __name__ == '__main__':
+    main()
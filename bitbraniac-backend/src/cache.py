@@ -0,0 +1,412 @@
+"""
+Shared cache for BitBraniac application.
+
+The chatbot caches conversation contexts and LLM responses through a small
+``CacheBackend`` interface. ``CACHE_BACKEND`` selects the implementation:
+
+- ``local``: in-process LRU (default; each process has its own copy)
+- ``socket``: an LRU served over a Unix domain socket, so every worker on the
+  host shares one cache (``src/server.py`` runs the cache process)
+- ``none``: caching disabled
+
+Entries can carry a tag. ``invalidate(tag)`` drops every entry with that tag
+and bumps the tag's generation; ``set(..., generation=n)`` only stores the
+value if the tag is still at generation ``n``, so a context loaded before a
+concurrent write can never overwrite the invalidation.
+
+A cache starts at a random epoch, so a restarted cache server never hands
+out a generation a client saw before. If the socket cache cannot deliver an
+invalidation, the client keeps it and sends it again before its next call
+goes through; until then every call falls back to a miss (``generation``
+returns -1). Once the server is back, the reconnect callbacks run so workers
+can drop what they kept from before the outage.
+"""
+
+import json
+import os
+import secrets
+import socket
+import socketserver
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app
+
+
+HEADER = struct.Struct('!I')
+
+# Generations are epoch * EPOCH_SIZE + n; dropping a tag's generation record
+# starts a new epoch so stale generations can never match again
+EPOCH_SIZE = 1 << 32
+
+
+class CacheBackend(ABC):
+    """Interface implemented by all cache backends."""
+
+    @abstractmethod
+    def get(self, key):
+        """Return the cached value or None."""
+
+    @abstractmethod
+    def set(self, key, value, ttl=None, tag=None, generation=None):
+        """Store a value; returns False if the tag moved past ``generation``."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Drop one entry."""
+
+    @abstractmethod
+    def generation(self, tag):
+        """Current generation of a tag."""
+
+    @abstractmethod
+    def invalidate(self, tag):
+        """Drop all entries with the tag; returns its new generation."""
+
+    @abstractmethod
+    def clear(self):
+        """Drop all entries and tag generations."""
+
+    def stats(self):
+        return {}
+
+    def reset(self):
+        """Drop per-process state such as connections (called after fork)."""
+
+    def on_reconnect(self, callback):
+        """Call ``callback()`` when the cache is reachable again after an outage."""
+
+
+class NullCache(CacheBackend):
+    """Cache that stores nothing."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None, tag=None, generation=None):
+        return False
+
+    def delete(self, key):
+        pass
+
+    def generation(self, tag):
+        return 0
+
+    def invalidate(self, tag):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class LocalCache(CacheBackend):
+    """Thread-safe in-process LRU cache with TTLs and tags."""
+
+    def __init__(self, max_entries=10000, default_ttl=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at, tag)
+        self._tags = {}  # tag -> set of keys
+        self._generations = OrderedDict()
+        self._epoch = secrets.randbits(32)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        value, expires_at, tag = self._entries.pop(key)
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def _generation(self, tag):
+        return self._generations.get(tag, self._epoch * EPOCH_SIZE)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._drop(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, tag=None, generation=None):
+        ttl = ttl if ttl is not None else self.default_ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if generation is not None and self._generation(tag) != generation:
+                return False
+
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires_at, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def generation(self, tag):
+        with self._lock:
+            return self._generation(tag)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+            generation = self._generation(tag) + 1
+            self._generations[tag] = generation
+            self._generations.move_to_end(tag)
+            if len(self._generations) > self.max_entries:
+                self._generations.popitem(last=False)
+                self._epoch += 1
+            return generation
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions
+            }
+
+
+def _send(sock, payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError('Cache connection closed')
+    return data
+
+
+def _recv(stream):
+    size, = HEADER.unpack(_recv_exact(stream, HEADER.size))
+    return json.loads(_recv_exact(stream, size))
+
+
+class _CacheRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        cache = self.server.cache
+        while True:
+            try:
+                op, args = _recv(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            try:
+                result = {'ok': True, 'value': getattr(cache, op)(*args)}
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+            _send(self.request, result)
+
+
+class CacheServer(socketserver.ThreadingUnixStreamServer):
+    """Serves a ``LocalCache`` to other processes over a Unix domain socket."""
+
+    daemon_threads = True
+    OPERATIONS = ('get', 'set', 'delete', 'generation', 'invalidate', 'clear', 'stats')
+
+    def __init__(self, path, max_entries=10000):
+        # A previous server on this path (crashed, or an upgrading master) is replaced
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _CacheRequestHandler)
+        os.chmod(path, 0o600)
+        self.path = path
+        self.inode = os.stat(path).st_ino
+        self.cache = _RestrictedCache(LocalCache(max_entries=max_entries), self.OPERATIONS)
+
+    def server_close(self):
+        super().server_close()
+        # Leave the socket alone if a newer server has already taken the path over
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _RestrictedCache:
+    """Exposes only the cache operations clients may call."""
+
+    def __init__(self, cache, operations):
+        self._cache = cache
+        self._operations = operations
+
+    def __getattr__(self, name):
+        if name not in self._operations:
+            raise AttributeError(f"Unknown cache operation: {name}")
+        return getattr(self._cache, name)
+
+
+class SocketCache(CacheBackend):
+    """Client for ``CacheServer``; falls back to cache misses if the server is down."""
+
+    def __init__(self, path, timeout=0.5, retry_interval=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._pending = set()  # tags whose invalidation the server has not acknowledged
+        self._recovering = False
+        self._recover_lock = threading.Lock()
+        self._reconnect_callbacks = []
+
+    def reset(self):
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._recover_lock = threading.Lock()
+
+    def on_reconnect(self, callback):
+        self._reconnect_callbacks.append(callback)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    def _request(self, op, args):
+        """Send one operation; returns the server's reply, or None if it is unavailable."""
+        for attempt in range(2):
+            try:
+                sock, stream = self._connection()
+                _send(sock, [op, args])
+                return _recv(stream)
+            except (OSError, ConnectionError, ValueError) as e:
+                self._close()
+                if attempt:
+                    self._down_until = time.monotonic() + self.retry_interval
+                    self._recovering = True
+                    current_app.logger.warning(f"Cache server unavailable: {str(e)}")
+        return None
+
+    def _recover(self):
+        """Resend the invalidations the server missed; returns False if it is still unavailable."""
+        with self._recover_lock:
+            if not self._recovering:
+                return True
+            for tag in list(self._pending):
+                result = self._request('invalidate', [tag])
+                if result is None or not result['ok']:
+                    return False
+                self._pending.discard(tag)
+            self._recovering = False
+
+        for callback in self._reconnect_callbacks:
+            callback()
+        return True
+
+    def _call(self, op, *args, default=None):
+        if time.monotonic() < self._down_until:
+            return default
+        if self._recovering and not self._recover():
+            return default
+
+        result = self._request(op, args)
+        if result is None:
+            return default
+        if not result['ok']:
+            current_app.logger.error(f"Cache {op} error: {result['error']}")
+            return default
+        return result['value']
+
+    def get(self, key):
+        return self._call('get', key)
+
+    def set(self, key, value, ttl=None, tag=None, generation=None):
+        return self._call('set', key, value, ttl, tag, generation, default=False)
+
+    def delete(self, key):
+        self._call('delete', key)
+
+    def generation(self, tag):
+        # A generation no server hands out, so sets guarded by it are skipped
+        return self._call('generation', tag, default=-1)
+
+    def invalidate(self, tag):
+        generation = self._call('invalidate', tag, default=-1)
+        if generation == -1:
+            # Sent again before the next call; until then every call misses
+            self._pending.add(tag)
+            self._recovering = True
+        return generation
+
+    def clear(self):
+        self._call('clear')
+
+    def stats(self):
+        return self._call('stats', default={})
+
+
+def default_socket_path(app):
+    return app.config.get('CACHE_SOCKET_PATH') or os.path.join(app.instance_path, 'cache.sock')
+
+
+def create_cache(app):
+    """Create the cache backend selected by ``CACHE_BACKEND``."""
+    backend = app.config.get('CACHE_BACKEND', 'local')
+
+    if backend == 'local':
+        return LocalCache(max_entries=app.config['CACHE_MAX_ENTRIES'])
+    if backend == 'socket':
+        return SocketCache(default_socket_path(app), timeout=app.config['CACHE_SOCKET_TIMEOUT'])
+    if backend == 'none':
+        return NullCache()
+
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+def init_cache(app):
+    """Create the app's cache backend."""
+    app.extensions['cache'] = create_cache(app)
+
+
+def get_cache(app=None):
+    """Return the cache backend of the given (or current) app."""
+    app = app or current_app
+    return app.extensions['cache']
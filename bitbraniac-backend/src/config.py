@@ -3,6 +3,7 @@ Configuration module for BitBraniac application.
 """
 
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -30,11 +31,172 @@ class Config:
     MODEL_TEMPERATURE = float(os.getenv('MODEL_TEMPERATURE', '0.8'))
     MAX_OUTPUT_TOKENS = int(os.getenv('MAX_OUTPUT_TOKENS', '8192'))
     
+    # LLM backend: 'google', 'fake' (deterministic local stand-in) or 'replay' (recorded traffic)
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'google')
+    LLM_RECORD_PATH = os.getenv('LLM_RECORD_PATH')  # Record every LLM call to this file when set
+    LLM_REPLAY_PATH = os.getenv('LLM_REPLAY_PATH')
+    LLM_REPLAY_LATENCY_SCALE = float(os.getenv('LLM_REPLAY_LATENCY_SCALE', '1.0'))  # 0 replays instantly
+    FAKE_LLM_LATENCY = float(os.getenv('FAKE_LLM_LATENCY', '0.5'))  # seconds before the first token
+    FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '200'))
+    FAKE_LLM_RESPONSE_TOKENS = int(os.getenv('FAKE_LLM_RESPONSE_TOKENS', '120'))
+    FAKE_LLM_FAILURE_RATE = float(os.getenv('FAKE_LLM_FAILURE_RATE', '0'))  # share of calls failing with a 503
+    FAKE_LLM_TAIL_RATE = float(os.getenv('FAKE_LLM_TAIL_RATE', '0'))  # share of calls waiting FAKE_LLM_TAIL_LATENCY
+    FAKE_LLM_TAIL_LATENCY = float(os.getenv('FAKE_LLM_TAIL_LATENCY', '5'))
+    
+    # Model routing: messages are sorted into light / standard / deep tiers, each
+    # with its own model, output budget and temperature
+    ROUTING_ENABLED = os.getenv('ROUTING_ENABLED', 'True').lower() == 'true'
+    ROUTING_LIGHT_MAX_WORDS = int(os.getenv('ROUTING_LIGHT_MAX_WORDS', '8'))  # longest small talk message sent to the light tier
+    ROUTING_DEEP_MIN_WORDS = int(os.getenv('ROUTING_DEEP_MIN_WORDS', '80'))
+    ROUTING_DEEP_MIN_HISTORY = int(os.getenv('ROUTING_DEEP_MIN_HISTORY', '16'))  # messages in the conversation; 0 disables
+    ROUTING_LIGHT_MODEL = os.getenv('ROUTING_LIGHT_MODEL', 'gemini-2.0-flash-lite')
+    ROUTING_LIGHT_MAX_TOKENS = int(os.getenv('ROUTING_LIGHT_MAX_TOKENS', '512'))
+    ROUTING_LIGHT_TEMPERATURE = float(os.getenv('ROUTING_LIGHT_TEMPERATURE', '0.7'))
+    ROUTING_STANDARD_MODEL = os.getenv('ROUTING_STANDARD_MODEL')  # unset: MODEL_NAME
+    ROUTING_STANDARD_MAX_TOKENS = int(os.getenv('ROUTING_STANDARD_MAX_TOKENS', os.getenv('MAX_OUTPUT_TOKENS', '8192')))
+    ROUTING_STANDARD_TEMPERATURE = float(os.getenv('ROUTING_STANDARD_TEMPERATURE', os.getenv('MODEL_TEMPERATURE', '0.8')))
+    ROUTING_DEEP_MODEL = os.getenv('ROUTING_DEEP_MODEL')  # unset: MODEL_NAME
+    ROUTING_DEEP_MAX_TOKENS = int(os.getenv('ROUTING_DEEP_MAX_TOKENS', os.getenv('MAX_OUTPUT_TOKENS', '8192')))
+    ROUTING_DEEP_TEMPERATURE = float(os.getenv('ROUTING_DEEP_TEMPERATURE', os.getenv('MODEL_TEMPERATURE', '0.8')))
+    
+    # Course material retrieval: the best matching passages of the course notes are
+    # put in the prompt, which replaces the long static system prompt
+    RETRIEVAL_ENABLED = os.getenv('RETRIEVAL_ENABLED', 'True').lower() == 'true'
+    RETRIEVAL_COURSE_DIR = os.getenv('RETRIEVAL_COURSE_DIR')  # Defaults to bitbraniac-backend/course
+    RETRIEVAL_INDEX_DIR = os.getenv('RETRIEVAL_INDEX_DIR')  # Defaults to <instance_path>/retrieval
+    RETRIEVAL_AUTO_BUILD = os.getenv('RETRIEVAL_AUTO_BUILD', 'False').lower() == 'true'  # (re)build at startup if missing or stale
+    RETRIEVAL_PASSAGE_WORDS = int(os.getenv('RETRIEVAL_PASSAGE_WORDS', '120'))  # passage size the notes are split into
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '2'))  # passages per question
+    RETRIEVAL_MIN_SCORE = float(os.getenv('RETRIEVAL_MIN_SCORE', '4.0'))  # BM25 score below which a passage is left out
+    RETRIEVAL_MAX_QUERY_TERMS = int(os.getenv('RETRIEVAL_MAX_QUERY_TERMS', '32'))  # rarest terms of long questions searched
+    RETRIEVAL_BUDGET_MS = float(os.getenv('RETRIEVAL_BUDGET_MS', '5'))  # slower searches are counted in the metrics
+    
+    # Long-term memory: snippets of a user's earlier sessions recalled into new ones
+    MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', 'True').lower() == 'true'
+    MEMORY_DIR = os.getenv('MEMORY_DIR')  # Defaults to <instance_path>/memory
+    MEMORY_DIMENSIONS = int(os.getenv('MEMORY_DIMENSIONS', '1024'))  # width of the hashed snippet vectors
+    MEMORY_MIN_WORDS = int(os.getenv('MEMORY_MIN_WORDS', '5'))  # shorter messages are not remembered
+    MEMORY_SNIPPET_CHARS = int(os.getenv('MEMORY_SNIPPET_CHARS', '400'))
+    MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))  # snippets recalled per message
+    MEMORY_MIN_SIMILARITY = float(os.getenv('MEMORY_MIN_SIMILARITY', '0.15'))  # cosine similarity
+    MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '250'))  # prompt tokens spent on recalled snippets
+    MEMORY_INDEX_DELAY = float(os.getenv('MEMORY_INDEX_DELAY', '10'))  # seconds for messages to collect before indexing
+    MEMORY_INDEX_BATCH_SIZE = int(os.getenv('MEMORY_INDEX_BATCH_SIZE', '20'))  # users updated per job run
+    MEMORY_CACHE_USERS = int(os.getenv('MEMORY_CACHE_USERS', '256'))  # loaded user indexes kept per process
+    
+    # Per-user token accounting and daily quotas (0 = unlimited)
+    USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '30'))  # seconds between writes of the in-memory counters
+    USAGE_DAILY_TOKEN_QUOTA = int(os.getenv('USAGE_DAILY_TOKEN_QUOTA', '0'))  # prompt + completion tokens per user per UTC day
+    USAGE_DAILY_REQUEST_QUOTA = int(os.getenv('USAGE_DAILY_REQUEST_QUOTA', '0'))  # model calls per user per UTC day
+    USAGE_ANONYMOUS_DAILY_TOKEN_QUOTA = int(os.getenv('USAGE_ANONYMOUS_DAILY_TOKEN_QUOTA', '0'))  # shared by all guests per UTC day
+    USAGE_ANONYMOUS_DAILY_REQUEST_QUOTA = int(os.getenv('USAGE_ANONYMOUS_DAILY_REQUEST_QUOTA', '0'))
+    USAGE_MAX_HISTORY_DAYS = int(os.getenv('USAGE_MAX_HISTORY_DAYS', '366'))
+    
+    # LLM client resilience (retries, circuit breaker, hedged requests)
+    LLM_RESILIENCE_ENABLED = os.getenv('LLM_RESILIENCE_ENABLED', 'True').lower() == 'true'
+    LLM_RETRY_ATTEMPTS = int(os.getenv('LLM_RETRY_ATTEMPTS', '3'))  # attempts per call, including the first
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+    LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '8'))
+    LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '30'))  # seconds per provider call; attempts together fit in CHAT_TURN_TIMEOUT
+    LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))  # consecutive failures; 0 disables
+    LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', '30'))  # open time before a probe call
+    LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+    LLM_HEDGE_QUANTILE = float(os.getenv('LLM_HEDGE_QUANTILE', '0.95'))  # of recent first-token latencies
+    LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1.0'))  # seconds; also used until enough samples
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+    
+    # Build the chatbot in create_app instead of on the first chat request
+    CHATBOT_WARMUP = os.getenv('CHATBOT_WARMUP', 'False').lower() == 'true'
+    
     # Conversation settings
     CONVERSATION_WINDOW_SIZE = int(os.getenv('CONVERSATION_WINDOW_SIZE', '10'))
+    PROMPT_HISTORY_CACHE_SESSIONS = int(os.getenv('PROMPT_HISTORY_CACHE_SESSIONS', '256'))  # sessions whose history messages are kept per process
+    CHAT_TURN_TIMEOUT = float(os.getenv('CHAT_TURN_TIMEOUT', '120'))  # seconds a message may take to answer
+    CHAT_CANCEL_POLL_INTERVAL = float(os.getenv('CHAT_CANCEL_POLL_INTERVAL', '0.5'))  # seconds between cancellation checks
+    CHAT_SAVE_PARTIAL_RESPONSES = os.getenv('CHAT_SAVE_PARTIAL_RESPONSES', 'False').lower() == 'true'
+    CHAT_BATCH_MAX_QUESTIONS = int(os.getenv('CHAT_BATCH_MAX_QUESTIONS', '50'))  # per POST /api/chat/batch
+    CHAT_BATCH_CONCURRENCY = int(os.getenv('CHAT_BATCH_CONCURRENCY', '8'))  # model calls in flight per batch
+    SESSION_LOCK_DIR = os.getenv('SESSION_LOCK_DIR')  # Defaults to <instance_path>/session-locks
+    SESSION_LOCK_STRIPES = int(os.getenv('SESSION_LOCK_STRIPES', '4096'))  # lock files sessions are hashed onto
     
     # CORS settings
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*')
+    
+    # Production server settings (src/server.py)
+    SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(os.cpu_count() or 2)))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # request threads per worker
+    SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '1024'))
+    # Seconds to finish in-flight requests; longer than a chat turn may take
+    SERVER_GRACEFUL_TIMEOUT = float(os.getenv('SERVER_GRACEFUL_TIMEOUT', str(CHAT_TURN_TIMEOUT + 30)))
+    SERVER_KEEPALIVE_TIMEOUT = int(os.getenv('SERVER_KEEPALIVE_TIMEOUT', '5'))  # idle keep-alive connections are closed after this
+    
+    # Static frontend serving
+    STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', '3600'))  # seconds, for files without a content hash
+    STATIC_MEMORY_MAX_FILE_BYTES = int(os.getenv('STATIC_MEMORY_MAX_FILE_BYTES', str(4 * 1024 * 1024)))
+    STATIC_ZSTD_LEVEL = int(os.getenv('STATIC_ZSTD_LEVEL', '19'))
+    
+    # Shared cache for conversation contexts and LLM responses
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local')  # 'local', 'socket' (shared by all workers) or 'none'
+    CACHE_SOCKET_PATH = os.getenv('CACHE_SOCKET_PATH')  # Defaults to <instance_path>/cache.sock
+    CACHE_SOCKET_TIMEOUT = float(os.getenv('CACHE_SOCKET_TIMEOUT', '0.5'))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+    CACHE_CONTEXT_TTL = int(os.getenv('CACHE_CONTEXT_TTL', '600'))
+    CACHE_RESPONSE_TTL = int(os.getenv('CACHE_RESPONSE_TTL', '3600'))  # 0 disables response caching
+    
+    # Metrics settings
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_DIR = os.getenv('METRICS_DIR')  # per-process snapshots merged by /api/metrics; src/server.py defaults it to <instance_path>/metrics
+    METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', '5'))  # seconds between snapshots
+    
+    # Retention settings (purge of soft-deleted sessions)
+    RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'True').lower() == 'true'
+    RETENTION_GRACE_DAYS = int(os.getenv('RETENTION_GRACE_DAYS', '7'))
+    RETENTION_INTERVAL_SECONDS = int(os.getenv('RETENTION_INTERVAL_SECONDS', '3600'))
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+    RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '0.05'))  # seconds between batches
+    RETENTION_VACUUM_PAGES = int(os.getenv('RETENTION_VACUUM_PAGES', '256'))  # pages released per vacuum step
+    RETENTION_LOCK_PATH = os.getenv('RETENTION_LOCK_PATH')  # Defaults to <instance_path>/retention.lock
+    
+    # Delta sync change log
+    CHANGES_PAGE_SIZE = int(os.getenv('CHANGES_PAGE_SIZE', '500'))  # max changes returned per request
+    CHANGES_RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', '30'))  # older clients must reload in full
+    
+    # Session titles: the first user message, optionally replaced by a model-written summary
+    TITLE_SUMMARY_ENABLED = os.getenv('TITLE_SUMMARY_ENABLED', 'False').lower() == 'true'
+    TITLE_MODEL_NAME = os.getenv('TITLE_MODEL_NAME', 'gemini-2.0-flash-lite')
+    TITLE_BATCH_SIZE = int(os.getenv('TITLE_BATCH_SIZE', '20'))  # sessions titled per model call
+    TITLE_BATCH_WAIT = float(os.getenv('TITLE_BATCH_WAIT', '2.0'))  # seconds to wait for a batch to fill
+    
+    # Background jobs
+    JOBS_ENABLED = os.getenv('JOBS_ENABLED', 'True').lower() == 'true'
+    JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', '2'))  # job threads per process
+    JOBS_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '1.0'))  # seconds between checks for due jobs
+    JOBS_LEASE_SECONDS = int(os.getenv('JOBS_LEASE_SECONDS', '300'))  # running jobs older than this are retried
+    JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', '5'))
+    JOBS_RETRY_BASE_DELAY = float(os.getenv('JOBS_RETRY_BASE_DELAY', '5'))  # seconds, doubled on each attempt
+    JOBS_RETRY_MAX_DELAY = float(os.getenv('JOBS_RETRY_MAX_DELAY', '600'))
+    JOBS_FAILED_RETENTION_DAYS = int(os.getenv('JOBS_FAILED_RETENTION_DAYS', '7'))
+    
+    # Session event stream (/api/sessions/events)
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.5'))  # seconds; how soon other workers' changes arrive
+    EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+    EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '64'))  # events a slow client may fall behind before it is disconnected
+    EVENTS_WRITE_TIMEOUT = float(os.getenv('EVENTS_WRITE_TIMEOUT', '10'))
+    EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', '3000'))  # client reconnect delay
+    
+    # Cold-storage archival of idle sessions
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'True').lower() == 'true'
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '7'))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR')  # Defaults to <instance_path>/archive
+    ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', str(64 * 1024 * 1024)))
+    ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', '3'))
+    ARCHIVE_COMPACT_MIN_LIVE_RATIO = float(os.getenv('ARCHIVE_COMPACT_MIN_LIVE_RATIO', '0.5'))  # segments with less live data are rewritten
+    
+    # History export/import settings
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))  # rows fetched per cursor batch
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))  # rows inserted per transaction
 
 
 class DevelopmentConfig(Config):
@@ -53,7 +215,16 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Testing configuration."""
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # In-memory database for testing
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite:///:memory:')  # In-memory database by default
+    RETENTION_ENABLED = False
+    JOBS_ENABLED = False
+    # Keep files written by test apps out of the instance folder
+    TEST_DATA_DIR = os.getenv('TEST_DATA_DIR', os.path.join(tempfile.gettempdir(), 'bitbraniac-test'))
+    RETRIEVAL_INDEX_DIR = os.getenv('RETRIEVAL_INDEX_DIR', os.path.join(TEST_DATA_DIR, 'retrieval'))
+    MEMORY_DIR = os.getenv('MEMORY_DIR', os.path.join(TEST_DATA_DIR, 'memory'))
+    SESSION_LOCK_DIR = os.getenv('SESSION_LOCK_DIR', os.path.join(TEST_DATA_DIR, 'session-locks'))
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(TEST_DATA_DIR, 'archive'))
+    RETENTION_LOCK_PATH = os.getenv('RETENTION_LOCK_PATH', os.path.join(TEST_DATA_DIR, 'retention.lock'))
 
 
 # Configuration dictionary
@@ -0,0 +1,264 @@
+"""
+Session event stream for BitBraniac application.
+
+Clients keep one server-sent events connection open (``GET /api/sessions/events``)
+and receive their session changes as they happen instead of polling
+``/api/sessions/changes``. Every event carries the change log watermark as its
+id, so a reconnecting client sends ``Last-Event-ID`` and is caught up from the
+change log before live events resume.
+
+Each process runs one ``EventBroker``. A single poller thread follows the
+change log (so writes made by other workers are seen within
+``EVENTS_POLL_INTERVAL``; writes made in this process wake it immediately),
+builds one delta per subscribed user and fans it out to that user's
+connections.
+
+Under ``src/server.py`` an open stream does not hold a request thread: once
+its headers and catch-up events are written, the connection is handed to the
+worker's asyncio loop, which keeps thousands of idle streams alive with
+heartbeats on one thread. Elsewhere (the development server) each stream is
+served by its request thread.
+
+A connection whose client falls ``EVENTS_QUEUE_SIZE`` events behind, or does
+not accept a write within ``EVENTS_WRITE_TIMEOUT`` seconds, is closed; the
+client reconnects with its last event id and catches up from the change log.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+from flask import current_app
+from .models import SessionChange, db
+from .services.change_log_service import ChangeLogService
+
+
+HEARTBEAT = b': ping\n\n'
+CLOSE = None  # queued to end a stream
+
+
+def format_event(data, event=None, event_id=None):
+    """Encode one server-sent event."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class ThreadSubscriber:
+    """Stream consumed by a request thread."""
+
+    def __init__(self, user_id, max_queued):
+        self.user_id = user_id
+        self.queue = queue.Queue(max_queued)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Too far behind: drop the backlog and end the stream
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(CLOSE)
+
+    def get(self, timeout):
+        """Next event, or HEARTBEAT if nothing arrived within the timeout."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return HEARTBEAT
+
+
+class AsyncSubscriber:
+    """Stream served from the event loop of an ``EventStreamLoop``."""
+
+    def __init__(self, user_id, max_queued, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queued)
+
+    def offer(self, event):
+        self.loop.call_soon_threadsafe(self._offer, event)
+
+    def _offer(self, event):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = CLOSE
+        self.queue.put_nowait(event)
+
+
+class EventStreamLoop:
+    """asyncio loop on a daemon thread that serves detached event streams."""
+
+    def __init__(self, broker, heartbeat, write_timeout):
+        self.broker = broker
+        self.heartbeat = heartbeat
+        self.write_timeout = write_timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='bitbraniac-events', daemon=True)
+        self.thread.start()
+
+    def attach(self, sock, chunked, subscriber):
+        """Take over a connection whose response headers have been sent."""
+        asyncio.run_coroutine_threadsafe(self._serve(sock, chunked, subscriber), self.loop)
+
+    async def _serve(self, sock, chunked, subscriber):
+        writer = None
+        closed = None
+        try:
+            sock.setblocking(False)
+            reader, writer = await asyncio.open_connection(sock=sock)
+            # The client sends nothing more, so readable means it went away
+            closed = asyncio.ensure_future(reader.read())
+
+            while not closed.done():
+                next_event = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait((next_event, closed), timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if next_event not in done:
+                    next_event.cancel()
+                    event = HEARTBEAT
+                else:
+                    event = next_event.result()
+                if closed.done() or event is CLOSE:
+                    break
+
+                writer.write(b'%x\r\n%s\r\n' % (len(event), event) if chunked else event)
+                await asyncio.wait_for(writer.drain(), self.write_timeout)
+
+            if chunked and not closed.done():
+                writer.write(b'0\r\n\r\n')
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.broker.unsubscribe(subscriber)
+            if closed is not None:
+                if closed.done() and not closed.cancelled():
+                    closed.exception()  # retrieved so asyncio doesn't log it
+                closed.cancel()
+            if writer is not None:
+                writer.close()
+            else:
+                sock.close()
+
+
+class EventBroker:
+    """Follows the change log and fans deltas out to subscribed connections."""
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.position = None
+        self.stream_loop = None
+        self._subscribers = {}  # user_id -> set of subscribers
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._poller = None
+
+    def subscribe(self, user_id, detachable=False):
+        """Register a connection for a user; must be called within an app context."""
+        with self._lock:
+            if self._poller is None:
+                # Read the position here, before the caller catches up from the
+                # change log, so no entry falls between catch-up and live events
+                self.position = ChangeLogService.latest_seq()
+                self._poller = threading.Thread(target=self._poll, name='bitbraniac-events-poller', daemon=True)
+                self._poller.start()
+
+            max_queued = self.config['EVENTS_QUEUE_SIZE']
+            if detachable:
+                if self.stream_loop is None:
+                    self.stream_loop = EventStreamLoop(
+                        self, self.config['EVENTS_HEARTBEAT_SECONDS'], self.config['EVENTS_WRITE_TIMEOUT']
+                    )
+                subscriber = AsyncSubscriber(user_id, max_queued, self.stream_loop.loop)
+            else:
+                subscriber = ThreadSubscriber(user_id, max_queued)
+
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.user_id]
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def notify(self):
+        """Check the change log now instead of at the next poll."""
+        self._wake.set()
+
+    def _poll(self):
+        interval = self.config['EVENTS_POLL_INTERVAL']
+        batch_size = self.config['CHANGES_PAGE_SIZE']
+
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+
+            with self.app.app_context():
+                try:
+                    while self._dispatch(batch_size) == batch_size:
+                        pass
+                except Exception as e:
+                    current_app.logger.error(f"Event poll error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+    def _dispatch(self, batch_size):
+        """Publish the next batch of change log entries; returns how many were read."""
+        changes = SessionChange.query.filter(
+            SessionChange.seq > self.position
+        ).order_by(SessionChange.seq.asc()).limit(batch_size).all()
+        if not changes:
+            return 0
+        self.position = changes[-1].seq
+
+        with self._lock:
+            subscribed = {user_id: list(subscribers) for user_id, subscribers in self._subscribers.items()}
+
+        by_user = {}
+        for change in changes:
+            if change.user_id in subscribed:
+                by_user.setdefault(change.user_id, []).append(change)
+
+        # One payload per user, however many of their connections are open
+        for user_id, user_changes in by_user.items():
+            delta = ChangeLogService.build_delta(user_id, user_changes)
+            delta['watermark'] = user_changes[-1].seq
+            event = format_event(delta, event='changes', event_id=delta['watermark'])
+            for subscriber in subscribed[user_id]:
+                subscriber.offer(event)
+
+        return len(changes)
+
+
+def init_events(app):
+    """Create the app's event broker; its threads start with the first subscriber."""
+    app.extensions['event_broker'] = EventBroker(app)
+
+
+def get_event_broker(app=None):
+    """Return the event broker of the given (or current) app."""
+    app = app or current_app
+    return app.extensions['event_broker']
+
+
+def notify_session_change():
+    """Wake the event broker after committing a change log entry."""
+    broker = current_app.extensions.get('event_broker')
+    if broker is not None:
+        broker.notify()
@@ -8,15 +8,24 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
 
 from src.config import config
 from src.models import init_db
 from src.auth import init_jwt
-from src.routes.chat import chat_bp
+from src.cache import init_cache
+from src.events import init_events
+from src.metrics import init_metrics
+from src.static_files import init_static
+from src.routes.chat import chat_bp, warm_chatbot
 from src.routes.auth import auth_bp
 from src.routes.sessions import sessions_bp
+from src.services.retention_service import init_retention
+from src.services.job_service import init_jobs
+from src.services.usage_service import init_usage
+from src.services.retrieval import init_retrieval
+from src.services.session_locks import init_session_locks
 
 
 def create_app(config_name=None):
@@ -32,7 +41,15 @@ def create_app(config_name=None):
     # Initialize extensions
     CORS(app, origins=app.config['CORS_ORIGINS'])
     init_db(app)
+    init_metrics(app)
     init_jwt(app)
+    init_cache(app)
+    init_events(app)
+    init_retention(app)
+    init_jobs(app)
+    init_usage(app)
+    init_retrieval(app)
+    init_session_locks(app)
     
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -51,21 +68,10 @@ def create_app(config_name=None):
         }
     
     # Serve React frontend (if built files are present)
-    @app.route('/', defaults={'path': ''})
-    @app.route('/<path:path>')
-    def serve(path):
-        static_folder_path = app.static_folder
-        if static_folder_path is None:
-            return "Static folder not configured", 404
-
-        if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-            return send_from_directory(static_folder_path, path)
-        else:
-            index_path = os.path.join(static_folder_path, 'index.html')
-            if os.path.exists(index_path):
-                return send_from_directory(static_folder_path, 'index.html')
-            else:
-                return "index.html not found", 404
+    init_static(app)
+    
+    if app.config.get('CHATBOT_WARMUP'):
+        warm_chatbot(app)
     
     return app
 
@@ -0,0 +1,469 @@
+"""
+Metrics for BitBraniac application.
+
+A small in-process registry of counters and histograms exposed in the
+Prometheus text format at ``/api/metrics``. Request timing, per-request
+database query counts/time and LLM call time are recorded per endpoint.
+
+With ``METRICS_DIR`` set (``src/server.py`` does), every process writes its
+samples to ``<METRICS_DIR>/<pid>.json`` every ``METRICS_SNAPSHOT_INTERVAL``
+seconds, and ``/api/metrics`` renders the samples of all live processes with
+a ``pid`` label, whichever worker serves the scrape.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from .models import db
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add_label(sample, name, value):
+    """Add a label to a rendered sample line."""
+    series, _, sample_value = sample.rpartition(' ')
+    label = f'{name}="{_escape(value)}"'
+    if series.endswith('}'):
+        series = f'{series[:-1]},{label}}}'
+    else:
+        series = f'{series}{{{label}}}'
+    return f'{series} {sample_value}'
+
+
+class Counter:
+    """Monotonically increasing counter with optional labels."""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+
+
+class Gauge:
+    """Value that can go up and down, set directly or read from a function at scrape time."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Collect from ``function()``, which returns {label value tuple: value}."""
+        self._function = function
+
+    def collect(self):
+        if self._function is not None:
+            values = self._function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """Cumulative histogram with optional labels."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label tuple -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the enclosed block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                labels = _format_labels(self.label_names, key, ('le', _format_value(float(bound))))
+                yield f'{self.name}_bucket{labels} {count}'
+            yield f'{self.name}_bucket{_format_labels(self.label_names, key, ("le", "+Inf"))} {values[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(values[-2])}'
+            yield f'{self.name}_count{_format_labels(self.label_names, key)} {values[-1]}'
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering (e.g. several apps in one process) returns the existing metric
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def samples(self):
+        """This process's sample lines per metric name."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: list(metric.collect()) for metric in metrics}
+
+    def render(self, snapshots=None):
+        """Render all metrics in the Prometheus text exposition format.
+
+        With ``snapshots`` ({pid: samples()}), render those samples instead
+        of this process's, each labelled with its pid.
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            if snapshots is None:
+                lines.extend(metric.collect())
+                continue
+            for pid, samples in sorted(snapshots.items()):
+                lines.extend(_add_label(sample, 'pid', pid) for sample in samples.get(metric.name, ()))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    'bitbraniac_http_request_duration_seconds',
+    'Time spent handling HTTP requests.',
+    ('endpoint', 'method', 'status')
+)
+REQUEST_DB_QUERIES = registry.histogram(
+    'bitbraniac_http_request_db_queries',
+    'Number of database queries issued per HTTP request.',
+    ('endpoint',),
+    COUNT_BUCKETS
+)
+REQUEST_DB_DURATION = registry.histogram(
+    'bitbraniac_http_request_db_duration_seconds',
+    'Time spent in database queries per HTTP request.',
+    ('endpoint',)
+)
+REQUEST_LLM_DURATION = registry.histogram(
+    'bitbraniac_http_request_llm_duration_seconds',
+    'Time spent waiting on the LLM per HTTP request.',
+    ('endpoint',)
+)
+REQUEST_APP_DURATION = registry.histogram(
+    'bitbraniac_http_request_app_duration_seconds',
+    'Time spent outside the database and LLM (routing, serialization) per HTTP request.',
+    ('endpoint',)
+)
+LLM_CALL_DURATION = registry.histogram(
+    'bitbraniac_llm_call_duration_seconds',
+    'Duration of individual LLM chain invocations.',
+    ('endpoint',)
+)
+LLM_TIER_DURATION = registry.histogram(
+    'bitbraniac_llm_tier_duration_seconds',
+    'Duration of chat model calls per routing tier.',
+    ('tier',)
+)
+ROUTING_DECISIONS = registry.counter(
+    'bitbraniac_routing_decisions_total',
+    'Chat messages routed to each model tier, by the rule that decided it.',
+    ('tier', 'reason')
+)
+LLM_TOKENS = registry.counter(
+    'bitbraniac_llm_tokens_total',
+    'Tokens used by chat model calls, by kind (prompt, completion).',
+    ('kind',)
+)
+QUOTA_REJECTIONS = registry.counter(
+    'bitbraniac_quota_rejections_total',
+    'Chat messages refused because the user reached a daily quota.',
+    ('quota',)
+)
+LLM_ATTEMPTS = registry.counter(
+    'bitbraniac_llm_attempts_total',
+    'Calls to the LLM provider by role (first, retry, hedge) and outcome (success, transient_error, error, abandoned).',
+    ('model', 'role', 'outcome')
+)
+LLM_ATTEMPT_DURATION = registry.histogram(
+    'bitbraniac_llm_attempt_duration_seconds',
+    'Time from starting an LLM attempt to its first token, failure or abandonment.',
+    ('model', 'role', 'outcome')
+)
+LLM_CIRCUIT_STATE = registry.gauge(
+    'bitbraniac_llm_circuit_state',
+    'LLM circuit breaker state (0 closed, 1 half-open, 2 open).',
+    ('model',)
+)
+LLM_CIRCUIT_REJECTIONS = registry.counter(
+    'bitbraniac_llm_circuit_rejections_total',
+    'LLM calls refused because the circuit breaker was open.',
+    ('model',)
+)
+RETRIEVAL_DURATION = registry.histogram(
+    'bitbraniac_retrieval_duration_seconds',
+    'Time spent searching the course notes index per question.',
+    (),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+RETRIEVAL_OVER_BUDGET = registry.counter(
+    'bitbraniac_retrieval_over_budget_total',
+    'Course notes searches that took longer than RETRIEVAL_BUDGET_MS.'
+)
+MEMORY_RECALL_DURATION = registry.histogram(
+    'bitbraniac_memory_recall_duration_seconds',
+    'Time spent recalling snippets from a user\'s earlier sessions per message.',
+    (),
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+SESSION_LOCK_WAIT = registry.histogram(
+    'bitbraniac_session_lock_wait_seconds',
+    'Time a turn waited for the previous turn of its session to finish.',
+    (),
+    (0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+CACHE_REQUESTS = registry.counter(
+    'bitbraniac_cache_requests_total',
+    'Cache lookups by kind and result.',
+    ('kind', 'result')
+)
+JOB_QUEUE_DEPTH = registry.gauge(
+    'bitbraniac_job_queue_depth',
+    'Background jobs in the job table by kind and status.',
+    ('kind', 'status')
+)
+JOBS_PROCESSED = registry.counter(
+    'bitbraniac_jobs_processed_total',
+    'Background jobs run by kind and outcome (done, retry, failed).',
+    ('kind', 'outcome')
+)
+JOB_DURATION = registry.histogram(
+    'bitbraniac_job_duration_seconds',
+    'Time spent running a batch of background jobs.',
+    ('kind',)
+)
+
+
+def _endpoint_label():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+@contextmanager
+def track_llm_time():
+    """Time an LLM call and attribute it to the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        LLM_CALL_DURATION.observe(elapsed, endpoint=_endpoint_label())
+        if has_request_context():
+            g.metrics_llm_time = g.get('metrics_llm_time', 0.0) + elapsed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context():
+        g.metrics_db_queries = g.get('metrics_db_queries', 0) + 1
+        g.metrics_db_time = g.get('metrics_db_time', 0.0) + elapsed
+
+
+class SnapshotWriter:
+    """Writes this process's samples under a directory shared by all workers."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the writer thread once per process (after any fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name='metrics-snapshots', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception:
+                pass  # the next snapshot will try again
+
+    def write(self):
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(registry.samples(), f)
+        os.replace(tmp_path, path)
+
+    def read_all(self):
+        """Samples of every live process, by pid; snapshots of exited processes are removed."""
+        snapshots = {os.getpid(): registry.samples()}
+        for name in os.listdir(self.directory):
+            pid, ext = os.path.splitext(name)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    snapshots[int(pid)] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+
+def init_metrics(app):
+    """Register request timing hooks, database event hooks and the metrics endpoint."""
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        endpoint = _endpoint_label()
+        db_time = g.get('metrics_db_time', 0.0)
+        llm_time = g.get('metrics_llm_time', 0.0)
+
+        REQUEST_DURATION.observe(elapsed, endpoint=endpoint, method=request.method, status=str(response.status_code))
+        REQUEST_DB_QUERIES.observe(g.get('metrics_db_queries', 0), endpoint=endpoint)
+        REQUEST_DB_DURATION.observe(db_time, endpoint=endpoint)
+        REQUEST_LLM_DURATION.observe(llm_time, endpoint=endpoint)
+        REQUEST_APP_DURATION.observe(max(elapsed - db_time - llm_time, 0.0), endpoint=endpoint)
+        return response
+
+    def snapshot_writer():
+        directory = app.config.get('METRICS_DIR')
+        if not directory:
+            return None
+        writer = app.extensions.get('metrics_snapshots')
+        if writer is None:
+            writer = SnapshotWriter(directory, app.config['METRICS_SNAPSHOT_INTERVAL'])
+            app.extensions['metrics_snapshots'] = writer
+        return writer
+
+    @app.before_request
+    def start_snapshots():
+        writer = snapshot_writer()
+        if writer is not None:
+            writer.ensure_started()
+
+    @app.route('/api/metrics')
+    def metrics():
+        writer = snapshot_writer()
+        snapshots = writer.read_all() if writer is not None else None
+        return Response(registry.render(snapshots), mimetype='text/plain; version=0.0.4')
@@ -3,6 +3,7 @@ Database models for BitBraniac application.
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import uuid
@@ -48,6 +49,9 @@ class ChatSession(db.Model):
     """Chat session model to group related messages."""
     
     __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        db.Index('ix_chat_sessions_user_active_updated', 'user_id', 'is_active', 'updated_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -59,8 +63,14 @@ class ChatSession(db.Model):
     # Relationship to messages
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self, include_messages=False):
+    # Cold-storage location when the messages have been archived
+    archive = db.relationship('SessionArchive', uselist=False, lazy='joined', cascade='all, delete-orphan')
+    
+    def to_dict(self, include_messages=False, message_count=None):
         """Convert chat session object to dictionary."""
+        if message_count is None:
+            message_count = self.archive.message_count if self.archive else len(self.messages)
+        
         result = {
             'id': self.id,
             'user_id': self.user_id,
@@ -68,7 +78,7 @@ class ChatSession(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'is_active': self.is_active,
-            'message_count': len(self.messages)
+            'message_count': message_count
         }
         
         if include_messages:
@@ -76,21 +86,17 @@ class ChatSession(db.Model):
         
         return result
     
-    def generate_title(self):
-        """Generate a title from the first user message."""
-        first_user_message = ChatMessage.query.filter_by(
-            session_id=self.id,
-            message_type='user'
-        ).order_by(ChatMessage.created_at.asc()).first()
-        
-        if first_user_message:
-            # Take first 50 characters of the message as title
-            title = first_user_message.content[:50]
-            if len(first_user_message.content) > 50:
-                title += "..."
-            self.title = title
-        else:
-            self.title = "New Chat"
+    @staticmethod
+    def title_from_message(content):
+        """Title made of the first 50 characters of a message."""
+        title = content[:50]
+        if len(content) > 50:
+            title += "..."
+        return title
+    
+    def generate_title(self, first_message):
+        """Generate a title from the first user message (already in hand, so no query)."""
+        self.title = ChatSession.title_from_message(first_message) if first_message else "New Chat"
     
     def __repr__(self):
         return f'<ChatSession {self.id}: {self.title}>'
@@ -100,6 +106,9 @@ class ChatMessage(db.Model):
     """Chat message model to store individual messages."""
     
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_created', 'session_id', 'created_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     session_id = db.Column(db.String(36), db.ForeignKey('chat_sessions.id'), nullable=False)
@@ -121,12 +130,168 @@ class ChatMessage(db.Model):
         return f'<ChatMessage {self.id}: {self.message_type}>'
 
 
+class SessionArchive(db.Model):
+    """Offset index entry for a session whose messages live in a segment file."""
+    
+    __tablename__ = 'session_archives'
+    
+    session_id = db.Column(db.String(36), db.ForeignKey('chat_sessions.id'), primary_key=True)
+    segment = db.Column(db.String(64), nullable=False)
+    offset = db.Column(db.BigInteger, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SessionArchive {self.session_id}: {self.segment}@{self.offset}>'
+
+
+class SessionChange(db.Model):
+    """Entry in the per-user change log used for delta sync.
+    
+    ``seq`` is never reused, so it only grows for each user; clients keep the
+    last one they saw as their watermark.
+    """
+    
+    __tablename__ = 'session_changes'
+    __table_args__ = (
+        db.Index('ix_session_changes_user_seq', 'user_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    MESSAGE = 'message'
+    
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    # No foreign keys: entries outlive purged sessions
+    session_id = db.Column(db.String(36), nullable=False)
+    message_id = db.Column(db.String(36), nullable=True)
+    kind = db.Column(db.String(16), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SessionChange {self.seq}: {self.kind} {self.session_id}>'
+
+
+class ChangeLogHorizon(db.Model):
+    """Highest change sequence removed by pruning (a single row).
+    
+    A client whose watermark is below it may have missed pruned entries.
+    """
+    
+    __tablename__ = 'change_log_horizon'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    pruned_seq = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChangeLogHorizon {self.pruned_seq}>'
+
+
+class Job(db.Model):
+    """Deferred unit of work run by the background job workers."""
+    
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_priority_run_at', 'status', 'priority', 'run_at'),
+        db.Index('ix_jobs_dedupe_key', 'dedupe_key'),
+    )
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    status = db.Column(db.String(16), nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Enqueueing with the key of a job that is still queued returns that job
+    dedupe_key = db.Column(db.String(128), nullable=True)
+    locked_by = db.Column(db.String(32), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Job {self.id}: {self.kind} {self.status}>'
+
+
+class UserUsage(db.Model):
+    """LLM tokens used by a user on one (UTC) day."""
+    
+    __tablename__ = 'user_usage'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', name='uq_user_usage_user_day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    requests = db.Column(db.Integer, nullable=False, default=0)  # model calls
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert usage row to dictionary."""
+        return {
+            'day': self.day.isoformat(),
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.prompt_tokens + self.completion_tokens,
+            'requests': self.requests
+        }
+    
+    def __repr__(self):
+        return f'<UserUsage {self.user_id} {self.day}>'
+
+
+class AnonymousUsage(db.Model):
+    """LLM tokens used without an account on one (UTC) day, shared by all guests."""
+    
+    __tablename__ = 'anonymous_usage'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    day = db.Column(db.Date, nullable=False, unique=True)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    requests = db.Column(db.Integer, nullable=False, default=0)  # model calls
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AnonymousUsage {self.day}>'
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable incremental auto-vacuum so purged pages can be returned to the OS."""
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a fresh database (before the first table is created)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.close()
+
+
 def init_db(app):
     """Initialize the database with the Flask app."""
     db.init_app(app)
     
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+        
         # Create all tables
         db.create_all()
+        
+        # create_all skips indexes on tables that already exist
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
         print("Database tables created successfully!")
 
@@ -2,24 +2,91 @@
 Chat routes for BitBraniac application with authentication and session support.
 """
 
-from flask import Blueprint, request, jsonify, current_app
+import json
+import threading
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..services.chatbot_service import BitBraniacChatbot
 from ..services.chat_history_service import ChatHistoryService
+from ..services.turn_service import DEADLINE, TURN_ID_PATTERN, TurnService
+from ..services.usage_service import QuotaExceeded, UsageService
 
 chat_bp = Blueprint('chat', __name__)
 
 # Global chatbot instance
 chatbot = None
+_chatbot_lock = threading.Lock()
 
 def get_chatbot():
     """Get or create chatbot instance."""
     global chatbot
     if chatbot is None:
-        chatbot = BitBraniacChatbot(current_app.config)
+        with _chatbot_lock:
+            if chatbot is None:
+                # Imported here so LangChain and the Google client stack load
+                # on first use, not when the blueprint is registered
+                from ..services.chatbot_service import BitBraniacChatbot
+                chatbot = BitBraniacChatbot(current_app.config)
     return chatbot
 
 
+def warm_chatbot(app):
+    """Build the chatbot (imports, LLM client and chain) before serving traffic."""
+    with app.app_context():
+        return get_chatbot()
+
+
+def reset_chatbot_clients(app):
+    """Rebuild the chatbot's LLM client after fork; network clients must not be shared across processes."""
+    if chatbot is not None:
+        with app.app_context():
+            chatbot.reset_llm()
+
+
+def parse_turn_options(data):
+    """Read the optional ``turn_id`` and ``timeout`` of a message request.
+    
+    Returns (turn_id, timeout, error message).
+    """
+    turn_id = data.get('turn_id')
+    if turn_id is not None and (not isinstance(turn_id, str) or not TURN_ID_PATTERN.match(turn_id)):
+        return None, None, 'Invalid turn_id'
+    
+    timeout = data.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        return None, None, 'Invalid timeout'
+    
+    return turn_id, timeout, None
+
+
+def cancelled_response(result, turn):
+    """Response for a turn that was cancelled or ran out of time."""
+    return jsonify({
+        'success': False,
+        'cancelled': True,
+        'reason': result['reason'],
+        'partial_response': result['partial_response'],
+        'turn_id': turn.turn_id,
+        'session_id': result.get('session_id'),
+        'message': result['error']
+    }), 504 if result['reason'] == DEADLINE else 409
+
+
+def ndjson_event(kind, **fields):
+    """One line of a newline-delimited JSON event stream."""
+    return json.dumps(dict(type=kind, **fields), separators=(',', ':')) + '\n'
+
+
+def quota_response(result):
+    """Response for a user who reached a daily quota."""
+    response = jsonify({
+        'success': False,
+        'quota_exceeded': True,
+        'message': result.get('error') or result.get('message')
+    })
+    response.headers['Retry-After'] = str(result['retry_after'])
+    return response, 429
+
+
 @chat_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for chat service."""
@@ -78,6 +145,13 @@ def send_message():
                 'message': 'Message cannot be empty'
             }), 400
         
+        turn_id, timeout, error = parse_turn_options(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
         session_id = data.get('session_id')
         
         # If no session_id provided, create a new session
@@ -93,19 +167,28 @@ def send_message():
         
         # Get chatbot and process message
         bot = get_chatbot()
-        result = bot.chat(message, session_id=session_id, user_id=user_id)
+        turn = TurnService.start(user_id, turn_id, timeout, request.environ)
+        try:
+            result = bot.chat(message, session_id=session_id, user_id=user_id, turn=turn)
+        finally:
+            TurnService.finish(turn)
         
         if result['success']:
             return jsonify({
                 'success': True,
                 'response': result['response'],
-                'session_id': session_id
+                'session_id': session_id,
+                'turn_id': turn.turn_id
             })
+        elif result.get('cancelled'):
+            return cancelled_response(result, turn)
+        elif result.get('quota_exceeded'):
+            return quota_response(result)
         else:
             return jsonify({
                 'success': False,
                 'message': result.get('error', 'Failed to process message')
-            }), 500
+            }), 503 if result.get('unavailable') else 500
             
     except Exception as e:
         current_app.logger.error(f"Send message error: {str(e)}")
@@ -133,20 +216,36 @@ def send_message_anonymous():
                 'message': 'Message cannot be empty'
             }), 400
         
-        # Get chatbot and process message without session persistence
+        turn_id, timeout, error = parse_turn_options(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        # Get chatbot and process message without session persistence; the
+        # turn still gives the request a deadline and notices a closed tab
         bot = get_chatbot()
-        result = bot.chat(message)
+        turn = TurnService.start(None, turn_id, timeout, request.environ)
+        try:
+            result = bot.chat(message, turn=turn)
+        finally:
+            TurnService.finish(turn)
         
         if result['success']:
             return jsonify({
                 'success': True,
                 'response': result['response']
             })
+        elif result.get('cancelled'):
+            return cancelled_response(result, turn)
+        elif result.get('quota_exceeded'):
+            return quota_response(result)
         else:
             return jsonify({
                 'success': False,
                 'message': result.get('error', 'Failed to process message')
-            }), 500
+            }), 503 if result.get('unavailable') else 500
             
     except Exception as e:
         current_app.logger.error(f"Send anonymous message error: {str(e)}")
@@ -156,13 +255,270 @@ def send_message_anonymous():
         }), 500
 
 
+@chat_bp.route('/message/stream', methods=['POST'])
+@jwt_required()
+def stream_message():
+    """Send a message and stream the response as newline-delimited JSON events.
+    
+    Events: ``turn`` (turn and session ids), ``chunk`` (response text as it is
+    generated), then one of ``done``, ``cancelled`` or ``error``. Closing the
+    connection cancels the turn.
+    """
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        data = request.get_json()
+        if not data or 'message' not in data:
+            return jsonify({
+                'success': False,
+                'message': 'Message is required'
+            }), 400
+        
+        message = data['message'].strip()
+        if not message:
+            return jsonify({
+                'success': False,
+                'message': 'Message cannot be empty'
+            }), 400
+        
+        turn_id, timeout, error = parse_turn_options(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+        
+        # Refuse before the stream starts so the client gets a proper status
+        quota = UsageService.check_quota(user_id)
+        if not quota['success']:
+            return quota_response(quota)
+        
+        session_id = data.get('session_id')
+        if not session_id:
+            session_result = ChatHistoryService.create_chat_session(user_id)
+            if session_result['success']:
+                session_id = session_result['session']['id']
+            else:
+                return jsonify({
+                    'success': False,
+                    'message': 'Failed to create chat session'
+                }), 500
+        
+        bot = get_chatbot()
+        turn = TurnService.start(user_id, turn_id, timeout, request.environ)
+        
+    except Exception as e:
+        current_app.logger.error(f"Stream message error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to process message'
+        }), 500
+    
+    def generate():
+        # Runs while the response is written; when the client goes away the
+        # server closes this generator, which stops the model mid-response
+        events = bot.chat_stream(message, session_id=session_id, user_id=user_id, turn=turn)
+        try:
+            yield ndjson_event('turn', turn_id=turn.turn_id, session_id=session_id)
+            for kind, value in events:
+                if kind == 'chunk':
+                    yield ndjson_event('chunk', text=value)
+                elif value['success']:
+                    yield ndjson_event('done', response=value['response'], session_id=session_id)
+                elif value.get('cancelled'):
+                    yield ndjson_event('cancelled', reason=value['reason'],
+                                       partial_response=value['partial_response'], session_id=session_id)
+                else:
+                    yield ndjson_event('error', message=value['error'], session_id=session_id)
+        finally:
+            events.close()
+            TurnService.finish(turn)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@chat_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def send_batch():
+    """Answer many independent questions at once, streaming each answer as newline-delimited JSON.
+    
+    Events: ``batch`` (question count), then ``result`` or ``error`` per
+    question in the order they finish (each carries the question's
+    ``index``), then ``done``. With ``save`` the answered questions are stored
+    as one new session, whose id is sent in ``done``.
+    """
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        data = request.get_json()
+        questions = data.get('questions') if data else None
+        if not isinstance(questions, list) or not questions:
+            return jsonify({
+                'success': False,
+                'message': 'Questions are required'
+            }), 400
+        
+        max_questions = current_app.config['CHAT_BATCH_MAX_QUESTIONS']
+        if len(questions) > max_questions:
+            return jsonify({
+                'success': False,
+                'message': f'At most {max_questions} questions per batch'
+            }), 400
+        
+        if not all(isinstance(question, str) and question.strip() for question in questions):
+            return jsonify({
+                'success': False,
+                'message': 'Questions cannot be empty'
+            }), 400
+        questions = [question.strip() for question in questions]
+        
+        save = bool(data.get('save'))
+        title = data.get('title')
+        if title is not None and not isinstance(title, str):
+            return jsonify({
+                'success': False,
+                'message': 'Invalid title'
+            }), 400
+        
+        concurrency = current_app.config['CHAT_BATCH_CONCURRENCY']
+        if isinstance(data.get('concurrency'), int) and data['concurrency'] > 0:
+            concurrency = min(data['concurrency'], concurrency)
+        
+        quota = UsageService.check_quota(user_id)
+        if not quota['success']:
+            return quota_response(quota)
+        
+        bot = get_chatbot()
+        
+    except Exception as e:
+        current_app.logger.error(f"Send batch error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to process batch'
+        }), 500
+    
+    def generate():
+        yield ndjson_event('batch', count=len(questions))
+        
+        answers = {}
+        failed = 0
+        results = bot.answer_batch(questions, concurrency, user_id)
+        try:
+            for index, response, error in results:
+                if error is None:
+                    answers[index] = response
+                    yield ndjson_event('result', index=index, response=response)
+                elif isinstance(error, QuotaExceeded):
+                    failed += 1
+                    yield ndjson_event('error', index=index, quota_exceeded=True,
+                                       retry_after=error.retry_after, message=str(error))
+                else:
+                    failed += 1
+                    yield ndjson_event('error', index=index, message='Failed to answer this question')
+        finally:
+            results.close()
+        
+        session_id = None
+        if save and answers:
+            saved = ChatHistoryService.save_message_pairs(
+                user_id, [(questions[index], answers[index]) for index in sorted(answers)], title
+            )
+            if saved['success']:
+                session_id = saved['session']['id']
+            else:
+                yield ndjson_event('error', message=saved['message'])
+        
+        yield ndjson_event('done', completed=len(answers), failed=failed, session_id=session_id)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@chat_bp.route('/message/<turn_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_message(turn_id):
+    """Cancel a message that is still being answered."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        if not TURN_ID_PATTERN.match(turn_id):
+            return jsonify({
+                'success': False,
+                'message': 'Invalid turn_id'
+            }), 400
+        
+        result = TurnService.cancel(turn_id, user_id)
+        return jsonify(result), 202 if result.get('pending') else 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Cancel message error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to cancel message'
+        }), 500
+
+
+@chat_bp.route('/usage', methods=['GET'])
+@jwt_required()
+def get_usage():
+    """Get the current user's daily token usage and quotas."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        days = request.args.get('days', 30, type=int)
+        if days < 1 or days > current_app.config['USAGE_MAX_HISTORY_DAYS']:
+            return jsonify({
+                'success': False,
+                'message': f"days must be between 1 and {current_app.config['USAGE_MAX_HISTORY_DAYS']}"
+            }), 400
+        
+        result = UsageService.get_usage(user_id, days)
+        
+        if result['success']:
+            return jsonify(result)
+        else:
+            return jsonify(result), 500
+            
+    except Exception as e:
+        current_app.logger.error(f"Get usage error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'Failed to get usage'
+        }), 500
+
+
 @chat_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_chat_history():
-    """Get current conversation history from memory."""
+    """Get the conversation window of one of the user's sessions."""
     try:
         bot = get_chatbot()
-        result = bot.get_conversation_history()
+        result = bot.get_conversation_history(request.args.get('session_id'), get_jwt_identity())
         
         return jsonify(result)
         
@@ -180,7 +536,7 @@ def clear_chat():
     """Clear current conversation memory."""
     try:
         bot = get_chatbot()
-        success = bot.clear_memory()
+        success = bot.clear_memory(get_jwt_identity())
         
         if success:
             return jsonify({
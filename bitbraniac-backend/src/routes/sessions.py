@@ -2,13 +2,27 @@
 Chat session management routes for BitBraniac application.
 """
 
-from flask import Blueprint, request, jsonify
+import io
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from ..events import format_event, get_event_broker
+from ..services.change_log_service import ChangeLogService
 from ..services.chat_history_service import ChatHistoryService
+from ..services.history_transfer_service import HistoryTransferService
 from ..auth import AuthService
 
 sessions_bp = Blueprint('sessions', __name__)
 
+
+def _with_validator(response, etag):
+    """Attach the ETag and make clients revalidate instead of reusing per-user data blindly."""
+    if etag:
+        response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
+
 @sessions_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_user_sessions():
@@ -22,10 +36,16 @@ def get_user_sessions():
             }), 401
         
         limit = request.args.get('limit', 50, type=int)
+        
+        # Unchanged list: one aggregate query and no body
+        etag = ChatHistoryService.get_user_sessions_etag(user_id, limit)
+        if etag and request.if_none_match.contains_weak(etag):
+            return _with_validator(Response(status=304), etag)
+        
         result = ChatHistoryService.get_user_chat_sessions(user_id, limit)
         
         if result['success']:
-            return jsonify(result), 200
+            return _with_validator(jsonify(result), etag), 200
         else:
             return jsonify(result), 400
             
@@ -65,6 +85,181 @@ def create_session():
         }), 500
 
 
+@sessions_bp.route('/changes', methods=['GET'])
+@jwt_required()
+def get_session_changes():
+    """Get sessions and messages changed since the client's watermark."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        # Without a watermark, hand out the current one to start syncing from
+        if 'since' not in request.args:
+            return jsonify({
+                'success': True,
+                'watermark': ChangeLogService.current_watermark(user_id)
+            }), 200
+        
+        since = request.args.get('since', type=int)
+        if since is None or since < 0:
+            return jsonify({
+                'success': False,
+                'message': 'since must be a non-negative integer'
+            }), 400
+        
+        result = ChangeLogService.get_changes(user_id, since, request.args.get('limit', type=int))
+        
+        if result['success']:
+            return jsonify(result), 200
+        else:
+            return jsonify(result), 400
+            
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to retrieve session changes'
+        }), 500
+
+
+@sessions_bp.route('/events', methods=['GET'])
+@jwt_required()
+def session_events():
+    """Stream session changes to the client as server-sent events."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        since = request.headers.get('Last-Event-ID') or request.args.get('since')
+        if since is not None and not since.isdigit():
+            return jsonify({
+                'success': False,
+                'message': 'Last-Event-ID must be a non-negative integer'
+            }), 400
+        
+        config = current_app.config
+        broker = get_event_broker()
+        # Set by src/server.py: hands the connection to the worker's event loop
+        detach = request.environ.get('bitbraniac.detach')
+        
+        # Subscribe before catching up so nothing committed in between is missed;
+        # an event delivered twice merges to the same state on the client
+        subscriber = broker.subscribe(user_id, detachable=detach is not None)
+        try:
+            events = [b'retry: %d\n\n' % config['EVENTS_RETRY_MS']]
+            if since is None:
+                watermark = ChangeLogService.current_watermark(user_id)
+                events.append(format_event({'watermark': watermark}, event='ready', event_id=watermark))
+            else:
+                since = int(since)
+                while True:
+                    result = ChangeLogService.get_changes(user_id, since)
+                    if not result['success']:
+                        raise RuntimeError(result['message'])
+                    if result['reset']:
+                        events.append(format_event(result, event='reset', event_id=result['watermark']))
+                        break
+                    if result['watermark'] > since:
+                        events.append(format_event(result, event='changes', event_id=result['watermark']))
+                    since = result['watermark']
+                    if not result['has_more']:
+                        break
+        except Exception:
+            broker.unsubscribe(subscriber)
+            raise
+        
+        def stream():
+            detached = False
+            try:
+                yield b''.join(events)
+                if detach is not None:
+                    detach(lambda sock, chunked: broker.stream_loop.attach(sock, chunked, subscriber))
+                    detached = True
+                    return
+                
+                heartbeat = config['EVENTS_HEARTBEAT_SECONDS']
+                while True:
+                    event = subscriber.get(heartbeat)
+                    if event is None:
+                        return
+                    yield event
+            finally:
+                if not detached:
+                    broker.unsubscribe(subscriber)
+        
+        return Response(stream(), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # don't let a proxy hold events back
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to open event stream'
+        }), 500
+
+
+@sessions_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_sessions():
+    """Stream all chat sessions and messages of the current user as NDJSON."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        return Response(
+            stream_with_context(HistoryTransferService.iter_export(user_id)),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=bitbraniac-history.ndjson'}
+        )
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to export chat sessions'
+        }), 500
+
+
+@sessions_bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_sessions():
+    """Import chat sessions and messages from an NDJSON export."""
+    try:
+        user_id = get_jwt_identity()
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'message': 'User not authenticated'
+            }), 401
+        
+        # Read the body line by line instead of loading it into memory; the
+        # raw request stream reads one byte at a time for readline()
+        lines = io.BufferedReader(request.stream, buffer_size=64 * 1024)
+        result = HistoryTransferService.import_records(user_id, lines)
+        
+        if result['success']:
+            return jsonify(result), 201
+        else:
+            return jsonify(result), 400
+            
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Failed to import chat sessions'
+        }), 500
+
+
 @sessions_bp.route('/<session_id>', methods=['GET'])
 @jwt_required()
 def get_session(session_id):
@@ -77,10 +272,14 @@ def get_session(session_id):
                 'message': 'User not authenticated'
             }), 401
         
+        etag = ChatHistoryService.get_session_etag(session_id, user_id)
+        if etag and request.if_none_match.contains_weak(etag):
+            return _with_validator(Response(status=304), etag)
+        
         result = ChatHistoryService.get_chat_session(session_id, user_id)
         
         if result['success']:
-            return jsonify(result), 200
+            return _with_validator(jsonify(result), etag), 200
         else:
             return jsonify(result), 404 if 'not found' in result['message'] else 400
             
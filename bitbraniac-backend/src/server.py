@@ -0,0 +1,378 @@
+"""
+Production server for BitBraniac backend.
+
+A preforking launcher: the master process creates the app once, warms the
+chatbot and database engine, binds the listening socket and forks
+``SERVER_WORKERS`` workers that share the loaded code copy-on-write. Each
+worker serves requests from a pool of ``SERVER_THREADS`` threads. With
+``CACHE_BACKEND=socket`` (the default here) the master also runs a cache
+process that all workers share. Session event streams are detached from the
+request threads and served by an asyncio loop in each worker (``src/events.py``).
+
+Signals handled by the master:
+
+- ``TERM``/``INT``: graceful shutdown; workers stop accepting connections and
+  finish in-flight requests (up to ``SERVER_GRACEFUL_TIMEOUT`` seconds)
+- ``HUP``: rolling restart of the workers
+- ``USR2``: upgrade; a new master is started from the current code on the same
+  socket and this master drains and exits once the new one is serving
+
+Usage:
+    python src/server.py
+"""
+
+import io
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Same import path setup as main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from src.cache import CacheServer, default_socket_path, get_cache, init_cache
+from src.main import create_app
+from src.models import db
+from src.routes.chat import reset_chatbot_clients, warm_chatbot
+from src.services.usage_service import flush_usage
+
+
+LISTEN_FD_ENV = 'BITBRANIAC_LISTEN_FD'
+UPGRADE_FROM_ENV = 'BITBRANIAC_UPGRADE_FROM'
+
+
+class _Discard(io.RawIOBase):
+    """Write sink for a handler whose connection has been detached."""
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return len(data)
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    """Request handler that lets the app take a connection off the pool."""
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ['bitbraniac.detach'] = self.detach
+        return environ
+
+    def detach(self, callback):
+        """Hand the connection over once this response is out of the handler.
+
+        Call after the response headers have been sent. Instead of closing
+        the socket, the server calls ``callback(socket, chunked)`` when the
+        handler is done with it; the pool thread is free from then on.
+        """
+        self.wfile = _Discard()  # werkzeug still writes the closing chunk
+        self.server.detached[self.request] = (callback, self.protocol_version >= 'HTTP/1.1')
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles connections on a fixed-size thread pool."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, keepalive_timeout, fd=None):
+        # Idle keep-alive connections would otherwise pin pool threads forever
+        handler = type('PooledRequestHandler', (PooledRequestHandler,), {'timeout': keepalive_timeout})
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='bitbraniac-http')
+        self.detached = {}  # socket -> (callback, chunked)
+        self._inflight = 0
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._inflight += 1
+        self.pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._idle:
+                self._inflight -= 1
+                self._idle.notify_all()
+
+    def shutdown_request(self, request):
+        detached = self.detached.pop(request, None)
+        if detached is None:
+            super().shutdown_request(request)
+            return
+        callback, chunked = detached
+        try:
+            callback(request, chunked)
+        except Exception:
+            # Nobody took the connection over
+            super().shutdown_request(request)
+
+    def drain(self, timeout):
+        """Wait for in-flight connections to finish; returns how many are left."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self._inflight and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+            return self._inflight
+
+
+def run_worker(app, listen_fd, master_pid):
+    """Serve requests in a forked worker process until told to stop."""
+    config = app.config
+
+    # The master handles INT (Ctrl+C reaches the whole process group) and HUP
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    # Pooled DB connections and the LLM client were created in the master
+    with app.app_context():
+        db.engine.dispose(close=False)
+    get_cache(app).reset()
+    reset_chatbot_clients(app)
+
+    server = PooledWSGIServer(
+        config['SERVER_HOST'], 0, app,
+        threads=config['SERVER_THREADS'],
+        keepalive_timeout=config['SERVER_KEEPALIVE_TIMEOUT'],
+        fd=listen_fd
+    )
+
+    def stop(*_):
+        # shutdown() blocks until serve_forever returns, so call it off the main thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def watch_master():
+        while os.getppid() == master_pid:
+            time.sleep(1)
+        stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    threading.Thread(target=watch_master, daemon=True).start()
+
+    app.logger.info(f"Worker {os.getpid()} serving with {config['SERVER_THREADS']} threads")
+    server.serve_forever(poll_interval=0.5)
+
+    left = server.drain(config['SERVER_GRACEFUL_TIMEOUT'])
+    if left:
+        app.logger.warning(f"Worker {os.getpid()} exiting with {left} requests still running")
+    server.server_close()
+    flush_usage(app)
+
+
+def run_cache_server(app, master_pid):
+    """Serve the shared cache in a forked process until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    server = CacheServer(default_socket_path(app), max_entries=app.config['CACHE_MAX_ENTRIES'])
+
+    def stop(*_):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def watch_master():
+        while os.getppid() == master_pid:
+            time.sleep(1)
+        stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    threading.Thread(target=watch_master, daemon=True).start()
+
+    app.logger.info(f"Cache server {os.getpid()} listening on {server.path}")
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+
+
+class Arbiter:
+    """Master process: forks, supervises and restarts workers."""
+
+    def __init__(self, app, sock):
+        self.app = app
+        self.sock = sock
+        self.config = app.config
+        self.workers = set()
+        self.retiring = set()
+        self.cache_pid = None
+        self.stopping = False
+        self._pending_signals = []
+
+    def _fork(self, target, *args):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                target(self.app, *args)
+            except Exception as e:
+                self.app.logger.error(f"Process {os.getpid()} crashed: {str(e)}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        return pid
+
+    def spawn_worker(self):
+        pid = self._fork(run_worker, self.sock.fileno(), os.getpid())
+        self.workers.add(pid)
+        return pid
+
+    def spawn_cache_server(self):
+        self.cache_pid = self._fork(run_cache_server, os.getpid())
+        # Workers that start before the socket exists would just see cache misses
+        path = default_socket_path(self.app)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def reap_workers(self):
+        while self.workers or self.retiring:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            if pid == self.cache_pid:
+                self.cache_pid = None
+                if not self.stopping:
+                    self.app.logger.warning(f"Cache server {pid} exited unexpectedly (status {status}), restarting")
+                    self.spawn_cache_server()
+            elif pid in self.retiring:
+                self.retiring.discard(pid)
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                if not self.stopping:
+                    self.app.logger.warning(f"Worker {pid} exited unexpectedly (status {status}), restarting")
+                    self.spawn_worker()
+
+    def rolling_restart(self):
+        """Replace workers one at a time; the socket keeps accepting throughout."""
+        for pid in list(self.workers):
+            self.spawn_worker()
+            self.workers.discard(pid)
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+
+    def upgrade(self):
+        """Start a new master running the current code on the same socket."""
+        env = dict(os.environ, **{
+            LISTEN_FD_ENV: str(self.sock.fileno()),
+            UPGRADE_FROM_ENV: str(os.getpid())
+        })
+        subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(self.sock.fileno(),))
+        self.app.logger.info("Started new master for upgrade")
+
+    def stop(self):
+        self.stopping = True
+        for pid in self.workers | self.retiring:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.config['SERVER_GRACEFUL_TIMEOUT'] + 5
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self.retiring |= self.workers
+            self.workers.clear()
+            self.reap_workers()
+            time.sleep(0.1)
+
+        for pid in self.retiring:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        # The cache outlives the workers so draining requests can still use it
+        if self.cache_pid:
+            os.kill(self.cache_pid, signal.SIGTERM)
+            os.waitpid(self.cache_pid, 0)
+
+    def run(self):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR2):
+            signal.signal(signum, lambda signum, frame: self._pending_signals.append(signum))
+
+        if self.config['CACHE_BACKEND'] == 'socket':
+            self.spawn_cache_server()
+        for _ in range(self.config['SERVER_WORKERS']):
+            self.spawn_worker()
+        self.app.logger.info(
+            f"Master {os.getpid()} listening on {self.sock.getsockname()} "
+            f"with {self.config['SERVER_WORKERS']} workers"
+        )
+
+        # Hand over from the master we are replacing
+        if os.getenv(UPGRADE_FROM_ENV):
+            os.kill(int(os.environ.pop(UPGRADE_FROM_ENV)), signal.SIGTERM)
+
+        while True:
+            while self._pending_signals:
+                signum = self._pending_signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.app.logger.info("Shutting down gracefully")
+                    self.stop()
+                    return
+                if signum == signal.SIGHUP:
+                    self.app.logger.info("Restarting workers")
+                    self.rolling_restart()
+                elif signum == signal.SIGUSR2:
+                    self.upgrade()
+
+            self.reap_workers()
+            time.sleep(0.5)
+
+
+def create_listen_socket(config, port):
+    """Bind the shared listening socket, or adopt the one passed by an upgrading master."""
+    if os.getenv(LISTEN_FD_ENV):
+        sock = socket.socket(fileno=int(os.environ.pop(LISTEN_FD_ENV)))
+    else:
+        sock = socket.create_server(
+            (config['SERVER_HOST'], port),
+            backlog=config['SERVER_BACKLOG'],
+            family=socket.AF_INET6 if ':' in config['SERVER_HOST'] else socket.AF_INET
+        )
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    app = create_app(os.getenv('FLASK_ENV', 'production'))
+    # Share contexts and responses between workers unless configured otherwise
+    if 'CACHE_BACKEND' not in os.environ:
+        app.config['CACHE_BACKEND'] = 'socket'
+        init_cache(app)
+    # Let /api/metrics report every worker, not just the one serving the scrape
+    if not app.config.get('METRICS_DIR'):
+        app.config['METRICS_DIR'] = os.path.join(app.instance_path, 'metrics')
+    port = int(os.getenv('PORT', 5001))
+
+    # Warm everything the workers would otherwise pay for on their first request
+    try:
+        warm_chatbot(app)
+    except Exception as e:
+        app.logger.warning(f"Chatbot warm-up failed, workers will retry on first use: {str(e)}")
+    with app.app_context():
+        db.session.execute(db.text('SELECT 1'))
+        db.session.remove()
+        db.engine.dispose()
+
+    sock = create_listen_socket(app.config, port)
+    Arbiter(app, sock).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Cold-storage archive service for BitBraniac application.
+
+Messages of sessions that have been idle for a while are moved out of the
+live database into append-only, zstd-compressed segment files. Each archived
+session is one compressed frame; its location is kept in ``session_archives``.
+
+Reading an archived session is served from its frame, so the session stays
+archived. Writing to it moves the messages back into the database and drops
+its ``session_archives`` row, and so does purging it; the frame is then dead.
+Compaction deletes segments without live frames and rewrites the live frames
+of mostly dead segments into the newest one.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import zstandard
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from ..models import ChatSession, ChatMessage, SessionArchive, db
+
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.zst'
+
+# Segments modified more recently may have frames whose rows are not committed yet
+SEGMENT_COMPACT_MIN_AGE = 300
+
+
+class SegmentStore:
+    """Append-only store of compressed frames split across segment files."""
+
+    def __init__(self, directory, max_segment_bytes, compression_level=3):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compressor = zstandard.ZstdCompressor(level=compression_level, write_checksum=True)
+        self.decompressor = zstandard.ZstdDecompressor()
+        self._lock = threading.Lock()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def segments(self):
+        """Segment names, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _active_segment(self):
+        """Return the newest segment name, rolling over when it is full."""
+        segments = self.segments()
+        if segments:
+            latest = segments[-1]
+            if os.path.getsize(self._segment_path(latest)) < self.max_segment_bytes:
+                return latest
+            number = int(latest[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1
+        else:
+            number = 1
+        return f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"
+
+    def append(self, payload):
+        """Compress and append a payload, returning (segment, offset, length)."""
+        return self.append_frame(self.compressor.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8')))
+
+    def append_frame(self, frame):
+        """Append an already compressed frame, returning (segment, offset, length)."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            segment = self._active_segment()
+            # O_APPEND keeps concurrent writers from overwriting each other's frames
+            fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                view = memoryview(frame)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                os.fsync(fd)
+                end = os.lseek(fd, 0, os.SEEK_CUR)
+            finally:
+                os.close(fd)
+
+        return segment, end - len(frame), len(frame)
+
+    def read_frame(self, segment, offset, length):
+        """Read a single compressed frame."""
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read(self, segment, offset, length):
+        """Read and decompress a single frame."""
+        return json.loads(self.decompressor.decompress(self.read_frame(segment, offset, length)))
+
+    def size(self, segment):
+        return os.path.getsize(self._segment_path(segment))
+
+    def age(self, segment):
+        """Seconds since the segment was last written."""
+        return time.time() - os.path.getmtime(self._segment_path(segment))
+
+    def remove(self, segment):
+        try:
+            os.remove(self._segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+
+def get_segment_store(app=None):
+    """Get or create the segment store for the app."""
+    app = app or current_app._get_current_object()
+    store = app.extensions.get('archive_store')
+    if store is None:
+        directory = app.config.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+        store = SegmentStore(
+            directory,
+            app.config['ARCHIVE_SEGMENT_MAX_BYTES'],
+            app.config['ARCHIVE_COMPRESSION_LEVEL']
+        )
+        app.extensions['archive_store'] = store
+    return store
+
+
+class ArchiveService:
+    """Service class for archiving idle sessions and rehydrating them on access."""
+
+    @staticmethod
+    def archive_session(session):
+        """Move a session's messages into the segment store."""
+        messages = ChatMessage.query.filter_by(
+            session_id=session.id
+        ).order_by(ChatMessage.created_at.asc()).all()
+
+        if not messages:
+            return False
+
+        payload = {
+            'session_id': session.id,
+            'user_id': session.user_id,
+            'messages': [
+                {
+                    'id': msg.id,
+                    'message_type': msg.message_type,
+                    'content': msg.content,
+                    'created_at': msg.created_at.isoformat()
+                }
+                for msg in messages
+            ]
+        }
+        segment, offset, length = get_segment_store().append(payload)
+
+        message_ids = [msg.id for msg in messages]
+        ChatMessage.query.filter(ChatMessage.id.in_(message_ids)).delete(synchronize_session=False)
+
+        # A message arrived while we were writing the frame; leave the session hot
+        if ChatMessage.query.filter_by(session_id=session.id).count():
+            db.session.rollback()
+            return False
+
+        db.session.add(SessionArchive(
+            session_id=session.id,
+            segment=segment,
+            offset=offset,
+            length=length,
+            message_count=len(messages)
+        ))
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def archive_idle_sessions(after_days=None, batch_size=None):
+        """Archive active sessions that have not been touched for a number of days."""
+        config = current_app.config
+        after_days = config['ARCHIVE_AFTER_DAYS'] if after_days is None else after_days
+        batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=after_days)
+            sessions = ChatSession.query.outerjoin(SessionArchive).filter(
+                ChatSession.is_active.is_(True),
+                ChatSession.updated_at < cutoff,
+                SessionArchive.session_id.is_(None)
+            ).order_by(ChatSession.updated_at.asc()).limit(batch_size).all()
+
+            archived = 0
+            for session in sessions:
+                try:
+                    if ArchiveService.archive_session(session):
+                        archived += 1
+                except IntegrityError:
+                    # Another worker archived it first
+                    db.session.rollback()
+
+            current_app.logger.info(f"Archived {archived} idle chat sessions")
+
+            return {
+                'success': True,
+                'sessions_archived': archived
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Archive idle sessions error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to archive chat sessions'
+            }
+
+    @staticmethod
+    def load_archived_messages(archive):
+        """Read the archived messages of a session without touching the live tables."""
+        payload = get_segment_store().read(archive.segment, archive.offset, archive.length)
+        return payload['messages']
+
+    @staticmethod
+    def session_messages(session):
+        """Messages of an archived session as ``ChatMessage.to_dict`` dicts, oldest first."""
+        try:
+            messages = ArchiveService.load_archived_messages(session.archive)
+        except FileNotFoundError:
+            # Compaction moved the frame after the row was loaded
+            db.session.refresh(session.archive)
+            messages = ArchiveService.load_archived_messages(session.archive)
+        return [{'session_id': session.id, **msg} for msg in messages]
+
+    @staticmethod
+    def rehydrate(session):
+        """Move an archived session's messages back into the live database, before it is written to."""
+        archive = session.archive
+        if archive is None:
+            return False
+
+        try:
+            messages = ArchiveService.session_messages(session)
+            db.session.execute(db.insert(ChatMessage), [
+                {
+                    'id': msg['id'],
+                    'session_id': session.id,
+                    'message_type': msg['message_type'],
+                    'content': msg['content'],
+                    'created_at': datetime.fromisoformat(msg['created_at'])
+                }
+                for msg in messages
+            ])
+            db.session.delete(archive)
+            db.session.commit()
+
+            current_app.logger.info(f"Rehydrated {len(messages)} messages for session {session.id}")
+            return True
+
+        except IntegrityError:
+            # A concurrent request already rehydrated this session
+            db.session.rollback()
+            return False
+
+    @staticmethod
+    def compact_segments(min_live_ratio=None):
+        """Delete segments without live frames and rewrite the live frames of mostly dead ones."""
+        config = current_app.config
+        min_live_ratio = config['ARCHIVE_COMPACT_MIN_LIVE_RATIO'] if min_live_ratio is None else min_live_ratio
+        store = get_segment_store()
+        reclaimed_bytes = 0
+
+        try:
+            live_bytes = dict(db.session.query(
+                SessionArchive.segment, func.sum(SessionArchive.length)
+            ).group_by(SessionArchive.segment).all())
+
+            # The newest segment is still being appended to
+            for segment in store.segments()[:-1]:
+                if store.age(segment) < SEGMENT_COMPACT_MIN_AGE:
+                    continue
+                size = store.size(segment)
+                live = live_bytes.get(segment) or 0
+                if live and live >= size * min_live_ratio:
+                    continue
+
+                for archive in SessionArchive.query.filter_by(segment=segment).all():
+                    frame = store.read_frame(archive.segment, archive.offset, archive.length)
+                    archive.segment, archive.offset, archive.length = store.append_frame(frame)
+                db.session.commit()
+
+                store.remove(segment)
+                reclaimed_bytes += size - live
+
+            if reclaimed_bytes:
+                current_app.logger.info(f"Archive compaction reclaimed {reclaimed_bytes} bytes")
+
+            return {
+                'success': True,
+                'reclaimed_bytes': reclaimed_bytes
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Archive compaction error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to compact archive segments'
+            }
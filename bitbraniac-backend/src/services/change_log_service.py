@@ -0,0 +1,202 @@
+"""
+Change log service for BitBraniac application.
+
+Every session create/delete and every new message appends a ``SessionChange``
+row in the same transaction as the change itself. Clients remember the
+highest ``seq`` they have seen (their watermark) and ask for everything after
+it instead of refetching their whole session list. Pruning records the
+highest sequence it removed, so a client with an older watermark is told to
+reload even when nothing after it is left in the log.
+"""
+
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from ..models import ChangeLogHorizon, ChatMessage, ChatSession, SessionChange, db
+
+
+class ChangeLogService:
+    """Service class for recording and reading session changes."""
+
+    @staticmethod
+    def record(user_id, session_id, kind, message_id=None):
+        """Add a change to the current transaction; the caller commits."""
+        db.session.add(SessionChange(
+            user_id=user_id,
+            session_id=session_id,
+            kind=kind,
+            message_id=message_id
+        ))
+
+    @staticmethod
+    def record_many(user_id, session_ids, kind):
+        """Add one change per session with a single bulk insert; the caller commits."""
+        if not session_ids:
+            return
+        now = datetime.utcnow()
+        db.session.execute(SessionChange.__table__.insert(), [
+            {'user_id': user_id, 'session_id': session_id, 'kind': kind, 'created_at': now}
+            for session_id in session_ids
+        ])
+
+    @staticmethod
+    def pruned_seq():
+        """Highest change sequence removed by pruning (0 if nothing was pruned)."""
+        return db.session.query(ChangeLogHorizon.pruned_seq).filter(ChangeLogHorizon.id == 1).scalar() or 0
+
+    @staticmethod
+    def current_watermark(user_id):
+        """Highest change sequence of a user, never below the pruned horizon."""
+        latest = db.session.query(func.max(SessionChange.seq)).filter(
+            SessionChange.user_id == user_id
+        ).scalar() or 0
+        return max(latest, ChangeLogService.pruned_seq())
+
+    @staticmethod
+    def get_changes(user_id, since, limit=None):
+        """Sessions and messages that changed after the ``since`` watermark.
+
+        ``reset`` is set when entries after ``since`` have been pruned and
+        the client has to reload everything.
+        """
+        limit = min(limit or current_app.config['CHANGES_PAGE_SIZE'], current_app.config['CHANGES_PAGE_SIZE'])
+
+        try:
+            if since < ChangeLogService.pruned_seq():
+                return {
+                    'success': True,
+                    'reset': True,
+                    'watermark': ChangeLogService.current_watermark(user_id),
+                    'has_more': False,
+                    'sessions': [],
+                    'deleted': [],
+                    'messages': []
+                }
+
+            # Read first: entries of this user up to it are all in the page below
+            latest = ChangeLogService.latest_seq()
+
+            changes = SessionChange.query.filter(
+                SessionChange.user_id == user_id,
+                SessionChange.seq > since
+            ).order_by(SessionChange.seq.asc()).limit(limit + 1).all()
+
+            has_more = len(changes) > limit
+            changes = changes[:limit]
+
+            result = ChangeLogService.build_delta(user_id, changes)
+            result.update({
+                'success': True,
+                'reset': False,
+                # An idle user still moves along with the log, ahead of pruning
+                'watermark': changes[-1].seq if changes else max(since, latest),
+                'has_more': has_more
+            })
+            return result
+
+        except Exception as e:
+            current_app.logger.error(f"Get session changes error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to retrieve session changes'
+            }
+
+    @staticmethod
+    def build_delta(user_id, changes):
+        """Current state of what a user's change entries touched.
+
+        Sessions are returned as they are now; a session created and deleted
+        within the entries is only reported as deleted.
+        """
+        deleted = {change.session_id for change in changes if change.kind == SessionChange.DELETED}
+        touched = {change.session_id for change in changes} - deleted
+
+        sessions = []
+        if touched:
+            sessions = ChatSession.query.filter(
+                ChatSession.id.in_(touched),
+                ChatSession.user_id == user_id,
+                ChatSession.is_active.is_(True)
+            ).all()
+            # Deleted by an entry further along the log
+            deleted |= touched - {session.id for session in sessions}
+
+        counts = {}
+        if sessions:
+            counts = dict(db.session.query(ChatMessage.session_id, func.count(ChatMessage.id)).filter(
+                ChatMessage.session_id.in_([session.id for session in sessions])
+            ).group_by(ChatMessage.session_id).all())
+
+        message_ids = [
+            change.message_id for change in changes
+            if change.kind == SessionChange.MESSAGE and change.session_id not in deleted
+        ]
+        messages = []
+        if message_ids:
+            messages = ChatMessage.query.filter(
+                ChatMessage.id.in_(message_ids)
+            ).order_by(ChatMessage.created_at.asc()).all()
+
+        return {
+            'sessions': [
+                session.to_dict(message_count=(
+                    session.archive.message_count if session.archive else counts.get(session.id, 0)
+                ))
+                for session in sessions
+            ],
+            'deleted': sorted(deleted),
+            'messages': [message.to_dict() for message in messages]
+        }
+
+    @staticmethod
+    def latest_seq():
+        """Highest change sequence over all users."""
+        return db.session.query(func.max(SessionChange.seq)).scalar() or 0
+
+    @staticmethod
+    def prune(retention_days=None, batch_size=None, pause=None):
+        """Delete change log entries older than the retention period, oldest first."""
+        config = current_app.config
+        retention_days = config['CHANGES_RETENTION_DAYS'] if retention_days is None else retention_days
+        batch_size = batch_size or config['RETENTION_BATCH_SIZE']
+        pause = config['RETENTION_BATCH_PAUSE'] if pause is None else pause
+
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            pruned = 0
+
+            # seq and created_at grow together, so walk the primary key
+            while True:
+                rows = db.session.query(SessionChange.seq, SessionChange.created_at).order_by(
+                    SessionChange.seq.asc()
+                ).limit(batch_size).all()
+                expired = [row.seq for row in rows if row.created_at < cutoff]
+
+                if expired:
+                    SessionChange.query.filter(SessionChange.seq.in_(expired)).delete(synchronize_session=False)
+                    # Recorded in the same transaction, so no window where entries are gone unnoticed
+                    horizon = db.session.get(ChangeLogHorizon, 1)
+                    if horizon is None:
+                        db.session.add(ChangeLogHorizon(id=1, pruned_seq=max(expired)))
+                    else:
+                        horizon.pruned_seq = max(horizon.pruned_seq, max(expired))
+                    db.session.commit()
+                    pruned += len(expired)
+
+                if len(expired) < batch_size:
+                    break
+                time.sleep(pause)
+
+            return {
+                'success': True,
+                'changes_pruned': pruned
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Change log prune error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to prune session changes'
+            }
@@ -2,26 +2,68 @@
 Chat history service for BitBraniac application.
 """
 
+import hashlib
+import uuid
 from flask import current_app
-from datetime import datetime
-from ..models import ChatSession, ChatMessage, db
+from datetime import datetime, timedelta
+from sqlalchemy import case, func
+from ..models import ChatSession, ChatMessage, SessionChange, db
 from ..auth import AuthService
+from ..cache import get_cache
+from ..events import notify_session_change
+from ..metrics import CACHE_REQUESTS
+from .archive_service import ArchiveService
+from .change_log_service import ChangeLogService
+from .memory_service import MemoryService
+from .title_service import TitleService
 
 
 class ChatHistoryService:
     """Service class for handling chat history operations."""
     
+    @staticmethod
+    def _context_tag(session_id):
+        return f'session:{session_id}'
+    
+    @staticmethod
+    def _context_key(session_id, user_id, limit):
+        return f'context:{session_id}:{user_id}:{limit}'
+    
+    @staticmethod
+    def context_generation(session_id):
+        """Generation of a session's cached context; it changes whenever a message is added."""
+        return get_cache().generation(ChatHistoryService._context_tag(session_id))
+    
+    @staticmethod
+    def cache_session_context(session_id, user_id, limit, messages, generation):
+        """Store a session context unless the session changed after ``generation``."""
+        return get_cache().set(
+            ChatHistoryService._context_key(session_id, user_id, limit),
+            messages,
+            ttl=current_app.config['CACHE_CONTEXT_TTL'],
+            tag=ChatHistoryService._context_tag(session_id),
+            generation=generation
+        )
+    
+    @staticmethod
+    def invalidate_session_context(session_id):
+        """Drop cached contexts of a session in every worker."""
+        return get_cache().invalidate(ChatHistoryService._context_tag(session_id))
+    
     @staticmethod
     def create_chat_session(user_id, title=None):
         """Create a new chat session for a user."""
         try:
             session = ChatSession(
+                id=str(uuid.uuid4()),
                 user_id=user_id,
                 title=title or "New Chat"
             )
             
             db.session.add(session)
+            ChangeLogService.record(user_id, session.id, SessionChange.CREATED)
             db.session.commit()
+            notify_session_change()
             
             return {
                 'success': True,
@@ -37,10 +79,61 @@ class ChatHistoryService:
                 'message': 'Failed to create chat session'
             }
     
+    @staticmethod
+    def save_message_pairs(user_id, pairs, title=None):
+        """Save (question, answer) pairs as a new session, inserting its messages in one statement."""
+        try:
+            now = datetime.utcnow()
+            session_id = str(uuid.uuid4())
+            db.session.execute(ChatSession.__table__.insert(), [{
+                'id': session_id,
+                'user_id': user_id,
+                'title': (title or ChatSession.title_from_message(pairs[0][0]))[:200],
+                'created_at': now,
+                'updated_at': now,
+                'is_active': True
+            }])
+            
+            rows = []
+            for question, answer in pairs:
+                for message_type, content in (('user', question), ('assistant', answer)):
+                    rows.append({
+                        'id': str(uuid.uuid4()),
+                        'session_id': session_id,
+                        'message_type': message_type,
+                        'content': content,
+                        # Distinct timestamps keep the pairs in order
+                        'created_at': now + timedelta(microseconds=len(rows))
+                    })
+            db.session.execute(ChatMessage.__table__.insert(), rows)
+            
+            ChangeLogService.record(user_id, session_id, SessionChange.CREATED)
+            MemoryService.request_update(user_id)
+            db.session.commit()
+            notify_session_change()
+            
+            session = db.session.get(ChatSession, session_id)
+            return {
+                'success': True,
+                'session': session.to_dict(message_count=len(rows)),
+                'message': 'Chat session saved successfully'
+            }
+            
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Save message pairs error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to save chat session'
+            }
+    
     @staticmethod
     def get_user_chat_sessions(user_id, limit=50):
         """Get all chat sessions for a user."""
         try:
+            # Read first, so anything committed while the list loads is replayed by a delta sync
+            watermark = ChangeLogService.current_watermark(user_id)
+            
             sessions = ChatSession.query.filter_by(
                 user_id=user_id,
                 is_active=True
@@ -48,7 +141,8 @@ class ChatHistoryService:
             
             return {
                 'success': True,
-                'sessions': [session.to_dict() for session in sessions]
+                'sessions': [session.to_dict() for session in sessions],
+                'watermark': watermark
             }
             
         except Exception as e:
@@ -58,6 +152,45 @@ class ChatHistoryService:
                 'message': 'Failed to retrieve chat sessions'
             }
     
+    @staticmethod
+    def get_user_sessions_etag(user_id, limit=50):
+        """Version tag of a user's session list, from one aggregate over the user's index range.
+        
+        Adding a message, creating or (soft) deleting a session all change
+        either the active count or the newest ``updated_at``.
+        """
+        try:
+            active_count, last_updated = db.session.query(
+                func.count(case((ChatSession.is_active.is_(True), 1))),
+                func.max(ChatSession.updated_at)
+            ).filter(ChatSession.user_id == user_id).one()
+            
+            version = f'{user_id}:{limit}:{active_count}:{last_updated.isoformat() if last_updated else ""}'
+            return hashlib.sha1(version.encode('utf-8')).hexdigest()
+            
+        except Exception as e:
+            current_app.logger.error(f"Get user sessions etag error: {str(e)}")
+            return None
+    
+    @staticmethod
+    def get_session_etag(session_id, user_id):
+        """Version tag of a session and its messages, or None if it does not exist."""
+        try:
+            updated_at = db.session.query(ChatSession.updated_at).filter_by(
+                id=session_id,
+                user_id=user_id,
+                is_active=True
+            ).scalar()
+            
+            if updated_at is None:
+                return None
+            
+            return hashlib.sha1(f'{session_id}:{updated_at.isoformat()}'.encode('utf-8')).hexdigest()
+            
+        except Exception as e:
+            current_app.logger.error(f"Get session etag error: {str(e)}")
+            return None
+    
     @staticmethod
     def get_chat_session(session_id, user_id):
         """Get a specific chat session with messages."""
@@ -74,9 +207,16 @@ class ChatHistoryService:
                     'message': 'Chat session not found'
                 }
             
+            # Archived sessions are read from their frame and stay archived
+            if session.archive:
+                result = session.to_dict()
+                result['messages'] = ArchiveService.session_messages(session)
+            else:
+                result = session.to_dict(include_messages=True)
+            
             return {
                 'success': True,
-                'session': session.to_dict(include_messages=True)
+                'session': result
             }
             
         except Exception as e:
@@ -103,14 +243,19 @@ class ChatHistoryService:
                     'message': 'Chat session not found'
                 }
             
+            if session.archive:
+                ArchiveService.rehydrate(session)
+            
             # Create new message
             message = ChatMessage(
+                id=str(uuid.uuid4()),
                 session_id=session_id,
                 message_type=message_type,
                 content=content
             )
             
             db.session.add(message)
+            ChangeLogService.record(user_id, session_id, SessionChange.MESSAGE, message_id=message.id)
             
             # Update session timestamp
             session.updated_at = datetime.utcnow()
@@ -118,9 +263,14 @@ class ChatHistoryService:
             # Generate title from first user message if not set
             if not session.title or session.title == "New Chat":
                 if message_type == 'user':
-                    session.generate_title()
+                    session.generate_title(content)
+                    TitleService.request_summary(session_id, content)
+            if message_type == 'user':
+                MemoryService.request_update(user_id)
             
             db.session.commit()
+            ChatHistoryService.invalidate_session_context(session_id)
+            notify_session_change()
             
             return {
                 'success': True,
@@ -154,7 +304,11 @@ class ChatHistoryService:
             
             # Soft delete
             session.is_active = False
+            ChangeLogService.record(user_id, session_id, SessionChange.DELETED)
+            MemoryService.request_update(user_id, compact=True)
             db.session.commit()
+            ChatHistoryService.invalidate_session_context(session_id)
+            notify_session_change()
             
             return {
                 'success': True,
@@ -180,8 +334,13 @@ class ChatHistoryService:
             
             for session in sessions:
                 session.is_active = False
+            ChangeLogService.record_many(user_id, [session.id for session in sessions], SessionChange.DELETED)
+            MemoryService.request_update(user_id, compact=True)
             
             db.session.commit()
+            for session in sessions:
+                ChatHistoryService.invalidate_session_context(session.id)
+            notify_session_change()
             
             return {
                 'success': True,
@@ -200,6 +359,16 @@ class ChatHistoryService:
     def get_session_messages_for_memory(session_id, user_id, limit=None):
         """Get messages from a session formatted for LangChain memory."""
         try:
+            key = ChatHistoryService._context_key(session_id, user_id, limit)
+            cached = get_cache().get(key)
+            if cached is not None:
+                CACHE_REQUESTS.inc(kind='context', result='hit')
+                return cached
+            CACHE_REQUESTS.inc(kind='context', result='miss')
+            
+            # Read before loading so a message added meanwhile keeps the result out of the cache
+            generation = ChatHistoryService.context_generation(session_id)
+            
             session = ChatSession.query.filter_by(
                 id=session_id,
                 user_id=user_id,
@@ -209,22 +378,29 @@ class ChatHistoryService:
             if not session:
                 return []
             
-            query = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at.asc())
-            
-            if limit:
-                # Get the most recent messages
-                query = query.limit(limit)
-            
-            messages = query.all()
+            if session.archive:
+                messages = [(msg['message_type'], msg['content']) for msg in ArchiveService.session_messages(session)]
+                if limit:
+                    messages = messages[-limit:]
+            else:
+                query = ChatMessage.query.filter_by(session_id=session_id)
+                
+                if limit:
+                    # Get the most recent messages, oldest first
+                    rows = query.order_by(ChatMessage.created_at.desc()).limit(limit).all()[::-1]
+                else:
+                    rows = query.order_by(ChatMessage.created_at.asc()).all()
+                messages = [(msg.message_type, msg.content) for msg in rows]
             
             # Format for LangChain memory
             formatted_messages = []
-            for msg in messages:
-                if msg.message_type == 'user':
-                    formatted_messages.append({"type": "human", "content": msg.content})
-                elif msg.message_type == 'assistant':
-                    formatted_messages.append({"type": "ai", "content": msg.content})
+            for message_type, content in messages:
+                if message_type == 'user':
+                    formatted_messages.append({"type": "human", "content": content})
+                elif message_type == 'assistant':
+                    formatted_messages.append({"type": "ai", "content": content})
             
+            ChatHistoryService.cache_session_context(session_id, user_id, limit, formatted_messages, generation)
             return formatted_messages
             
         except Exception as e:
@@ -1,16 +1,35 @@
 """
 BitBraniac Chatbot Service with LangChain integration and persistent chat history.
+
+Prompts are laid out so consecutive turns of a conversation share as long a
+prefix as possible, which providers with prefix (context) caching bill and
+serve faster: the static system message first, then the history, and last the
+student's message together with everything picked for it (course notes,
+recalled memories). The system message is built once, and each session's
+history is kept as LangChain messages between turns.
 """
 
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationBufferMemory, ConversationBufferWindowMemory
-from langchain.schema import HumanMessage, AIMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnablePassthrough
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from langchain.schema import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 from flask import current_app
+from ..cache import NullCache, get_cache
+from ..metrics import CACHE_REQUESTS, LLM_TIER_DURATION, track_llm_time
 from .chat_history_service import ChatHistoryService
+from .conversation import ConversationBuffer
+from .llm_backends import UsageCallback, create_llm, estimate_tokens, prompt_key
+from .llm_resilience import LLMUnavailableError
+from .memory_service import MemoryService
+from .model_router import LIGHT, STANDARD, TIERS, ModelRouter, tier_settings
+from .retrieval import get_retrieval_index
+from .session_locks import get_session_locks
+from .turn_service import TurnCancelled
+from .usage_service import QuotaExceeded, UsageService
 
 
 class BitBraniacChatbot:
@@ -20,57 +39,48 @@ class BitBraniacChatbot:
         """Initialize the chatbot with configuration."""
         self.config = config
         self.llm = None
-        self.memory = None
-        self.window_memory = None
+        self.tier_llms = {}
+        self.router = None
         self.chain = None
+        self.tier_chains = {}
+        self.batch_chain = None
+        self.system_message = None
+        self._history_cache = OrderedDict()  # (session_id, user_id) -> (context generation, history messages)
+        self._history_lock = threading.Lock()
+        # Invalidations may have been lost while the shared cache was down
+        get_cache().on_reconnect(self.clear_memory)
+        self.retrieval = get_retrieval_index(current_app)
         self._setup_llm()
-        self._setup_memory()
         self._setup_chain()
     
     def _setup_llm(self):
-        """Set up the Google Generative AI model."""
+        """Set up the LLM backend (Google Generative AI unless configured otherwise)."""
         try:
-            api_key = self.config.GOOGLE_API_KEY
-            if not api_key:
-                raise ValueError("Google API key not found in configuration")
-            
-            self.llm = ChatGoogleGenerativeAI(
-                model=self.config.MODEL_NAME,
-                temperature=self.config.MODEL_TEMPERATURE,
-                max_output_tokens=self.config.MAX_OUTPUT_TOKENS,
-                google_api_key=api_key
-            )
+            self.llm = create_llm(self.config)
             
-            current_app.logger.info(f"LLM initialized with model: {self.config.MODEL_NAME}")
+            # One client per distinct (model, output budget, temperature) of the routing tiers
+            default_settings = (self.config['MODEL_NAME'], self.config['MAX_OUTPUT_TOKENS'], self.config['MODEL_TEMPERATURE'])
+            clients = {default_settings: self.llm}
+            self.router = ModelRouter(self.config) if self.config['ROUTING_ENABLED'] else None
+            self.tier_llms = {}
+            for tier in TIERS:
+                settings = tier_settings(self.config, tier) if self.router else default_settings
+                if settings not in clients:
+                    model_name, max_tokens, temperature = settings
+                    clients[settings] = create_llm(dict(
+                        self.config,
+                        MODEL_NAME=model_name,
+                        MAX_OUTPUT_TOKENS=max_tokens,
+                        MODEL_TEMPERATURE=temperature
+                    ))
+                self.tier_llms[tier] = (settings, clients[settings])
             
-        except Exception as e:
-            current_app.logger.error(f"Failed to initialize LLM: {str(e)}")
-            raise
-    
-    def _setup_memory(self):
-        """Set up conversation memory."""
-        try:
-            # Buffer memory for maintaining conversation context
-            self.memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                input_key="input",
-                output_key="output"
-            )
-            
-            # Window memory for recent context (fallback)
-            self.window_memory = ConversationBufferWindowMemory(
-                k=self.config.CONVERSATION_WINDOW_SIZE,
-                memory_key="recent_chat_history",
-                return_messages=True,
-                input_key="input",
-                output_key="output"
+            current_app.logger.info(
+                f"LLM initialized with backend: {self.config['LLM_BACKEND']}, model: {self.config['MODEL_NAME']}"
             )
             
-            current_app.logger.info("Memory systems initialized")
-            
         except Exception as e:
-            current_app.logger.error(f"Failed to initialize memory: {str(e)}")
+            current_app.logger.error(f"Failed to initialize LLM: {str(e)}")
             raise
     
     def _setup_chain(self):
@@ -107,22 +117,34 @@ Teaching approach:
 
 Remember: You're not just answering questions, you're nurturing the next generation of computer scientists! 🚀"""
 
-            # Create the prompt template
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", system_prompt),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("human", "{input}")
-            ])
-            
-            # Create the chain
-            self.chain = (
-                RunnablePassthrough.assign(
-                    chat_history=lambda x: self.memory.chat_memory.messages
+            if self.retrieval is not None:
+                # What to cover and how comes from the course notes picked for each question
+                system_prompt = """You are BitBraniac 🧠, an enthusiastic and patient AI Computer Science tutor. Explain concepts clearly, starting from the fundamentals, with analogies, practical examples and code when relevant, and the occasional emoji. Suggest practice problems and ask a follow-up question to check understanding. When course notes come with the student's question, base your answer on them and use their terminology."""
+
+            self.system_prompt = system_prompt
+            # Rendered once; every prompt starts with this same message
+            self.system_message = SystemMessage(content=system_prompt)
+            
+            # Create the chain, and one per routing tier
+            def build_chain(llm):
+                prompt = RunnableLambda(
+                    lambda x: self._prompt_messages(x["input"], x.get("history", ()), x.get("context", ''))
                 )
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+                return prompt | llm | StrOutputParser()
+            
+            self.chain = build_chain(self.llm)
+            chains = {id(self.llm): self.chain}
+            for tier, (settings, llm) in self.tier_llms.items():
+                if id(llm) not in chains:
+                    chains[id(llm)] = build_chain(llm)
+                self.tier_chains[tier] = chains[id(llm)]
+            
+            # Stateless chain for independent questions: inputs carry their
+            # tier and an empty history, and the lambda hands each input to
+            # the chain of its tier
+            prompt = RunnableLambda(lambda x: self._prompt_messages(x["input"], (), x["context"]))
+            stateless = {tier: prompt | llm | StrOutputParser() for tier, (settings, llm) in self.tier_llms.items()}
+            self.batch_chain = RunnableLambda(lambda x: stateless[x['tier']])
             
             current_app.logger.info("Conversation chain initialized")
             
@@ -130,35 +152,288 @@ Remember: You're not just answering questions, you're nurturing the next generat
             current_app.logger.error(f"Failed to initialize chain: {str(e)}")
             raise
     
-    def load_session_history(self, session_id, user_id):
-        """Load chat history from database into memory."""
-        try:
-            # Get messages from database
-            messages = ChatHistoryService.get_session_messages_for_memory(
-                session_id, user_id, limit=self.config.CONVERSATION_WINDOW_SIZE * 2
+    def reset_llm(self):
+        """Recreate the LLM client and chain (e.g. in a freshly forked worker process)."""
+        self._setup_llm()
+        self._setup_chain()
+    
+    def _history_limit(self):
+        return self.config['CONVERSATION_WINDOW_SIZE'] * 2
+    
+    def _route(self, message, history_size=0):
+        """Routing tier for a message with ``history_size`` messages before it."""
+        if self.router is None:
+            return STANDARD
+        route = self.router.route(message, history_size)
+        current_app.logger.debug(f"Message routed to {route.tier} tier ({route.reason})")
+        return route.tier
+    
+    def _course_notes(self, message, tier=STANDARD):
+        """The best matching course passages for a message, formatted for the system message."""
+        if self.retrieval is None or tier == LIGHT:
+            return ''
+        passages = self.retrieval.search(message, self.config['RETRIEVAL_TOP_K'], self.config['RETRIEVAL_MIN_SCORE'])
+        if not passages:
+            return ''
+        current_app.logger.debug(f"Course notes for message: {', '.join(p.title for p in passages)}")
+        notes = '\n\n'.join(f"### {p.title}\n{p.text}" for p in passages)
+        return f"Course notes relevant to the student's question:\n\n{notes}"
+    
+    def _memory_context(self, recalled, tier=STANDARD):
+        """Snippets recalled from the student's earlier sessions, formatted for the system message."""
+        if not recalled or tier == LIGHT:
+            return ''
+        lines = '\n'.join(f"- {snippet['text']}" for snippet in recalled)
+        return f"The student wrote this in earlier conversations (use it only if relevant):\n{lines}"
+    
+    def _message_context(self, message, tier=STANDARD, recalled=()):
+        """Everything sent along with a message: course notes and recalled memories."""
+        return '\n\n'.join(part for part in (self._course_notes(message, tier), self._memory_context(recalled, tier)) if part)
+    
+    def _prompt_messages(self, message, history, context=''):
+        """The prompt for a message: system message, history, then the message with its context.
+        
+        Only the last message differs from the previous turn's prompt plus
+        its answer, so the provider can reuse its cache of the rest.
+        """
+        content = f"{context}\n\nThe student's question:\n{message}" if context else message
+        return [self.system_message, *history, HumanMessage(content=content)]
+    
+    def _response_cache_key(self, message, tier=STANDARD, history=(), context=''):
+        """Key for a response: backend, model settings of the tier and the full prompt it would be given."""
+        messages = self._prompt_messages(message, history, context)
+        model_name, max_tokens, temperature = self.tier_llms[tier][0]
+        return f"response:{self.config['LLM_BACKEND']}:{model_name}:{max_tokens}:{temperature}:{prompt_key(messages)}"
+    
+    def _generate_response(self, message, tier=STANDARD, usage=None, context='', history=()):
+        """Answer from the shared response cache, or invoke the tier's chain and cache the result."""
+        ttl = self.config['CACHE_RESPONSE_TTL']
+        if ttl:
+            cache = get_cache()
+            key = self._response_cache_key(message, tier, history, context)
+            response = cache.get(key)
+            if response is not None:
+                CACHE_REQUESTS.inc(kind='response', result='hit')
+                return response
+            CACHE_REQUESTS.inc(kind='response', result='miss')
+        
+        with track_llm_time(), LLM_TIER_DURATION.time(tier=tier):
+            response = self.tier_chains[tier].invoke(
+                {"input": message, "context": context, "history": history}, config={'callbacks': [usage] if usage else []}
             )
+        
+        if ttl:
+            cache.set(key, response, ttl=ttl)
+        return response
+    
+    def _stream_chain(self, chain, message, chunks, stop, usage=None, context='', history=()):
+        """Feed chain output into ``chunks`` until done or ``stop`` is set."""
+        stream = chain.stream(
+            {"input": message, "context": context, "history": history}, config={'callbacks': [usage] if usage else []}
+        )
+        try:
+            for chunk in stream:
+                if stop.is_set():
+                    return
+                chunks.put(('chunk', chunk))
+            chunks.put(('end', None))
+        except Exception as e:
+            chunks.put(('error', e))
+        finally:
+            # Closing the stream drops the upstream request
+            stream.close()
+    
+    def _generate_chunks(self, message, turn, tier=STANDARD, usage=None, context='', history=()):
+        """Yield the response in chunks, stopping as soon as the turn is cancelled.
+        
+        The chain runs on a helper thread so this thread can give up on a
+        cancelled turn right away instead of waiting for the next chunk; the
+        helper abandons the upstream call when its next chunk arrives.
+        """
+        ttl = self.config['CACHE_RESPONSE_TTL']
+        if ttl:
+            cache = get_cache()
+            key = self._response_cache_key(message, tier, history, context)
+            response = cache.get(key)
+            if response is not None:
+                CACHE_REQUESTS.inc(kind='response', result='hit')
+                yield response
+                return
+            CACHE_REQUESTS.inc(kind='response', result='miss')
+        
+        turn.check()
+        chunks = queue.Queue()
+        stop = threading.Event()
+        threading.Thread(
+            target=self._stream_chain, args=(self.tier_chains[tier], message, chunks, stop, usage, context, history),
+            name='llm-stream', daemon=True
+        ).start()
+        
+        parts = []
+        try:
+            with track_llm_time(), LLM_TIER_DURATION.time(tier=tier):
+                while True:
+                    try:
+                        kind, value = chunks.get(timeout=turn.wait_interval())
+                    except queue.Empty:
+                        turn.check()
+                        continue
+                    if kind == 'end':
+                        break
+                    if kind == 'error':
+                        raise value
+                    parts.append(value)
+                    yield value
+                    turn.check()
+        finally:
+            stop.set()
+        
+        if ttl:
+            cache.set(key, ''.join(parts), ttl=ttl)
+    
+    def answer_batch(self, questions, concurrency, user_id=None):
+        """
+        Answer independent questions concurrently, without conversation history.
+        
+        Yields ``(index, response, error)`` as each question is answered, in
+        completion order. At most ``concurrency`` questions run at once, and
+        the user's quota is checked before each one starts: once it is used
+        up, the remaining questions fail with ``QuotaExceeded``. Closing the
+        generator early drops questions that have not started yet.
+        """
+        ttl = self.config['CACHE_RESPONSE_TTL']
+        cache = get_cache() if ttl else None
+        pending = []  # (index, input, cache key)
+        
+        for index, question in enumerate(questions):
+            tier = self._route(question, history_size=0)
+            context = self._message_context(question, tier)
+            key = None
+            if ttl:
+                key = self._response_cache_key(question, tier, history=[], context=context)
+                response = cache.get(key)
+                if response is not None:
+                    CACHE_REQUESTS.inc(kind='response', result='hit')
+                    yield index, response, None
+                    continue
+                CACHE_REQUESTS.inc(kind='response', result='miss')
+            pending.append((index, {'input': question, 'tier': tier, 'context': context}, key))
+        
+        if not pending:
+            return
+        
+        waiting = deque(pending)
+        running = {}  # future -> (index, input, cache key, usage, estimated prompt tokens)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='llm-batch')
+        try:
+            with track_llm_time():
+                while waiting or running:
+                    # Start questions as slots free up, each only if the user is still
+                    # within quota counting the questions already running
+                    while waiting and len(running) < concurrency:
+                        index, inputs, key = waiting.popleft()
+                        prompt_tokens = estimate_tokens(self.system_prompt + inputs['context'] + inputs['input'])
+                        quota = UsageService.check_quota(
+                            user_id, sum(item[4] for item in running.values()), len(running)
+                        )
+                        if not quota['success']:
+                            yield index, None, QuotaExceeded(quota)
+                            continue
+                        usage = UsageCallback()
+                        future = executor.submit(self.batch_chain.invoke, inputs, {'callbacks': [usage]})
+                        running[future] = (index, inputs, key, usage, prompt_tokens)
+                    if not running:
+                        break
+                    
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index, inputs, key, usage, prompt_tokens = running.pop(future)
+                        error = future.exception()
+                        output = None if error else future.result()
+                        if usage.called:
+                            self._record_usage(user_id, usage, prompt_tokens, [] if error else [output])
+                        
+                        if error:
+                            current_app.logger.error(f"Batch question error: {str(error)}")
+                            yield index, None, error
+                            continue
+                        
+                        if key:
+                            cache.set(key, output, ttl=ttl)
+                        yield index, output, None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _record_usage(self, user_id, usage, prompt_tokens, parts):
+        """Count a model call, estimating what the model did not report (e.g. a stream cut short)."""
+        if usage.reported:
+            UsageService.record(user_id, usage.prompt_tokens, usage.completion_tokens)
+        else:
+            UsageService.record(user_id, prompt_tokens, estimate_tokens(''.join(parts)) if parts else 0)
+    
+    def _save_partial_response(self, session_id, user_id, parts):
+        if session_id and user_id and parts and self.config['CHAT_SAVE_PARTIAL_RESPONSES']:
+            ChatHistoryService.add_message_to_session(session_id, user_id, 'assistant', ''.join(parts))
+    
+    def _cached_history(self, session_id, user_id, generation):
+        """A session's history messages kept from an earlier turn, if the session has not changed since."""
+        with self._history_lock:
+            cached = self._history_cache.get((session_id, user_id))
+            if cached is None or cached[0] != generation:
+                return None
+            self._history_cache.move_to_end((session_id, user_id))
+            return cached[1]
+    
+    def _cache_history(self, session_id, user_id, generation, messages):
+        size = self.config['PROMPT_HISTORY_CACHE_SESSIONS']
+        # Without a cache backend generations never change and cannot tell a stale history
+        if not size or generation < 0 or isinstance(get_cache(), NullCache):
+            return
+        with self._history_lock:
+            self._history_cache[(session_id, user_id)] = (generation, tuple(messages))
+            self._history_cache.move_to_end((session_id, user_id))
+            while len(self._history_cache) > size:
+                self._history_cache.popitem(last=False)
+    
+    def load_session_history(self, session_id, user_id, query=None, generation=None):
+        """Load chat history from database into a new conversation, and recall
+        what from the user's other sessions is relevant to ``query``.
+        
+        ``generation`` is the session's context generation, if the caller
+        already read it. Returns (conversation, recalled snippets); the
+        conversation is empty if the history could not be loaded.
+        """
+        conversation = ConversationBuffer(self._history_limit())
+        recalled = []
+        try:
+            if generation is None:
+                generation = ChatHistoryService.context_generation(session_id)
+            history = self._cached_history(session_id, user_id, generation)
             
-            # Clear current memory
-            self.memory.clear()
-            self.window_memory.clear()
+            if history is not None:
+                conversation.extend_messages(history)
+            else:
+                # Get messages from database
+                messages = ChatHistoryService.get_session_messages_for_memory(
+                    session_id, user_id, limit=self._history_limit()
+                )
+                for msg in messages:
+                    conversation.append(msg["type"], msg["content"])
+                self._cache_history(session_id, user_id, generation, conversation.messages())
             
-            # Load messages into memory
-            for msg in messages:
-                if msg["type"] == "human":
-                    self.memory.chat_memory.add_user_message(msg["content"])
-                    self.window_memory.chat_memory.add_user_message(msg["content"])
-                elif msg["type"] == "ai":
-                    self.memory.chat_memory.add_ai_message(msg["content"])
-                    self.window_memory.chat_memory.add_ai_message(msg["content"])
+            recalled = MemoryService.recall(user_id, query, exclude_session_id=session_id) if query else []
             
-            current_app.logger.info(f"Loaded {len(messages)} messages from session {session_id}")
-            return True
+            current_app.logger.info(
+                f"Loaded {len(conversation)} messages from session {session_id}, "
+                f"recalled {len(recalled)} from earlier sessions"
+            )
             
         except Exception as e:
             current_app.logger.error(f"Failed to load session history: {str(e)}")
-            return False
+            conversation.clear()
+        return conversation, recalled
     
-    def chat(self, message, session_id=None, user_id=None):
+    def chat(self, message, session_id=None, user_id=None, turn=None):
         """
         Process a chat message and return response.
         
@@ -166,49 +441,142 @@ Remember: You're not just answering questions, you're nurturing the next generat
             message (str): User's message
             session_id (str, optional): Chat session ID for persistent history
             user_id (str, optional): User ID for session validation
+            turn (Turn, optional): Deadline and cancellation state for this message
             
         Returns:
             dict: Response containing success status, message, and session info
         """
+        # Run the generator to the end so its cleanup (session lock, usage) happens here
+        result = None
+        for kind, value in self.chat_stream(message, session_id, user_id, turn):
+            if kind == 'result':
+                result = value
+        return result
+    
+    def chat_stream(self, message, session_id=None, user_id=None, turn=None):
+        """
+        Process a chat message, yielding ``('chunk', text)`` as the response is
+        generated and finally ``('result', dict)`` with the same result as ``chat``.
+        
+        Closing the generator while chunks are being yielded (the client went
+        away) stops generation and saves the partial response if configured.
+        The result is yielded after the turn is cleaned up, so closing the
+        generator once it has arrived changes nothing.
+        """
+        quota = UsageService.check_quota(user_id)
+        if not quota['success']:
+            yield 'result', {
+                'success': False,
+                'quota_exceeded': True,
+                'retry_after': quota['retry_after'],
+                'error': quota['message'],
+                'session_id': session_id
+            }
+            return
+        
+        parts = []
+        usage = UsageCallback()
+        prompt_tokens = 0
+        session_lock = None
         try:
-            # If session_id is provided, load history and save messages
+            # If session_id is provided, load history and save messages;
+            # anonymous messages start from an empty conversation
+            conversation, recalled = ConversationBuffer(self._history_limit()), []
             if session_id and user_id:
+                # Turns of one session run one at a time, each seeing the one before
+                session_lock = get_session_locks().acquire(session_id, turn)
+                generation = ChatHistoryService.context_generation(session_id)
+                
                 # Load existing session history
-                self.load_session_history(session_id, user_id)
+                conversation, recalled = self.load_session_history(session_id, user_id, query=message, generation=generation)
                 
                 # Save user message to database
                 ChatHistoryService.add_message_to_session(
                     session_id, user_id, 'user', message
                 )
             
-            # Generate response using the chain
-            response = self.chain.invoke({"input": message})
+            # Generate response using the chain of the message's tier
+            tier = self._route(message, len(conversation))
+            context = self._message_context(message, tier, recalled)
+            history = conversation.messages()
+            prompt_tokens = estimate_tokens(self.system_prompt + context + message) + sum(
+                estimate_tokens(entry.content) for entry in conversation
+            )
+            if turn is None:
+                parts.append(self._generate_response(message, tier, usage, context, history))
+            else:
+                for chunk in self._generate_chunks(message, turn, tier, usage, context, history):
+                    parts.append(chunk)
+                    yield 'chunk', chunk
+            response = ''.join(parts)
             
             # Add to memory for current conversation
-            self.memory.chat_memory.add_user_message(message)
-            self.memory.chat_memory.add_ai_message(response)
-            self.window_memory.chat_memory.add_user_message(message)
-            self.window_memory.chat_memory.add_ai_message(response)
+            conversation.add_user_message(message)
+            conversation.add_ai_message(response)
             
             # Save assistant response to database if session exists
             if session_id and user_id:
                 ChatHistoryService.add_message_to_session(
                     session_id, user_id, 'assistant', response
                 )
+                
+                # Both messages above bumped the generation once; anything more
+                # means another request wrote to the session and the cache stays cold
+                if generation >= 0:
+                    ChatHistoryService.cache_session_context(
+                        session_id, user_id, self._history_limit(), conversation.to_dicts(), generation + 2
+                    )
+                    self._cache_history(session_id, user_id, generation + 2, conversation.messages())
             
-            return {
+            result = {
                 'success': True,
                 'response': response,
                 'session_id': session_id
             }
             
+        except TurnCancelled as e:
+            current_app.logger.info(f"Turn {turn.turn_id} stopped: {e.reason}")
+            self._save_partial_response(session_id, user_id, parts)
+            result = {
+                'success': False,
+                'cancelled': True,
+                'reason': e.reason,
+                'partial_response': ''.join(parts),
+                'error': 'Response took too long. Please try again.' if e.reason == 'deadline' else 'Message was cancelled.',
+                'session_id': session_id
+            }
+        
+        except GeneratorExit:
+            if turn is not None:
+                turn.cancel('disconnected')
+            self._save_partial_response(session_id, user_id, parts)
+            raise
+        
+        except LLMUnavailableError as e:
+            current_app.logger.error(f"Chat model unavailable: {str(e)}")
+            result = {
+                'success': False,
+                'unavailable': True,
+                'error': 'BitBraniac is temporarily unavailable. Please try again in a moment.',
+                'session_id': session_id
+            }
+            
         except Exception as e:
             current_app.logger.error(f"Chat processing error: {str(e)}")
-            return {
+            result = {
                 'success': False,
                 'error': 'Failed to process message. Please try again.',
                 'session_id': session_id
             }
+        
+        finally:
+            if session_lock is not None:
+                session_lock.release()
+            # Cached answers never reach the model and cost nothing
+            if usage.called:
+                self._record_usage(user_id, usage, prompt_tokens, parts)
+        
+        yield 'result', result
     
     def get_welcome_message(self):
         """Get the welcome message for new users."""
@@ -216,30 +584,28 @@ Remember: You're not just answering questions, you're nurturing the next generat
 
 Ask me anything about **programming, algorithms, databases, AI, and more!** Let's dive into the world of Computer Science! 🚀"""
     
-    def clear_memory(self):
-        """Clear conversation memory."""
+    def clear_memory(self, user_id=None):
+        """Forget the session histories kept between turns (of one user, or all)."""
         try:
-            self.memory.clear()
-            self.window_memory.clear()
+            with self._history_lock:
+                for key in [key for key in self._history_cache if user_id is None or key[1] == user_id]:
+                    del self._history_cache[key]
             current_app.logger.info("Memory cleared")
             return True
         except Exception as e:
             current_app.logger.error(f"Failed to clear memory: {str(e)}")
             return False
     
-    def get_conversation_history(self):
-        """Get current conversation history."""
+    def get_conversation_history(self, session_id=None, user_id=None):
+        """Get the conversation window of a user's session (empty without one)."""
         try:
-            messages = []
-            for message in self.memory.chat_memory.messages:
-                if isinstance(message, HumanMessage):
-                    messages.append({"type": "human", "content": message.content})
-                elif isinstance(message, AIMessage):
-                    messages.append({"type": "ai", "content": message.content})
-            
+            history = []
+            if session_id and user_id:
+                conversation, _ = self.load_session_history(session_id, user_id)
+                history = conversation.to_dicts()
             return {
                 'success': True,
-                'history': messages
+                'history': history
             }
             
         except Exception as e:
@@ -0,0 +1,89 @@
+"""
+Conversation buffer for BitBraniac application.
+
+The conversation the chatbot answers from is a fixed-size ring of
+(role, content) entries holding at most the last
+``CONVERSATION_WINDOW_SIZE * 2`` messages: the same window that is loaded
+from the database, so a long conversation never grows past it. Entries
+become LangChain messages only when a prompt is built; each entry keeps its
+message once built, so later turns reuse it.
+"""
+
+from langchain.schema import AIMessage, HumanMessage
+
+
+HUMAN = 'human'
+AI = 'ai'
+
+
+class ConversationEntry:
+    """One message of a conversation."""
+
+    __slots__ = ('role', 'content', '_message')
+
+    def __init__(self, role, content, message=None):
+        self.role = role
+        self.content = content
+        self._message = message
+
+    def message(self):
+        """The entry as a LangChain message."""
+        if self._message is None:
+            self._message = HumanMessage(content=self.content) if self.role == HUMAN else AIMessage(content=self.content)
+        return self._message
+
+
+class ConversationBuffer:
+    """The last ``capacity`` messages of a conversation, oldest first."""
+
+    __slots__ = ('capacity', '_entries', '_head', '_size')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._entries = [None] * capacity
+        self._head = 0  # position of the oldest entry
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._entries[(self._head + i) % self.capacity]
+
+    def append(self, role, content, message=None):
+        """Add a message, dropping the oldest one when the buffer is full."""
+        if not self.capacity:
+            return
+        entry = ConversationEntry(role, content, message)
+        if self._size < self.capacity:
+            self._entries[(self._head + self._size) % self.capacity] = entry
+            self._size += 1
+        else:
+            self._entries[self._head] = entry
+            self._head = (self._head + 1) % self.capacity
+
+    def add_user_message(self, content):
+        self.append(HUMAN, content)
+
+    def add_ai_message(self, content):
+        self.append(AI, content)
+
+    def extend_messages(self, messages):
+        """Add LangChain human and AI messages, keeping them for reuse in prompts."""
+        for message in messages:
+            if message.type in (HUMAN, AI):
+                self.append(message.type, message.content, message)
+
+    def clear(self):
+        self._entries = [None] * self.capacity
+        self._head = 0
+        self._size = 0
+
+    def messages(self):
+        """The conversation as LangChain messages, for a prompt."""
+        return [entry.message() for entry in self]
+
+    def to_dicts(self):
+        """The conversation as ``{"type", "content"}`` dicts, the format cached per session."""
+        return [{"type": entry.role, "content": entry.content} for entry in self]
@@ -0,0 +1,189 @@
+"""
+Chat history export/import service for BitBraniac application.
+
+History is exchanged as NDJSON: one ``session`` record followed by the
+``message`` records that belong to it. Export streams rows from a server-side
+cursor and import inserts in batched transactions, so memory use stays
+constant regardless of history size.
+"""
+
+import json
+import uuid
+from datetime import datetime
+from flask import current_app
+from ..events import notify_session_change
+from ..models import ChatSession, ChatMessage, SessionArchive, SessionChange, db
+from .archive_service import ArchiveService
+from .change_log_service import ChangeLogService
+from .memory_service import MemoryService
+
+
+MESSAGE_TYPES = ('user', 'assistant')
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value) if value else datetime.utcnow()
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+class HistoryTransferService:
+    """Service class for streaming export and bulk import of chat history."""
+
+    @staticmethod
+    def iter_export(user_id, batch_size=None):
+        """Yield NDJSON chunks with all active sessions and messages of a user."""
+        batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+
+        # One ordered outer join walked with a server-side cursor; plain columns
+        # keep the ORM identity map from growing with the result set
+        query = db.select(
+            ChatSession.id, ChatSession.title, ChatSession.created_at, ChatSession.updated_at,
+            SessionArchive.segment, SessionArchive.offset, SessionArchive.length,
+            ChatMessage.id, ChatMessage.message_type, ChatMessage.content, ChatMessage.created_at
+        ).select_from(ChatSession).outerjoin(
+            SessionArchive, SessionArchive.session_id == ChatSession.id
+        ).outerjoin(
+            ChatMessage, ChatMessage.session_id == ChatSession.id
+        ).where(
+            ChatSession.user_id == user_id,
+            ChatSession.is_active.is_(True)
+        ).order_by(
+            ChatSession.created_at, ChatSession.id, ChatMessage.created_at
+        ).execution_options(yield_per=batch_size)
+
+        chunk = []
+        current_session_id = None
+
+        for row in db.session.execute(query):
+            (session_id, title, created_at, updated_at,
+             segment, offset, length,
+             message_id, message_type, content, message_created_at) = row
+
+            if session_id != current_session_id:
+                current_session_id = session_id
+                chunk.append(_dumps({
+                    'type': 'session',
+                    'id': session_id,
+                    'title': title,
+                    'created_at': created_at.isoformat(),
+                    'updated_at': updated_at.isoformat()
+                }))
+
+                if segment is not None:
+                    archive = SessionArchive(segment=segment, offset=offset, length=length)
+                    for msg in ArchiveService.load_archived_messages(archive):
+                        chunk.append(_dumps({'type': 'message', 'session_id': session_id, **msg}))
+
+            if message_id is not None:
+                chunk.append(_dumps({
+                    'type': 'message',
+                    'session_id': session_id,
+                    'id': message_id,
+                    'message_type': message_type,
+                    'content': content,
+                    'created_at': message_created_at.isoformat()
+                }))
+
+            if len(chunk) >= batch_size:
+                yield ''.join(chunk)
+                chunk = []
+
+        if chunk:
+            yield ''.join(chunk)
+
+    @staticmethod
+    def _flush(user_id, session_rows, message_rows):
+        """Insert a batch of sessions and messages in one transaction."""
+        if session_rows:
+            db.session.execute(ChatSession.__table__.insert(), session_rows)
+            # Imported messages ride along with their session's creation
+            ChangeLogService.record_many(user_id, [row['id'] for row in session_rows], SessionChange.CREATED)
+        if message_rows:
+            db.session.execute(ChatMessage.__table__.insert(), message_rows)
+            # Their original timestamps may be behind the memory index cursor
+            MemoryService.request_update(user_id, session_ids={row['session_id'] for row in message_rows})
+        db.session.commit()
+        notify_session_change()
+
+    @staticmethod
+    def import_records(user_id, lines, batch_size=None):
+        """Import NDJSON lines into new sessions owned by the user."""
+        batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+        session_ids = {}  # exported id -> new id
+        session_rows = []
+        message_rows = []
+        sessions_imported = 0
+        messages_imported = 0
+        skipped = 0
+
+        try:
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+
+                if record.get('type') == 'session' and record.get('id'):
+                    new_id = str(uuid.uuid4())
+                    session_ids[record['id']] = new_id
+                    session_rows.append({
+                        'id': new_id,
+                        'user_id': user_id,
+                        'title': (record.get('title') or 'New Chat')[:200],
+                        'created_at': _parse_datetime(record.get('created_at')),
+                        'updated_at': _parse_datetime(record.get('updated_at') or record.get('created_at')),
+                        'is_active': True
+                    })
+                    sessions_imported += 1
+
+                elif (record.get('type') == 'message'
+                      and record.get('session_id') in session_ids
+                      and record.get('message_type') in MESSAGE_TYPES
+                      and isinstance(record.get('content'), str)):
+                    message_rows.append({
+                        'id': str(uuid.uuid4()),
+                        'session_id': session_ids[record['session_id']],
+                        'message_type': record['message_type'],
+                        'content': record['content'],
+                        'created_at': _parse_datetime(record.get('created_at'))
+                    })
+                    messages_imported += 1
+
+                else:
+                    skipped += 1
+                    continue
+
+                if len(session_rows) + len(message_rows) >= batch_size:
+                    HistoryTransferService._flush(user_id, session_rows, message_rows)
+                    session_rows = []
+                    message_rows = []
+
+            HistoryTransferService._flush(user_id, session_rows, message_rows)
+
+            return {
+                'success': True,
+                'sessions_imported': sessions_imported,
+                'messages_imported': messages_imported,
+                'skipped': skipped
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Import chat history error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to import chat history'
+            }
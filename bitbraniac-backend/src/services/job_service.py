@@ -0,0 +1,312 @@
+"""
+Background job service for BitBraniac application.
+
+Work that does not have to happen inside a request is stored as a ``Job`` row
+and run later by a pool of ``JOBS_WORKERS`` threads in each process. Jobs
+live in the application database, so they survive restarts and every worker
+process of ``src/server.py`` shares one queue.
+
+- ``JobService.enqueue`` adds a job to the caller's transaction, so the job
+  exists exactly when the caller's changes are committed;
+  ``JobService.submit`` enqueues and commits on its own.
+- Jobs run in ``priority`` order (higher first), then oldest first, once
+  their ``run_at`` has passed. Enqueue with ``delay`` to let jobs collect
+  into batches.
+- A ``dedupe_key`` collapses repeated requests for the same work while the
+  first one is still queued.
+- A failing job is retried with jittered exponential backoff up to
+  ``max_attempts`` times, then kept as ``failed`` for
+  ``JOBS_FAILED_RETENTION_DAYS``. Jobs held by a worker that died are picked
+  up again once their ``JOBS_LEASE_SECONDS`` lease runs out.
+
+Handlers are registered per kind with ``register_job``. A handler is called
+with a list of payloads: up to ``batch_size`` due jobs of the same kind are
+claimed together, and the whole batch succeeds or fails as one.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from ..metrics import JOB_DURATION, JOB_QUEUE_DEPTH, JOBS_PROCESSED
+from ..models import Job, db
+
+
+_handlers = {}  # kind -> (handler, batch_size)
+
+
+def register_job(kind, batch_size=1):
+    """Decorator registering the handler for a job kind.
+
+    ``batch_size`` is a number or a function of the app config.
+    """
+    def decorator(handler):
+        _handlers[kind] = (handler, batch_size)
+        return handler
+    return decorator
+
+
+class JobService:
+    """Service class for enqueueing and running background jobs."""
+
+    @staticmethod
+    def enqueue(kind, payload=None, priority=0, delay=0, dedupe_key=None, max_attempts=None):
+        """Add a job to the current transaction; the caller commits."""
+        if dedupe_key:
+            existing = Job.query.filter_by(dedupe_key=dedupe_key, status=Job.QUEUED).first()
+            if existing:
+                return existing
+
+        job = Job(
+            kind=kind,
+            payload=json.dumps(payload or {}, separators=(',', ':')),
+            priority=priority,
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+            dedupe_key=dedupe_key,
+            max_attempts=max_attempts or current_app.config['JOBS_MAX_ATTEMPTS']
+        )
+        db.session.add(job)
+        return job
+
+    @staticmethod
+    def submit(kind, payload=None, priority=0, delay=0, dedupe_key=None, max_attempts=None):
+        """Enqueue a job and commit it right away."""
+        try:
+            job = JobService.enqueue(kind, payload, priority, delay, dedupe_key, max_attempts)
+            db.session.commit()
+            if not delay:
+                JobService.wake()
+
+            return {
+                'success': True,
+                'job_id': job.id
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Submit job error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to submit job'
+            }
+
+    @staticmethod
+    def wake():
+        """Let this process's workers look for due jobs now instead of at the next poll."""
+        pool = current_app.extensions.get('job_pool')
+        if pool is not None:
+            pool.wake()
+
+    @staticmethod
+    def _batch_size(kind):
+        batch_size = _handlers[kind][1] if kind in _handlers else 1
+        return batch_size(current_app.config) if callable(batch_size) else batch_size
+
+    @staticmethod
+    def claim():
+        """Lock the next due job, and up to a batch of due jobs of the same kind.
+
+        Returns (kind, jobs); jobs is empty when nothing is due or another
+        worker got there first.
+        """
+        now = datetime.utcnow()
+        due = Job.query.filter(Job.status == Job.QUEUED, Job.run_at <= now)
+        order = (Job.priority.desc(), Job.run_at.asc(), Job.id.asc())
+
+        first = due.with_entities(Job.id, Job.kind).order_by(*order).first()
+        if first is None:
+            return None, []
+
+        ids = [first.id]
+        batch_size = JobService._batch_size(first.kind)
+        if batch_size > 1:
+            ids += [row.id for row in due.with_entities(Job.id).filter(
+                Job.kind == first.kind, Job.id != first.id
+            ).order_by(*order).limit(batch_size - 1)]
+
+        # Only rows still queued are taken, so concurrent workers never share a job
+        token = uuid.uuid4().hex
+        claimed = Job.query.filter(Job.id.in_(ids), Job.status == Job.QUEUED).update({
+            Job.status: Job.RUNNING,
+            Job.locked_by: token,
+            Job.locked_at: now,
+            Job.attempts: Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return first.kind, []
+
+        return first.kind, Job.query.filter_by(locked_by=token).order_by(*order).all()
+
+    @staticmethod
+    def _retry_delay(attempts):
+        config = current_app.config
+        delay = min(config['JOBS_RETRY_BASE_DELAY'] * 2 ** (attempts - 1), config['JOBS_RETRY_MAX_DELAY'])
+        # Jitter so jobs that failed together don't retry together
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def run(kind, jobs):
+        """Run a claimed batch and record the outcome of each job."""
+        try:
+            if kind not in _handlers:
+                raise LookupError(f"No handler registered for job kind '{kind}'")
+
+            handler = _handlers[kind][0]
+            with JOB_DURATION.time(kind=kind):
+                handler([json.loads(job.payload) for job in jobs])
+
+            Job.query.filter(Job.id.in_([job.id for job in jobs])).delete(synchronize_session=False)
+            db.session.commit()
+            JOBS_PROCESSED.inc(len(jobs), kind=kind, outcome='done')
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Job {kind} error: {str(e)}")
+
+            now = datetime.utcnow()
+            for job in jobs:
+                job.last_error = str(e)[:2000]
+                job.locked_by = None
+                job.locked_at = None
+                if job.attempts >= job.max_attempts:
+                    job.status = Job.FAILED
+                    JOBS_PROCESSED.inc(kind=kind, outcome='failed')
+                else:
+                    job.status = Job.QUEUED
+                    job.run_at = now + timedelta(seconds=JobService._retry_delay(job.attempts))
+                    JOBS_PROCESSED.inc(kind=kind, outcome='retry')
+            db.session.commit()
+            return False
+
+    @staticmethod
+    def release_expired_leases():
+        """Requeue jobs whose worker stopped without finishing them."""
+        cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOBS_LEASE_SECONDS'])
+        expired = Job.query.filter(Job.status == Job.RUNNING, Job.locked_at < cutoff)
+
+        failed = expired.filter(Job.attempts >= Job.max_attempts).update({
+            Job.status: Job.FAILED,
+            Job.locked_by: None,
+            Job.last_error: 'Lease expired'
+        }, synchronize_session=False)
+        released = expired.update({
+            Job.status: Job.QUEUED,
+            Job.locked_by: None,
+            Job.locked_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+        return released + failed
+
+    @staticmethod
+    def queue_depth():
+        """Number of jobs per (kind, status)."""
+        rows = db.session.query(Job.kind, Job.status, func.count(Job.id)).group_by(Job.kind, Job.status).all()
+        return {(kind, status): count for kind, status, count in rows}
+
+    @staticmethod
+    def prune(retention_days=None):
+        """Delete failed jobs older than the retention period."""
+        retention_days = current_app.config['JOBS_FAILED_RETENTION_DAYS'] if retention_days is None else retention_days
+
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            pruned = Job.query.filter(
+                Job.status == Job.FAILED,
+                Job.run_at < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+            return {
+                'success': True,
+                'jobs_pruned': pruned
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Job prune error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to prune jobs'
+            }
+
+
+class JobWorkerPool:
+    """Threads that claim and run due jobs."""
+
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config['JOBS_WORKERS']
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.threads = []
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the threads once per process (after any fork)."""
+        if self.threads:
+            return
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.size):
+                thread = threading.Thread(target=self._work, args=(i,), name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def stop(self):
+        self._stopping = True
+        self.wake()
+
+    def _work(self, index):
+        last_lease_check = 0.0
+        while not self._stopping:
+            ran = False
+            with self.app.app_context():
+                try:
+                    # One thread per pool looks for jobs abandoned by dead workers
+                    if index == 0 and time.monotonic() - last_lease_check > self.poll_interval * 30:
+                        last_lease_check = time.monotonic()
+                        JobService.release_expired_leases()
+
+                    kind, jobs = JobService.claim()
+                    if jobs:
+                        JobService.run(kind, jobs)
+                    ran = kind is not None
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.error(f"Job worker error: {str(e)}")
+                finally:
+                    db.session.remove()
+
+            if not ran:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+
+
+def init_jobs(app):
+    """Create the job worker pool; it starts with the first request of each process."""
+    pool = JobWorkerPool(app)
+    app.extensions['job_pool'] = pool
+
+    def collect_queue_depth():
+        try:
+            return JobService.queue_depth()
+        except Exception:
+            return {}
+
+    JOB_QUEUE_DEPTH.set_function(collect_queue_depth)
+
+    if app.config.get('JOBS_ENABLED'):
+        app.before_request(pool.ensure_started)
+    return pool
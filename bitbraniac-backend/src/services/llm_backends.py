@@ -0,0 +1,375 @@
+"""
+LLM backends for BitBraniac application.
+
+``create_llm`` builds the chat model selected by ``LLM_BACKEND``:
+
+- ``google``: Google Gemini via ``ChatGoogleGenerativeAI`` (default)
+- ``fake``: deterministic local stand-in for benchmarks and tests, with
+  optional injected provider errors and slow tail calls
+- ``replay``: serves responses captured earlier with ``LLM_RECORD_PATH``
+
+The backend is wrapped with retries, a circuit breaker and optional hedging
+(see ``llm_resilience``) unless ``LLM_RESILIENCE_ENABLED`` is false. When
+``LLM_RECORD_PATH`` is set, every call is also recorded (rendered prompt,
+response, token counts and timings) to that file.
+"""
+
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+import zstandard
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from .llm_resilience import make_resilient
+from .tokens import estimate_tokens
+
+
+FAKE_VOCABULARY = (
+    'algorithm', 'array', 'binary', 'cache', 'class', 'compiler', 'complexity', 'data',
+    'database', 'function', 'graph', 'hash', 'heap', 'index', 'loop', 'memory',
+    'network', 'node', 'object', 'pointer', 'process', 'query', 'queue', 'recursion',
+    'search', 'sort', 'stack', 'string', 'thread', 'tree', 'type', 'variable'
+)
+
+
+class FakeProviderError(Exception):
+    """Transient provider failure injected by ``FakeChatModel``."""
+
+    code = 503
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Collects the token usage reported by the model calls of one chain run."""
+
+    def __init__(self):
+        self.called = False
+        self.reported = False
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.called = True
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.called = True
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    self.reported = True
+                    self.prompt_tokens += usage.get('input_tokens', 0)
+                    self.completion_tokens += usage.get('output_tokens', 0)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model with a configurable latency profile.
+
+    The reply depends only on the last message, and timing is
+    ``latency + response_tokens / tokens_per_second``. A ``failure_rate``
+    share of calls raise ``FakeProviderError`` and a ``tail_rate`` share wait
+    ``tail_latency`` seconds instead of ``latency``, to exercise retries and
+    hedging.
+    """
+
+    latency: float = 0.0
+    tokens_per_second: float = 0.0  # 0 disables per-token delay
+    response_tokens: int = 64
+    failure_rate: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return 'bitbraniac-fake'
+
+    def _response_words(self, messages):
+        digest = hashlib.sha256(str(messages[-1].content).encode('utf-8')).digest()
+        return [
+            FAKE_VOCABULARY[digest[i % len(digest)] % len(FAKE_VOCABULARY)]
+            for i in range(self.response_tokens)
+        ]
+
+    def _usage(self, messages, output_tokens):
+        input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        return {
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens
+        }
+
+    def _first_token_latency(self):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise FakeProviderError('Fake provider unavailable')
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.tail_latency
+        return self.latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self._response_words(messages)
+        delay = self._first_token_latency() + (len(words) / self.tokens_per_second if self.tokens_per_second else 0)
+        if delay:
+            time.sleep(delay)
+
+        message = AIMessage(content=' '.join(words), usage_metadata=self._usage(messages, len(words)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self._response_words(messages)
+        latency = self._first_token_latency()
+        if latency:
+            time.sleep(latency)
+
+        for i, word in enumerate(words):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else ' ' + word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content='',
+            usage_metadata=self._usage(messages, len(words))
+        ))
+
+
+def prompt_key(messages):
+    """Stable key for a rendered prompt."""
+    digest = hashlib.sha256()
+    for message in messages:
+        digest.update(message.type.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(str(message.content).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def question_key(messages):
+    """Key for the last message only, used when the full prompt has no recording."""
+    return hashlib.sha256(str(messages[-1].content).encode('utf-8')).hexdigest()
+
+
+class LLMRecorder:
+    """Appends LLM interactions to a log of zstd-compressed NDJSON frames."""
+
+    def __init__(self, path, compression_level=9):
+        self.path = path
+        self.compressor = zstandard.ZstdCompressor(level=compression_level)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, messages, response, usage, latency, duration, model):
+        output_tokens = (usage or {}).get('output_tokens') or estimate_tokens(response)
+        input_tokens = (usage or {}).get('input_tokens') or sum(estimate_tokens(str(m.content)) for m in messages)
+        entry = {
+            'prompt_key': prompt_key(messages),
+            'question_key': question_key(messages),
+            'prompt': [[message.type, str(message.content)] for message in messages],
+            'response': response,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'latency': round(latency, 4),
+            'duration': round(duration, 4),
+            'model': model,
+            'recorded_at': datetime.utcnow().isoformat()
+        }
+        frame = self.compressor.compress((json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8'))
+
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(frame)
+
+
+def load_recordings(path):
+    """Read every entry from a recording log."""
+    with open(path, 'rb') as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        return [json.loads(line) for line in io.TextIOWrapper(reader, encoding='utf-8') if line.strip()]
+
+
+class RecordingChatModel(BaseChatModel):
+    """Wraps another chat model and records each interaction."""
+
+    inner: BaseChatModel
+    recorder: LLMRecorder
+    model_name: str = ''
+
+    @property
+    def _llm_type(self):
+        return f'recording-{self.inner._llm_type}'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        message = self.inner.invoke(messages, stop=stop, **kwargs)
+        duration = time.perf_counter() - started
+
+        self.recorder.record(messages, str(message.content), message.usage_metadata, duration, duration, self.model_name)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        latency = None
+        parts = []
+        usage = None
+
+        for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+            if latency is None:
+                latency = time.perf_counter() - started
+            parts.append(str(chunk.content))
+            usage = chunk.usage_metadata or usage
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+        duration = time.perf_counter() - started
+        self.recorder.record(messages, ''.join(parts), usage, latency or duration, duration, self.model_name)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Serves recorded responses with the recorded (optionally scaled) timing.
+
+    Prompts are matched exactly first, then by their last message; anything
+    else is served from the recordings in order so the traffic shape holds.
+    """
+
+    records: list
+    latency_scale: float = 1.0
+
+    _by_prompt: dict = PrivateAttr(default_factory=dict)
+    _by_question: dict = PrivateAttr(default_factory=dict)
+    _counters: dict = PrivateAttr(default_factory=dict)
+    _lock: object = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context):
+        for record in self.records:
+            self._by_prompt.setdefault(record['prompt_key'], []).append(record)
+            self._by_question.setdefault(record['question_key'], []).append(record)
+
+    @classmethod
+    def from_file(cls, path, latency_scale=1.0):
+        records = load_recordings(path)
+        if not records:
+            raise ValueError(f"No LLM recordings found in {path}")
+        return cls(records=records, latency_scale=latency_scale)
+
+    @property
+    def _llm_type(self):
+        return 'bitbraniac-replay'
+
+    def _pick(self, messages):
+        key = prompt_key(messages)
+        candidates = self._by_prompt.get(key)
+        if not candidates:
+            key = question_key(messages)
+            candidates = self._by_question.get(key)
+        if not candidates:
+            key, candidates = None, self.records
+
+        with self._lock:
+            index = self._counters.get(key, 0)
+            self._counters[key] = index + 1
+        return candidates[index % len(candidates)]
+
+    def _usage(self, record):
+        return {
+            'input_tokens': record['input_tokens'],
+            'output_tokens': record['output_tokens'],
+            'total_tokens': record['input_tokens'] + record['output_tokens']
+        }
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        record = self._pick(messages)
+        if self.latency_scale:
+            time.sleep(record['duration'] * self.latency_scale)
+
+        message = AIMessage(content=record['response'], usage_metadata=self._usage(record))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        record = self._pick(messages)
+        words = record['response'].split(' ')
+        if self.latency_scale:
+            time.sleep(record['latency'] * self.latency_scale)
+        per_word = max(record['duration'] - record['latency'], 0) * self.latency_scale / len(words)
+
+        for i, word in enumerate(words):
+            if per_word:
+                time.sleep(per_word)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else ' ' + word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+        yield ChatGenerationChunk(message=AIMessageChunk(content='', usage_metadata=self._usage(record)))
+
+
+def _create_backend(config):
+    backend = config.get('LLM_BACKEND', 'google')
+
+    if backend == 'fake':
+        return FakeChatModel(
+            latency=config['FAKE_LLM_LATENCY'],
+            tokens_per_second=config['FAKE_LLM_TOKENS_PER_SECOND'],
+            response_tokens=min(config['FAKE_LLM_RESPONSE_TOKENS'], config['MAX_OUTPUT_TOKENS']),
+            failure_rate=config['FAKE_LLM_FAILURE_RATE'],
+            tail_rate=config['FAKE_LLM_TAIL_RATE'],
+            tail_latency=config['FAKE_LLM_TAIL_LATENCY']
+        )
+
+    if backend == 'replay':
+        if not config.get('LLM_REPLAY_PATH'):
+            raise ValueError("LLM_REPLAY_PATH is required for the replay backend")
+        return ReplayChatModel.from_file(config['LLM_REPLAY_PATH'], config['LLM_REPLAY_LATENCY_SCALE'])
+
+    if backend == 'google':
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        api_key = config['GOOGLE_API_KEY']
+        if not api_key:
+            raise ValueError("Google API key not found in configuration")
+
+        options = {}
+        if config.get('LLM_RESILIENCE_ENABLED'):
+            # The resilient wrapper owns retries and failure detection: no
+            # retries stacked inside it, and a hanging call ends as a failure
+            options = {'max_retries': 1, 'timeout': config['LLM_REQUEST_TIMEOUT']}
+
+        return ChatGoogleGenerativeAI(
+            model=config['MODEL_NAME'],
+            temperature=config['MODEL_TEMPERATURE'],
+            max_output_tokens=config['MAX_OUTPUT_TOKENS'],
+            google_api_key=api_key,
+            **options
+        )
+
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+
+def create_llm(config):
+    """Create the chat model configured by ``LLM_BACKEND``, made resilient and recorded if requested."""
+    llm = _create_backend(config)
+    model_name = config['MODEL_NAME'] if config.get('LLM_BACKEND') == 'google' else config.get('LLM_BACKEND')
+
+    if config.get('LLM_RESILIENCE_ENABLED'):
+        llm = make_resilient(llm, config, model_name)
+
+    if config.get('LLM_RECORD_PATH'):
+        llm = RecordingChatModel(
+            inner=llm,
+            recorder=LLMRecorder(config['LLM_RECORD_PATH']),
+            model_name=model_name
+        )
+
+    return llm
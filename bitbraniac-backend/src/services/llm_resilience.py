@@ -0,0 +1,324 @@
+"""
+Resilient LLM client for BitBraniac application.
+
+``ResilientChatModel`` wraps the chat model built by ``create_llm``:
+
+- Transient provider errors (rate limits, 5xx, timeouts, dropped connections)
+  are retried up to ``LLM_RETRY_ATTEMPTS`` times with jittered exponential
+  backoff. A stream is only retried before its first chunk.
+- A circuit breaker opens after ``LLM_CIRCUIT_FAILURE_THRESHOLD`` consecutive
+  transient failures. While open, calls fail immediately with
+  ``LLMUnavailableError`` instead of queueing on a provider that is down;
+  after ``LLM_CIRCUIT_RESET_SECONDS`` one probe call is let through.
+- With ``LLM_HEDGE_ENABLED``, an attempt that has not produced its first
+  token after the ``LLM_HEDGE_QUANTILE`` of recent first-token latencies is
+  hedged with a second attempt; whichever answers first is used and the
+  other is abandoned.
+
+Every attempt is counted in ``bitbraniac_llm_attempts_total`` and timed in
+``bitbraniac_llm_attempt_duration_seconds``.
+"""
+
+import queue
+import random
+import threading
+import time
+from collections import deque
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from ..metrics import LLM_ATTEMPT_DURATION, LLM_ATTEMPTS, LLM_CIRCUIT_REJECTIONS, LLM_CIRCUIT_STATE
+
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class LLMUnavailableError(Exception):
+    """The provider is failing; raised when the circuit is open or retries ran out."""
+
+
+def is_transient(error):
+    """True for provider errors worth retrying."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # google.api_core errors carry the HTTP status as ``code``, httpx errors as ``status_code``
+    for attribute in ('code', 'status_code'):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int) and code in TRANSIENT_STATUS_CODES:
+            return True
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in TRANSIENT_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        LLM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[CLOSED], model=name)
+
+    def _set_state(self, state):
+        self.state = state
+        LLM_CIRCUIT_STATE.set(CIRCUIT_STATE_VALUES[state], model=self.name)
+
+    def allow(self):
+        """Whether a call may go to the provider now."""
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        LLM_CIRCUIT_REJECTIONS.inc(model=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.failure_threshold and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self):
+        """End a call that neither succeeded nor failed at the provider."""
+        with self._lock:
+            self._probing = False
+
+
+class LatencyTracker:
+    """Recent first-token latencies of successful attempts."""
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q, min_samples):
+        """The q-quantile, or None until ``min_samples`` have been seen."""
+        with self._lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class _Attempt:
+    """One call to the wrapped model, run on its own thread."""
+
+    def __init__(self, index, role, events):
+        self.index = index
+        self.role = role
+        self.events = events
+        self.started = time.perf_counter()
+        self.stop = threading.Event()
+        self.finished = False
+
+    def run_stream(self, llm, messages, kwargs):
+        stream = llm.stream(messages, **kwargs)
+        try:
+            for chunk in stream:
+                if self.stop.is_set():
+                    return
+                self.events.put((self, 'chunk', chunk))
+            self.events.put((self, 'end', None))
+        except Exception as e:
+            self.events.put((self, 'error', e))
+        finally:
+            stream.close()
+
+    def run_invoke(self, llm, messages, kwargs):
+        try:
+            message = llm.invoke(messages, **kwargs)
+            self.events.put((self, 'chunk', message))
+            self.events.put((self, 'end', None))
+        except Exception as e:
+            self.events.put((self, 'error', e))
+
+
+class ResilientChatModel(BaseChatModel):
+    """Wraps another chat model with retries, a circuit breaker and hedging."""
+
+    inner: BaseChatModel
+    model_name: str = ''
+    retry_attempts: int = 3
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 8.0
+    hedge_enabled: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 1.0
+    hedge_min_samples: int = 20
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+
+    _breaker: object = PrivateAttr(default=None)
+    _latencies: object = PrivateAttr(default_factory=LatencyTracker)
+
+    def model_post_init(self, __context):
+        self._breaker = CircuitBreaker(self.model_name, self.circuit_failure_threshold, self.circuit_reset_seconds)
+
+    @property
+    def _llm_type(self):
+        return f'resilient-{self.inner._llm_type}'
+
+    @property
+    def breaker(self):
+        return self._breaker
+
+    def hedge_delay(self):
+        """Seconds to wait for a first token before starting a hedge attempt."""
+        quantile = self._latencies.quantile(self.hedge_quantile, self.hedge_min_samples)
+        return max(quantile or 0.0, self.hedge_min_delay)
+
+    def _retry_delay(self, attempt):
+        delay = min(self.retry_base_delay * 2 ** (attempt - 1), self.retry_max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record_attempt(self, attempt, outcome):
+        elapsed = time.perf_counter() - attempt.started
+        LLM_ATTEMPTS.inc(model=self.model_name, role=attempt.role, outcome=outcome)
+        LLM_ATTEMPT_DURATION.observe(elapsed, model=self.model_name, role=attempt.role, outcome=outcome)
+        return elapsed
+
+    def _start(self, index, role, events, streaming, messages, kwargs):
+        attempt = _Attempt(index, role, events)
+        target = attempt.run_stream if streaming else attempt.run_invoke
+        threading.Thread(target=target, args=(self.inner, messages, kwargs), name='llm-attempt', daemon=True).start()
+        return attempt
+
+    def _first_response(self, try_number, streaming, messages, kwargs):
+        """Run one try (an attempt plus an optional hedge) until something answers.
+
+        Returns (winning attempt, first chunk, events queue) or raises the
+        error of the last attempt to fail.
+        """
+        events = queue.Queue()
+        role = 'first' if try_number == 1 else 'retry'
+        running = [self._start(0, role, events, streaming, messages, kwargs)]
+        hedge_at = time.monotonic() + self.hedge_delay() if self.hedge_enabled else None
+
+        while True:
+            timeout = None
+            if hedge_at is not None:
+                timeout = max(hedge_at - time.monotonic(), 0.0)
+            try:
+                attempt, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                running.append(self._start(1, 'hedge', events, streaming, messages, kwargs))
+                hedge_at = None
+                continue
+
+            if attempt.finished:
+                continue  # leftovers from an attempt that already failed or lost
+
+            if kind == 'chunk':
+                latency = self._record_attempt(attempt, 'success')
+                self._latencies.observe(latency)
+                for other in running:
+                    if other is not attempt and not other.finished:
+                        other.finished = True
+                        other.stop.set()
+                        self._record_attempt(other, 'abandoned')
+                return attempt, value, events
+
+            # Failed (or ended without output) before answering
+            attempt.finished = True
+            error = value if kind == 'error' else ConnectionError('Empty response from model')
+            self._record_attempt(attempt, 'transient_error' if is_transient(error) else 'error')
+            if any(not other.finished for other in running):
+                # The hedge may still answer; stop hedging further
+                hedge_at = None
+                continue
+            raise error
+
+    def _call(self, streaming, messages, kwargs):
+        """Yield chunks (or the single message when not streaming) from the first attempt to answer."""
+        try_number = 0
+        while True:
+            try_number += 1
+            if not self._breaker.allow():
+                raise LLMUnavailableError(f"Circuit open for {self.model_name}")
+
+            try:
+                attempt, first, events = self._first_response(try_number, streaming, messages, kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    self._breaker.release()
+                    raise
+                self._breaker.record_failure()
+                if try_number >= self.retry_attempts:
+                    raise LLMUnavailableError(f"{self.model_name} failed after {try_number} attempts: {e}") from e
+                time.sleep(self._retry_delay(try_number))
+                continue
+
+            self._breaker.record_success()
+            break
+
+        try:
+            yield first
+            while True:
+                other, kind, value = events.get()
+                if other is not attempt:
+                    continue
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    # Part of the response is already out, so this is not retried
+                    raise value
+                yield value
+        finally:
+            attempt.stop.set()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = next(self._call(False, messages, dict(kwargs, stop=stop)))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self._call(True, messages, dict(kwargs, stop=stop)):
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+
+def make_resilient(llm, config, model_name):
+    """Wrap ``llm`` according to the ``LLM_RETRY_*``, ``LLM_CIRCUIT_*`` and ``LLM_HEDGE_*`` settings."""
+    return ResilientChatModel(
+        inner=llm,
+        model_name=model_name,
+        retry_attempts=config['LLM_RETRY_ATTEMPTS'],
+        retry_base_delay=config['LLM_RETRY_BASE_DELAY'],
+        retry_max_delay=config['LLM_RETRY_MAX_DELAY'],
+        hedge_enabled=config['LLM_HEDGE_ENABLED'],
+        hedge_quantile=config['LLM_HEDGE_QUANTILE'],
+        hedge_min_delay=config['LLM_HEDGE_MIN_DELAY'],
+        hedge_min_samples=config['LLM_HEDGE_MIN_SAMPLES'],
+        circuit_failure_threshold=config['LLM_CIRCUIT_FAILURE_THRESHOLD'],
+        circuit_reset_seconds=config['LLM_CIRCUIT_RESET_SECONDS']
+    )
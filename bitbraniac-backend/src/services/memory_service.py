@@ -0,0 +1,475 @@
+"""
+Long-term memory service for BitBraniac application.
+
+What a student wrote in earlier sessions (their background, projects and
+earlier questions) is kept in a per-user vector index, so a new session can
+recall it without the student explaining it again.
+
+- Every user message of at least ``MEMORY_MIN_WORDS`` words becomes a snippet.
+  Its vector is a hashed bag of words (``MEMORY_DIMENSIONS`` wide,
+  L2-normalized), so no embedding model is needed.
+- Indexes are updated by ``memory_index`` background jobs. Saving a user
+  message queues one job per user, which becomes due ``MEMORY_INDEX_DELAY``
+  seconds later and picks up every message written since the last run.
+- A user's index is a directory with an append-only ``vectors.<n>.f32``
+  matrix, a ``snippets.<n>.jsonl`` file and a ``state.json`` that says how
+  many rows are valid. The matrix is memory-mapped and cached per process
+  until another process changes ``state.json``.
+- Deleting sessions queues a compaction that rewrites the index without
+  them. Until it runs, snippets of deleted sessions are filtered out when
+  recalling.
+- Imported sessions keep their original timestamps, which may be behind the
+  cursor. The import queues a job naming those sessions, and their messages
+  behind the cursor are indexed without moving it.
+
+``MemoryService.recall`` scores every snippet of the user with one
+matrix-vector product and returns the best ones that fit in
+``MEMORY_TOKEN_BUDGET`` tokens.
+"""
+
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, or_
+from ..metrics import MEMORY_RECALL_DURATION
+from ..models import ChatMessage, ChatSession, db
+from .job_service import JobService, register_job
+from .retrieval import tokenize
+from .tokens import estimate_tokens
+
+
+# Messages are indexed only once they are this old, so a message committed
+# a moment after a newer one is not skipped by the cursor
+SETTLE_SECONDS = 5
+FETCH_BATCH_SIZE = 1000
+
+
+def embed(texts, dimensions):
+    """Hashed bag-of-words vectors (one row per text), L2-normalized."""
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for term, count in Counter(tokenize(text)).items():
+            # crc32 rather than hash(), which differs between processes
+            digest = zlib.crc32(term.encode('utf-8'))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            matrix[row, digest % dimensions] += sign * (1 + math.log(count))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class UserMemory:
+    """A read-only view of one user's index, as of one ``state.json``."""
+
+    def __init__(self, directory, state):
+        self.directory = directory
+        self.state = state
+        count, dimensions, generation = state['count'], state['dimensions'], state['generation']
+
+        self.vectors = None
+        if count:
+            self.vectors = np.memmap(
+                os.path.join(directory, f'vectors.{generation}.f32'),
+                dtype=np.float32, mode='r', shape=(count, dimensions)
+            )
+        self.snippets = []
+        if state['snippets_bytes']:
+            with open(os.path.join(directory, f'snippets.{generation}.jsonl'), 'rb') as f:
+                data = f.read(state['snippets_bytes'])
+            self.snippets = [json.loads(line) for line in data.splitlines()]
+
+    def __len__(self):
+        return self.state['count']
+
+    def search(self, vector, k, min_similarity=0.0, exclude_session_id=None):
+        """Up to ``k`` (similarity, snippet) pairs, most similar first."""
+        if self.vectors is None:
+            return []
+        scores = self.vectors @ vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            (float(scores[row]), self.snippets[row])
+            for row in top
+            if scores[row] >= min_similarity and self.snippets[row]['session_id'] != exclude_session_id
+        ]
+
+
+class MemoryStore:
+    """Per-user index directories under one root, with a cache of loaded indexes."""
+
+    def __init__(self, root, dimensions, cache_size=256):
+        self.root = root
+        self.dimensions = dimensions
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # user_id -> (state.json mtime, UserMemory)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, user_id):
+        return os.path.join(self.root, user_id)
+
+    @staticmethod
+    def _read_state(directory):
+        try:
+            with open(os.path.join(directory, 'state.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_state(directory, state):
+        path = os.path.join(directory, 'state.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    @contextmanager
+    def _locked(self, user_id):
+        """Exclusive access to a user's index across threads and worker processes."""
+        directory = self._directory(user_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield directory
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, user_id):
+        """The user's index, or None if nothing has been indexed for them."""
+        directory = self._directory(user_id)
+        try:
+            mtime = os.stat(os.path.join(directory, 'state.json')).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None and cached[0] == mtime:
+                self._cache.move_to_end(user_id)
+                return cached[1]
+
+        state = self._read_state(directory)
+        if state is None or state['dimensions'] != self.dimensions:
+            return None
+        memory = UserMemory(directory, state)
+        with self._lock:
+            self._cache[user_id] = (mtime, memory)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return memory
+
+    def cursor(self, user_id):
+        state = self._read_state(self._directory(user_id))
+        return state['cursor'] if state and state['dimensions'] == self.dimensions else None
+
+    def append(self, user_id, snippets, cursor, previous_cursor):
+        """Add snippets to a user's index and move its cursor from ``previous_cursor``.
+
+        Returns the new count, or None if another update moved the cursor first.
+        """
+        with self._locked(user_id) as directory:
+            state = self._read_state(directory)
+            if state is None or state['dimensions'] != self.dimensions:
+                state = {'count': 0, 'snippets_bytes': 0, 'dimensions': self.dimensions, 'generation': 0, 'cursor': None}
+            if state['cursor'] != previous_cursor:
+                return None
+
+            vectors_path = os.path.join(directory, f"vectors.{state['generation']}.f32")
+            snippets_path = os.path.join(directory, f"snippets.{state['generation']}.jsonl")
+            if snippets:
+                data = b''.join(json.dumps(snippet, separators=(',', ':')).encode('utf-8') + b'\n' for snippet in snippets)
+                vectors = embed([snippet['text'] for snippet in snippets], self.dimensions)
+                # Cut off whatever an append that died halfway left behind
+                for path, size, payload in (
+                    (vectors_path, state['count'] * self.dimensions * 4, vectors.tobytes()),
+                    (snippets_path, state['snippets_bytes'], data)
+                ):
+                    with open(path, 'ab') as f:
+                        f.truncate(size)
+                        f.write(payload)
+                        f.flush()
+                        os.fsync(f.fileno())
+                state['count'] += len(snippets)
+                state['snippets_bytes'] += len(data)
+
+            state['cursor'] = cursor
+            self._write_state(directory, state)
+            return state['count']
+
+    def compact(self, user_id, keep_session_ids):
+        """Rewrite a user's index with only the snippets of ``keep_session_ids``; returns rows dropped."""
+        with self._locked(user_id) as directory:
+            state = self._read_state(directory)
+            if state is None or state['dimensions'] != self.dimensions or not state['count']:
+                return 0
+
+            memory = UserMemory(directory, state)
+            keep = [row for row, snippet in enumerate(memory.snippets) if snippet['session_id'] in keep_session_ids]
+            dropped = len(memory) - len(keep)
+            if not dropped:
+                return 0
+
+            # New files under the next generation; processes still reading
+            # the old ones keep their mapping until they reload
+            generation = state['generation'] + 1
+            data = b''.join(
+                json.dumps(memory.snippets[row], separators=(',', ':')).encode('utf-8') + b'\n' for row in keep
+            )
+            with open(os.path.join(directory, f'vectors.{generation}.f32'), 'wb') as f:
+                f.write(np.ascontiguousarray(memory.vectors[keep]).tobytes())
+            with open(os.path.join(directory, f'snippets.{generation}.jsonl'), 'wb') as f:
+                f.write(data)
+            self._write_state(directory, dict(
+                state, count=len(keep), snippets_bytes=len(data), generation=generation
+            ))
+            for name in (f"vectors.{state['generation']}.f32", f"snippets.{state['generation']}.jsonl"):
+                os.remove(os.path.join(directory, name))
+            return dropped
+
+
+def get_memory_store(app=None):
+    """Get or create the memory store for the app."""
+    app = app or current_app._get_current_object()
+    store = app.extensions.get('memory_store')
+    if store is None:
+        store = MemoryStore(
+            app.config.get('MEMORY_DIR') or os.path.join(app.instance_path, 'memory'),
+            app.config['MEMORY_DIMENSIONS'],
+            app.config['MEMORY_CACHE_USERS']
+        )
+        app.extensions['memory_store'] = store
+    return store
+
+
+class MemoryService:
+    """Service class for the per-user long-term memory."""
+
+    @staticmethod
+    def request_update(user_id, compact=False, session_ids=None):
+        """Queue an index update for a user if enabled; the caller commits.
+
+        ``session_ids`` are sessions whose messages may be behind the cursor
+        (imported ones); each such request gets its own job.
+        """
+        config = current_app.config
+        if not config['MEMORY_ENABLED'] or not user_id:
+            return None
+        if session_ids:
+            return JobService.enqueue(
+                'memory_index',
+                {'user_id': user_id, 'compact': compact, 'session_ids': list(session_ids)},
+                delay=config['MEMORY_INDEX_DELAY']
+            )
+        kind = 'compact' if compact else 'update'
+        return JobService.enqueue(
+            'memory_index',
+            {'user_id': user_id, 'compact': compact},
+            delay=config['MEMORY_INDEX_DELAY'],
+            dedupe_key=f'memory_index:{kind}:{user_id}'
+        )
+
+    @staticmethod
+    def _snippets(rows, skip_ids=()):
+        config = current_app.config
+        return [
+            {
+                'session_id': row.session_id,
+                'message_id': row.id,
+                'created_at': row.created_at.isoformat(),
+                'text': ' '.join(row.content.split())[:config['MEMORY_SNIPPET_CHARS']]
+            }
+            for row in rows
+            if len(row.content.split()) >= config['MEMORY_MIN_WORDS'] and row.id not in skip_ids
+        ]
+
+    @staticmethod
+    def _user_messages(user_id):
+        return db.session.query(
+            ChatMessage.id, ChatMessage.session_id, ChatMessage.content, ChatMessage.created_at
+        ).join(ChatSession, ChatSession.id == ChatMessage.session_id).filter(
+            ChatSession.user_id == user_id,
+            ChatSession.is_active.is_(True),
+            ChatMessage.message_type == 'user'
+        )
+
+    @staticmethod
+    def update_index(user_id):
+        """Index a user's messages written since the last update.
+
+        Returns (messages indexed, whether newer messages are still settling).
+        """
+        store = get_memory_store()
+        cursor = store.cursor(user_id)
+        settled_before = datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS)
+        indexed = 0
+
+        while True:
+            query = MemoryService._user_messages(user_id).filter(ChatMessage.created_at < settled_before)
+            if cursor:
+                after = datetime.fromisoformat(cursor['created_at'])
+                query = query.filter(or_(
+                    ChatMessage.created_at > after,
+                    and_(ChatMessage.created_at == after, ChatMessage.id > cursor['id'])
+                ))
+            rows = query.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).limit(FETCH_BATCH_SIZE).all()
+            if not rows:
+                break
+
+            snippets = MemoryService._snippets(rows)
+            last = rows[-1]
+            previous_cursor, cursor = cursor, {'created_at': last.created_at.isoformat(), 'id': last.id}
+            if store.append(user_id, snippets, cursor, previous_cursor) is None:
+                break
+            indexed += len(snippets)
+            if len(rows) < FETCH_BATCH_SIZE:
+                break
+
+        settling = db.session.query(ChatMessage.id).join(
+            ChatSession, ChatSession.id == ChatMessage.session_id
+        ).filter(
+            ChatSession.user_id == user_id,
+            ChatMessage.message_type == 'user',
+            ChatMessage.created_at >= settled_before
+        ).first() is not None
+        return indexed, settling
+
+    @staticmethod
+    def backfill_index(user_id, session_ids):
+        """Index messages of ``session_ids`` that are behind the cursor; returns how many were indexed.
+
+        Messages after the cursor are left to ``update_index``. Messages
+        already in the index are skipped, so running it again adds nothing.
+        """
+        store = get_memory_store()
+        session_ids = list(session_ids)
+
+        while True:
+            cursor = store.cursor(user_id)
+            if cursor is None:
+                # update_index starts from the beginning
+                return 0
+            memory = store.get(user_id)
+            known = {snippet['message_id'] for snippet in memory.snippets} if memory is not None else set()
+            after = datetime.fromisoformat(cursor['created_at'])
+
+            snippets = []
+            for start in range(0, len(session_ids), 500):
+                rows = MemoryService._user_messages(user_id).filter(
+                    ChatMessage.session_id.in_(session_ids[start:start + 500]),
+                    or_(
+                        ChatMessage.created_at < after,
+                        and_(ChatMessage.created_at == after, ChatMessage.id <= cursor['id'])
+                    )
+                ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all()
+                snippets.extend(MemoryService._snippets(rows, known))
+            if not snippets:
+                return 0
+
+            # Keeps the cursor where it is; retried if an update moved it meanwhile
+            if store.append(user_id, snippets, cursor, cursor) is not None:
+                return len(snippets)
+
+    @staticmethod
+    def compact_index(user_id):
+        """Drop the snippets of a user's deleted sessions; returns the number dropped."""
+        store = get_memory_store()
+        memory = store.get(user_id)
+        if memory is None or not len(memory):
+            return 0
+        session_ids = {snippet['session_id'] for snippet in memory.snippets}
+        active = MemoryService._active_sessions(user_id, session_ids)
+        return store.compact(user_id, active)
+
+    @staticmethod
+    def _active_sessions(user_id, session_ids):
+        active = set()
+        session_ids = list(session_ids)
+        for start in range(0, len(session_ids), 500):
+            active.update(session_id for (session_id,) in db.session.query(ChatSession.id).filter(
+                ChatSession.id.in_(session_ids[start:start + 500]),
+                ChatSession.user_id == user_id,
+                ChatSession.is_active.is_(True)
+            ))
+        return active
+
+    @staticmethod
+    def recall(user_id, query, exclude_session_id=None):
+        """Snippets from a user's other sessions most similar to ``query``, within the token budget."""
+        config = current_app.config
+        if not config['MEMORY_ENABLED'] or not user_id or not query:
+            return []
+
+        try:
+            with MEMORY_RECALL_DURATION.time():
+                memory = get_memory_store().get(user_id)
+                if memory is None:
+                    return []
+
+                top_k = config['MEMORY_TOP_K']
+                # Extra candidates make up for snippets of deleted sessions
+                candidates = memory.search(
+                    embed([query], memory.state['dimensions'])[0],
+                    top_k * 3,
+                    config['MEMORY_MIN_SIMILARITY'],
+                    exclude_session_id
+                )
+                if not candidates:
+                    return []
+                active = MemoryService._active_sessions(user_id, {snippet['session_id'] for _, snippet in candidates})
+
+                recalled, seen, budget = [], set(), config['MEMORY_TOKEN_BUDGET']
+                for _, snippet in candidates:
+                    text = snippet['text']
+                    if snippet['session_id'] not in active or text in seen:
+                        continue
+                    tokens = estimate_tokens(text)
+                    if tokens > budget:
+                        continue
+                    recalled.append(snippet)
+                    seen.add(text)
+                    budget -= tokens
+                    if len(recalled) >= top_k:
+                        break
+                return recalled
+
+        except Exception as e:
+            current_app.logger.error(f"Memory recall error: {str(e)}")
+            return []
+
+
+@register_job('memory_index', batch_size=lambda config: config['MEMORY_INDEX_BATCH_SIZE'])
+def update_memory_indexes(payloads):
+    """Job handler: compact and update the indexes of a batch of users."""
+    users = OrderedDict()
+    backfills = {}  # user_id -> imported session ids
+    for payload in payloads:
+        users[payload['user_id']] = users.get(payload['user_id'], False) or payload.get('compact', False)
+        if payload.get('session_ids'):
+            backfills.setdefault(payload['user_id'], set()).update(payload['session_ids'])
+
+    for user_id, compact in users.items():
+        started = time.perf_counter()
+        dropped = MemoryService.compact_index(user_id) if compact else 0
+        indexed = MemoryService.backfill_index(user_id, backfills[user_id]) if user_id in backfills else 0
+        updated, settling = MemoryService.update_index(user_id)
+        indexed += updated
+        if settling:
+            # Messages too recent to index now; pick them up in a later run
+            MemoryService.request_update(user_id)
+        current_app.logger.debug(
+            f"Memory index of user {user_id}: {indexed} added, {dropped} dropped in {time.perf_counter() - started:.3f}s"
+        )
+    db.session.commit()
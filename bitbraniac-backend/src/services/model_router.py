@@ -0,0 +1,94 @@
+"""
+Model routing for BitBraniac application.
+
+Each message is sorted into a tier by cheap local heuristics before the
+model is called, and every tier has its own model, output-token budget and
+temperature:
+
+- ``light``: acknowledgements and small talk made up only of phrases like
+  "thanks!", "ok got it" or "hi"; a short topic like "binary search tree
+  insertion" is a question and still gets the course notes and memory
+- ``standard``: ordinary questions
+- ``deep``: messages with code, long messages, design or proof style
+  questions and long conversations
+
+Decisions are counted per tier and reason in ``bitbraniac_routing_decisions_total``
+and model time per tier in ``bitbraniac_llm_tier_duration_seconds``, so the
+``ROUTING_*`` thresholds can be tuned from ``/api/metrics``.
+"""
+
+import re
+from collections import namedtuple
+from ..metrics import ROUTING_DECISIONS
+
+
+LIGHT = 'light'
+STANDARD = 'standard'
+DEEP = 'deep'
+TIERS = (LIGHT, STANDARD, DEEP)
+
+CODE_PATTERN = re.compile(
+    r'```|^( {4}|\t)\S|\b(def|class|import|return|public|static|void|function|const|let|var|#include)\b.*[(){};=:]'
+    r'|[{};]\s*$|=>|\w+\([^)]*\)\s*[{:;]',
+    re.MULTILINE
+)
+DEEP_KEYWORDS = re.compile(
+    r'\b(design|architect\w*|implement\w*|optimi[sz]\w*|prove|proof|derive|trade-?offs?|compare|'
+    r'step[- ]by[- ]step|in detail|distributed|scal(e|able|ability)|debug\w*|refactor\w*)\b',
+    re.IGNORECASE
+)
+SMALL_TALK_PHRASES = (
+    'thanks', 'thank you', 'thank u', 'thx', 'ty', 'cheers', 'ok', 'okay', 'kk', 'cool', 'nice', 'great',
+    'awesome', 'perfect', 'got it', 'i see', 'makes sense', 'that makes sense', 'that helps', 'that helped',
+    'understood', 'alright', 'wow', 'lol', 'hi', 'hello', 'hey', 'good morning', 'good evening', 'good night',
+    'bye', 'goodbye', 'see you', 'so much', 'very much', 'a lot', 'again'
+)
+# The whole message is small talk phrases separated by spaces, punctuation or emoji
+SMALL_TALK_PATTERN = re.compile(
+    r'^[\W_]*(?:(?:' + '|'.join(sorted(map(re.escape, SMALL_TALK_PHRASES), key=len, reverse=True)) + r')\b[\W_]*)+$',
+    re.IGNORECASE
+)
+
+Route = namedtuple('Route', ('tier', 'reason'))
+
+
+class ModelRouter:
+    """Picks the tier for a message from its wording, length, code content and conversation size."""
+
+    def __init__(self, config):
+        self.light_max_words = config['ROUTING_LIGHT_MAX_WORDS']
+        self.deep_min_words = config['ROUTING_DEEP_MIN_WORDS']
+        self.deep_min_history = config['ROUTING_DEEP_MIN_HISTORY']
+
+    def classify(self, message, history_size=0):
+        """Route for ``message`` given the number of messages already in the conversation."""
+        words = message.split()
+
+        if CODE_PATTERN.search(message):
+            return Route(DEEP, 'code')
+        if len(words) >= self.deep_min_words:
+            return Route(DEEP, 'long')
+        if DEEP_KEYWORDS.search(message):
+            return Route(DEEP, 'keyword')
+        if self.deep_min_history and history_size >= self.deep_min_history:
+            return Route(DEEP, 'history')
+
+        if len(words) <= self.light_max_words and '?' not in message and SMALL_TALK_PATTERN.match(message):
+            return Route(LIGHT, 'small_talk')
+        return Route(STANDARD, 'default')
+
+    def route(self, message, history_size=0):
+        """Classify ``message`` and record the decision."""
+        route = self.classify(message, history_size)
+        ROUTING_DECISIONS.inc(tier=route.tier, reason=route.reason)
+        return route
+
+
+def tier_settings(config, tier):
+    """(model name, max output tokens, temperature) for a tier."""
+    prefix = f'ROUTING_{tier.upper()}_'
+    return (
+        config.get(prefix + 'MODEL') or config['MODEL_NAME'],
+        config[prefix + 'MAX_TOKENS'],
+        config[prefix + 'TEMPERATURE']
+    )
@@ -0,0 +1,219 @@
+"""
+Retention service for BitBraniac application.
+
+Soft-deleted chat sessions (``is_active=False``) are kept for a grace period
+and then hard-deleted together with their messages by a background worker.
+
+Every process gets a worker, started with its first request so that a
+preforking master never runs one itself. Only the worker holding an
+exclusive ``flock`` on ``RETENTION_LOCK_PATH`` runs the cycles. It keeps the
+lock until its process exits, and then another process's worker takes over.
+"""
+
+import fcntl
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import text
+from ..models import ChatSession, ChatMessage, SessionArchive, db
+from .archive_service import ArchiveService
+from .change_log_service import ChangeLogService
+from .job_service import JobService
+
+
+class RetentionService:
+    """Service class for purging soft-deleted chat data."""
+
+    @staticmethod
+    def _database_size():
+        """Return (file size in bytes, free bytes) for SQLite, or (None, None)."""
+        if db.engine.dialect.name != 'sqlite':
+            return None, None
+
+        page_size = db.session.execute(text("PRAGMA page_size")).scalar()
+        page_count = db.session.execute(text("PRAGMA page_count")).scalar()
+        freelist_count = db.session.execute(text("PRAGMA freelist_count")).scalar()
+        return page_count * page_size, freelist_count * page_size
+
+    @staticmethod
+    def _dead_sessions_query(cutoff):
+        """Query for ids of soft-deleted sessions past the grace period."""
+        return db.session.query(ChatSession.id).filter(
+            ChatSession.is_active.is_(False),
+            ChatSession.updated_at < cutoff
+        )
+
+    @staticmethod
+    def compact(pages_per_step=None, pause=None):
+        """Release free pages back to the OS in small steps and return the bytes reclaimed."""
+        config = current_app.config
+        pages_per_step = pages_per_step or config['RETENTION_VACUUM_PAGES']
+        pause = config['RETENTION_BATCH_PAUSE'] if pause is None else pause
+
+        size_before, _ = RetentionService._database_size()
+        if size_before is None:
+            return 0
+
+        auto_vacuum = db.session.execute(text("PRAGMA auto_vacuum")).scalar()
+        if auto_vacuum != 2:  # 2 == INCREMENTAL
+            current_app.logger.info(
+                "Incremental vacuum unavailable (auto_vacuum is not INCREMENTAL); "
+                "freed pages will be reused by SQLite instead"
+            )
+            return 0
+
+        while db.session.execute(text("PRAGMA freelist_count")).scalar():
+            db.session.execute(text(f"PRAGMA incremental_vacuum({int(pages_per_step)})"))
+            db.session.commit()
+            time.sleep(pause)
+
+        size_after, _ = RetentionService._database_size()
+        return max(size_before - size_after, 0)
+
+    @staticmethod
+    def purge_soft_deleted(grace_days=None, batch_size=None, pause=None):
+        """Hard-delete soft-deleted sessions and their messages after the grace period."""
+        config = current_app.config
+        grace_days = config['RETENTION_GRACE_DAYS'] if grace_days is None else grace_days
+        batch_size = batch_size or config['RETENTION_BATCH_SIZE']
+        pause = config['RETENTION_BATCH_PAUSE'] if pause is None else pause
+
+        try:
+            # Soft delete bumps updated_at, so it doubles as the deletion time
+            cutoff = datetime.utcnow() - timedelta(days=grace_days)
+            messages_purged = 0
+            sessions_purged = 0
+
+            # Delete messages first, in small transactions, so writers are never blocked for long
+            while True:
+                dead_sessions = RetentionService._dead_sessions_query(cutoff).subquery()
+                message_ids = [row.id for row in db.session.query(ChatMessage.id).filter(
+                    ChatMessage.session_id.in_(db.select(dead_sessions.c.id))
+                ).limit(batch_size).all()]
+
+                if not message_ids:
+                    break
+
+                ChatMessage.query.filter(ChatMessage.id.in_(message_ids)).delete(synchronize_session=False)
+                db.session.commit()
+                messages_purged += len(message_ids)
+                time.sleep(pause)
+
+            # Then the now-empty sessions
+            while True:
+                session_ids = [row.id for row in RetentionService._dead_sessions_query(cutoff).limit(batch_size).all()]
+
+                if not session_ids:
+                    break
+
+                SessionArchive.query.filter(SessionArchive.session_id.in_(session_ids)).delete(synchronize_session=False)
+                ChatSession.query.filter(ChatSession.id.in_(session_ids)).delete(synchronize_session=False)
+                db.session.commit()
+                sessions_purged += len(session_ids)
+                time.sleep(pause)
+
+            reclaimed_bytes = 0
+            if sessions_purged or messages_purged:
+                reclaimed_bytes = RetentionService.compact(pause=pause)
+
+            current_app.logger.info(
+                f"Retention purge removed {sessions_purged} sessions and {messages_purged} messages, "
+                f"reclaimed {reclaimed_bytes} bytes"
+            )
+
+            return {
+                'success': True,
+                'sessions_purged': sessions_purged,
+                'messages_purged': messages_purged,
+                'reclaimed_bytes': reclaimed_bytes
+            }
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Retention purge error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to purge deleted chat sessions'
+            }
+
+
+class RetentionWorker(threading.Thread):
+    """Background thread that periodically purges deleted sessions.
+
+    It also prunes the change log and failed jobs, archives idle sessions and
+    compacts their segments.
+    """
+
+    def __init__(self, app):
+        super().__init__(name='retention-worker', daemon=True)
+        self.app = app
+        self.interval = app.config['RETENTION_INTERVAL_SECONDS']
+        self.lock_path = app.config.get('RETENTION_LOCK_PATH') or os.path.join(app.instance_path, 'retention.lock')
+        self._lock_file = None
+        self._start_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def ensure_started(self):
+        """Start the thread once per process (after any fork)."""
+        if self.ident is not None:
+            return
+        with self._start_lock:
+            if self.ident is None:
+                self.start()
+
+    def _is_leader(self):
+        """Whether this worker holds the retention lock, taking it if it is free."""
+        if self._lock_file is not None:
+            return True
+
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        return True
+
+    def run(self):
+        try:
+            while not self._stop_event.wait(self.interval):
+                if self._is_leader():
+                    self._run_cycle()
+        finally:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _run_cycle(self):
+        with self.app.app_context():
+            RetentionService.purge_soft_deleted()
+            ChangeLogService.prune()
+            JobService.prune()
+
+            if self.app.config.get('ARCHIVE_ENABLED'):
+                result = ArchiveService.archive_idle_sessions()
+                if result.get('sessions_archived'):
+                    RetentionService.compact()
+
+            # Frames of purged and rehydrated sessions are dead
+            ArchiveService.compact_segments()
+
+    def stop(self):
+        """Ask the worker to exit after the current cycle."""
+        self._stop_event.set()
+
+
+def init_retention(app):
+    """Create the retention worker if enabled; it starts with the first request of each process."""
+    if not app.config.get('RETENTION_ENABLED'):
+        return None
+
+    worker = RetentionWorker(app)
+    app.extensions['retention_worker'] = worker
+    app.before_request(worker.ensure_started)
+    return worker
@@ -0,0 +1,362 @@
+"""
+Course material retrieval for BitBraniac application.
+
+The Markdown notes in the course directory are split into passages (one per
+section, long sections in several parts) and indexed for BM25 ranking. The
+index is a directory of flat files, built offline:
+
+- ``terms.txt``: the vocabulary, one term per line; a term's id is its line
+- ``postings_offsets.npy``: where each term's postings start
+- ``postings_docs.npy`` / ``postings_weights.npy``: the passage and the
+  precomputed BM25 weight of every (term, passage) pair, grouped by term
+- ``passages.bin`` / ``passage_offsets.npy``: passage text as UTF-8
+- ``passages.json``: title and source file of every passage
+- ``meta.json``: corpus statistics and a fingerprint of the notes
+
+The arrays and the passage text are memory-mapped when the app is created,
+before server workers fork, so all workers share one copy through the page
+cache. A question is scored by adding up the weights in its terms' postings,
+so search time grows with the postings of the question's terms, not with the
+size of the notes.
+
+Build (or rebuild) the index with:
+
+    python -m src.services.retrieval [course_dir] [index_dir]
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import sys
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+import numpy as np
+from ..metrics import RETRIEVAL_DURATION, RETRIEVAL_OVER_BUDGET
+
+
+INDEX_VERSION = 1
+DEFAULT_COURSE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'course')
+DEFAULT_PASSAGE_WORDS = 120
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9][a-z0-9+#]*')
+HEADING_PATTERN = re.compile(r'^(#{1,3})\s+(.+?)\s*#*\s*$')
+STOPWORDS = frozenset((
+    'a', 'about', 'all', 'also', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'because', 'been', 'but', 'by',
+    'can', 'could', 'did', 'do', 'does', 'each', 'for', 'from', 'had', 'has', 'have', 'how', 'i', 'if', 'in',
+    'into', 'is', 'it', 'its', 'me', 'my', 'no', 'not', 'of', 'on', 'one', 'or', 'other', 'our', 'over', 'so',
+    'some', 'such', 'than', 'that', 'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this', 'to',
+    'too', 'up', 'us', 'use', 'used', 'very', 'was', 'we', 'were', 'what', 'when', 'where', 'which', 'while',
+    'who', 'why', 'will', 'with', 'would', 'you', 'your', 'explain', 'please', 'tell', 'work', 'works'
+))
+
+Passage = namedtuple('Passage', ('title', 'source', 'text', 'score'))
+
+
+def _stem(word):
+    """Fold common English plural endings so 'queues' matches 'queue'."""
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'shes', 'ches', 'xes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Index terms of a text: lowercased words without stopwords, plurals folded."""
+    return [_stem(word) for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+
+def _course_files(course_dir):
+    return sorted(
+        os.path.join(directory, name)
+        for directory, _, files in os.walk(course_dir)
+        for name in files if name.endswith('.md')
+    )
+
+
+def source_fingerprint(course_dir, passage_words=DEFAULT_PASSAGE_WORDS):
+    """Hash of the notes and the build settings; a stale index has a different one."""
+    digest = hashlib.sha256(f'{INDEX_VERSION}:{passage_words}:{BM25_K1}:{BM25_B}'.encode())
+    for path in _course_files(course_dir):
+        digest.update(os.path.relpath(path, course_dir).encode())
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _split_section(lines, passage_words):
+    """Split a section's lines into passages of about ``passage_words`` words at paragraph breaks."""
+    paragraphs, current, in_code = [], [], False
+    for line in lines:
+        if line.startswith('```'):
+            in_code = not in_code
+        if not line.strip() and not in_code:
+            if current:
+                paragraphs.append('\n'.join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        paragraphs.append('\n'.join(current))
+
+    passage, words = [], 0
+    for paragraph in paragraphs:
+        count = len(paragraph.split())
+        if passage and words + count > passage_words:
+            yield '\n\n'.join(passage)
+            passage, words = [], 0
+        passage.append(paragraph)
+        words += count
+    if passage:
+        yield '\n\n'.join(passage)
+
+
+def read_passages(course_dir, passage_words=DEFAULT_PASSAGE_WORDS):
+    """Yield (title, source, text) for every passage of the notes in course_dir."""
+    for path in _course_files(course_dir):
+        source = os.path.relpath(path, course_dir)
+        headings = [os.path.splitext(os.path.basename(path))[0].replace('-', ' ').title()]
+        lines, in_code = [], False
+
+        def flush():
+            title = ' > '.join(headings)
+            for text in _split_section(lines, passage_words):
+                yield title, source, text
+
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('```'):
+                    in_code = not in_code
+                match = None if in_code else HEADING_PATTERN.match(line)
+                if match is None:
+                    lines.append(line)
+                    continue
+
+                yield from flush()
+                lines = []
+                level = len(match.group(1))
+                if level == 1:
+                    headings = [match.group(2)]
+                else:
+                    headings = headings[:level - 1] + [match.group(2)]
+        yield from flush()
+
+
+def build_index(course_dir, index_dir, passage_words=DEFAULT_PASSAGE_WORDS):
+    """Index the notes in course_dir into index_dir, replacing any previous index."""
+    passages = list(read_passages(course_dir, passage_words))
+    postings = {}  # term -> {passage: term frequency}
+    lengths = np.zeros(len(passages), dtype=np.float32)
+    for number, (title, _, text) in enumerate(passages):
+        counts = Counter(tokenize(f'{title}\n{text}'))
+        lengths[number] = sum(counts.values())
+        for term, frequency in counts.items():
+            postings.setdefault(term, {})[number] = frequency
+
+    count = len(passages)
+    average_length = float(lengths.mean()) if count else 1.0
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    docs = np.zeros(sum(len(postings[term]) for term in terms), dtype=np.int32)
+    weights = np.zeros(len(docs), dtype=np.float32)
+
+    position = 0
+    for term_id, term in enumerate(terms):
+        term_postings = postings[term]
+        end = position + len(term_postings)
+        passage_ids = np.fromiter(sorted(term_postings), dtype=np.int32, count=len(term_postings))
+        frequencies = np.array([term_postings[number] for number in passage_ids], dtype=np.float32)
+        idf = math.log(1 + (count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths[passage_ids] / average_length)
+        docs[position:end] = passage_ids
+        weights[position:end] = idf * frequencies * (BM25_K1 + 1) / (frequencies + norms)
+        offsets[term_id + 1] = end
+        position = end
+
+    texts = [text.encode('utf-8') for _, _, text in passages]
+    text_offsets = np.zeros(count + 1, dtype=np.int64)
+    text_offsets[1:] = np.cumsum([len(text) for text in texts])
+
+    # Write next to the old index and swap directories, so a running server
+    # never sees a half-written one
+    staging = f'{index_dir.rstrip(os.sep)}.tmp-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    with open(os.path.join(staging, 'terms.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(terms))
+    np.save(os.path.join(staging, 'postings_offsets.npy'), offsets)
+    np.save(os.path.join(staging, 'postings_docs.npy'), docs)
+    np.save(os.path.join(staging, 'postings_weights.npy'), weights)
+    np.save(os.path.join(staging, 'passage_offsets.npy'), text_offsets)
+    with open(os.path.join(staging, 'passages.bin'), 'wb') as f:
+        f.writelines(texts)
+    with open(os.path.join(staging, 'passages.json'), 'w', encoding='utf-8') as f:
+        json.dump([{'title': title, 'source': source} for title, source, _ in passages], f)
+    meta = {
+        'version': INDEX_VERSION,
+        'passages': count,
+        'terms': len(terms),
+        'postings': len(docs),
+        'average_length': average_length,
+        'passage_words': passage_words,
+        'fingerprint': source_fingerprint(course_dir, passage_words),
+        'built_at': datetime.utcnow().isoformat()
+    }
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    previous = f'{index_dir.rstrip(os.sep)}.old-{os.getpid()}'
+    if os.path.exists(index_dir):
+        os.rename(index_dir, previous)
+    os.rename(staging, index_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return meta
+
+
+def read_meta(index_dir):
+    """The index's meta.json, or None if there is no usable index."""
+    try:
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == INDEX_VERSION else None
+
+
+class RetrievalIndex:
+    """A memory-mapped BM25 index over course passages."""
+
+    def __init__(self, index_dir, max_query_terms=32, budget_ms=0):
+        self.index_dir = index_dir
+        self.max_query_terms = max_query_terms
+        self.budget = budget_ms / 1000
+        self.meta = read_meta(index_dir)
+        if self.meta is None:
+            raise FileNotFoundError(f"No retrieval index in {index_dir}")
+
+        with open(os.path.join(index_dir, 'terms.txt'), encoding='utf-8') as f:
+            self.terms = {term: term_id for term_id, term in enumerate(f.read().split('\n')) if term}
+        with open(os.path.join(index_dir, 'passages.json'), encoding='utf-8') as f:
+            self.passages = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+        self.offsets = load('postings_offsets.npy')
+        self.docs = load('postings_docs.npy')
+        self.weights = load('postings_weights.npy')
+        self.text_offsets = load('passage_offsets.npy')
+        self._text = None
+        if self.text_offsets[-1]:
+            with open(os.path.join(index_dir, 'passages.bin'), 'rb') as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.passages)
+
+    def passage_text(self, number):
+        return self._text[self.text_offsets[number]:self.text_offsets[number + 1]].decode('utf-8')
+
+    def search(self, query, k=3, min_score=0.0):
+        """The top ``k`` passages for ``query`` scoring above ``min_score``, best first."""
+        started = time.perf_counter()
+        term_ids = {self.terms[term] for term in tokenize(query) if term in self.terms}
+        if not term_ids or not len(self):
+            return []
+
+        # Long questions (pasted code, essays) keep their rarest terms, which
+        # carry most of the score and have the shortest postings
+        term_ids = sorted(term_ids, key=lambda term_id: self.offsets[term_id + 1] - self.offsets[term_id])
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term_id in term_ids[:self.max_query_terms]:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A term occurs in a passage at most once in its postings, so
+            # fancy-indexed += does not lose updates
+            scores[self.docs[start:end]] += self.weights[start:end]
+
+        k = min(k, len(self))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        results = [
+            Passage(self.passages[number]['title'], self.passages[number]['source'], self.passage_text(number), float(scores[number]))
+            for number in top if scores[number] > min_score
+        ]
+
+        elapsed = time.perf_counter() - started
+        RETRIEVAL_DURATION.observe(elapsed)
+        if self.budget and elapsed > self.budget:
+            RETRIEVAL_OVER_BUDGET.inc()
+        return results
+
+
+def retrieval_paths(app):
+    """(course directory, index directory) for the app."""
+    return (
+        app.config.get('RETRIEVAL_COURSE_DIR') or DEFAULT_COURSE_DIR,
+        app.config.get('RETRIEVAL_INDEX_DIR') or os.path.join(app.instance_path, 'retrieval')
+    )
+
+
+def get_retrieval_index(app):
+    """The app's retrieval index, or None when retrieval is off or no index could be loaded."""
+    return app.extensions.get('retrieval_index')
+
+
+def init_retrieval(app):
+    """Memory-map the course index, building it first if it is missing or stale and auto-build is on."""
+    app.extensions['retrieval_index'] = None
+    if not app.config['RETRIEVAL_ENABLED']:
+        return None
+
+    course_dir, index_dir = retrieval_paths(app)
+    passage_words = app.config['RETRIEVAL_PASSAGE_WORDS']
+    try:
+        meta = read_meta(index_dir)
+        stale = os.path.isdir(course_dir) and (
+            meta is None or meta['fingerprint'] != source_fingerprint(course_dir, passage_words)
+        )
+        if stale and app.config['RETRIEVAL_AUTO_BUILD']:
+            started = time.perf_counter()
+            meta = build_index(course_dir, index_dir, passage_words)
+            app.logger.info(
+                f"Retrieval index built with {meta['passages']} passages in {time.perf_counter() - started:.2f}s"
+            )
+        elif stale and meta is not None:
+            app.logger.warning(f"Retrieval index in {index_dir} is older than the notes in {course_dir}")
+
+        if meta is None:
+            app.logger.warning(f"No retrieval index in {index_dir}; using the full system prompt")
+            return None
+
+        index = RetrievalIndex(
+            index_dir,
+            max_query_terms=app.config['RETRIEVAL_MAX_QUERY_TERMS'],
+            budget_ms=app.config['RETRIEVAL_BUDGET_MS']
+        )
+        app.extensions['retrieval_index'] = index
+        return index
+
+    except Exception as e:
+        app.logger.error(f"Retrieval index error: {str(e)}")
+        return None
+
+
+if __name__ == '__main__':
+    course_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_COURSE_DIR
+    index_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.path.dirname(DEFAULT_COURSE_DIR), 'instance', 'retrieval'
+    )
+    meta = build_index(course_dir, index_dir)
+    print(f"Indexed {meta['passages']} passages ({meta['terms']} terms) from {course_dir} into {index_dir}")
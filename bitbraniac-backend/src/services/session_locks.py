@@ -0,0 +1,121 @@
+"""
+Per-session locks for BitBraniac application.
+
+Turns of one chat session are answered one at a time: a turn loads the
+history, saves the student's message, calls the model and saves the answer
+before the next turn of that session starts, so a double submit or a second
+tab can't interleave messages or answer from a stale history. Turns of
+different sessions don't wait for each other.
+
+Sessions are hashed onto ``SESSION_LOCK_STRIPES`` lock files under
+``SESSION_LOCK_DIR`` and a turn holds an exclusive ``flock`` on its session's
+file, so the lock covers every server worker process. Threads of one process
+queue on a lock per stripe first. Two sessions on the same stripe do wait
+for each other, which with thousands of stripes is rare. A waiting turn
+keeps checking its deadline and cancellation, and gives its pooled database
+connection back first so the turn it waits for can still get one.
+"""
+
+import fcntl
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from flask import current_app
+from ..metrics import SESSION_LOCK_WAIT
+from ..models import db
+
+
+# Another process holds the file lock; how long to sleep between attempts
+FILE_LOCK_POLL_INTERVAL = 0.005
+
+
+class SessionLock:
+    """A held session lock; release it when the turn is done."""
+
+    def __init__(self, thread_lock, lock_file):
+        self._thread_lock = thread_lock
+        self._lock_file = lock_file
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        finally:
+            self._lock_file = None
+            self._thread_lock.release()
+
+
+class SessionLocks:
+    """Striped locks serializing the turns of each session across threads and processes."""
+
+    def __init__(self, directory, stripes=4096):
+        self.directory = directory
+        self.stripes = stripes
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+        os.makedirs(directory, exist_ok=True)
+
+    def stripe(self, session_id):
+        return zlib.crc32(session_id.encode('utf-8')) % self.stripes
+
+    def acquire(self, session_id, turn=None):
+        """Wait until no other turn of the session runs; raises ``TurnCancelled`` if ``turn`` stops first.
+
+        If it has to wait, the caller's database transaction is committed first.
+        """
+        stripe = self.stripe(session_id)
+        thread_lock = self._thread_locks[stripe]
+        started = time.perf_counter()
+        waited = False
+
+        if not thread_lock.acquire(blocking=False):
+            waited = True
+            db.session.commit()
+            while not thread_lock.acquire(timeout=turn.wait_interval() if turn is not None else -1):
+                turn.check()
+
+        lock_file = None
+        try:
+            lock_file = open(os.path.join(self.directory, f'{stripe}.lock'), 'w')
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not waited:
+                        waited = True
+                        db.session.commit()
+                    if turn is not None:
+                        turn.check()
+                    time.sleep(FILE_LOCK_POLL_INTERVAL)
+        except BaseException:
+            if lock_file is not None:
+                lock_file.close()
+            thread_lock.release()
+            raise
+
+        SESSION_LOCK_WAIT.observe(time.perf_counter() - started)
+        return SessionLock(thread_lock, lock_file)
+
+    @contextmanager
+    def hold(self, session_id, turn=None):
+        lock = self.acquire(session_id, turn)
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+def get_session_locks():
+    return current_app.extensions['session_locks']
+
+
+def init_session_locks(app):
+    """Create the session lock table; lock files live under ``SESSION_LOCK_DIR``."""
+    directory = app.config.get('SESSION_LOCK_DIR') or os.path.join(app.instance_path, 'session-locks')
+    locks = SessionLocks(directory, app.config['SESSION_LOCK_STRIPES'])
+    app.extensions['session_locks'] = locks
+    return locks
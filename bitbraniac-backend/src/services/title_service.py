@@ -0,0 +1,133 @@
+"""
+Title service for BitBraniac application.
+
+A session gets its title when its first user message is saved: the first 50
+characters of that message, taken from the message being written so the
+request does no extra queries. With ``TITLE_SUMMARY_ENABLED`` a
+``session_title`` job is queued in the same transaction to replace it with a
+short summary from ``TITLE_MODEL_NAME``. The jobs become due after
+``TITLE_BATCH_WAIT`` seconds, and up to ``TITLE_BATCH_SIZE`` of them are titled
+with a single model call. Summary titles reach clients through the change log.
+"""
+
+import re
+import threading
+from flask import current_app
+from ..events import notify_session_change
+from ..models import ChatSession, SessionChange, db
+from .change_log_service import ChangeLogService
+from .job_service import JobService, register_job
+
+
+TITLE_PROMPT = (
+    "Write a short title (at most 6 words) for each of these questions from a "
+    "computer science student. Answer with one line per question in the form "
+    "'<number>. <title>' and nothing else.\n\n"
+)
+TITLE_LINE_PATTERN = re.compile(r'^\s*(\d+)[.)]\s*(.+?)\s*$')
+MAX_TITLE_LENGTH = 80
+MAX_QUESTION_LENGTH = 500  # characters of each question sent to the model
+
+
+class TitleService:
+    """Service class for generating session titles."""
+
+    @staticmethod
+    def request_summary(session_id, first_message):
+        """Queue a summary title for a session if enabled; the caller commits."""
+        if not current_app.config.get('TITLE_SUMMARY_ENABLED'):
+            return None
+        return JobService.enqueue(
+            'session_title',
+            {'session_id': session_id, 'first_message': first_message},
+            delay=current_app.config['TITLE_BATCH_WAIT'],
+            dedupe_key=f'session_title:{session_id}'
+        )
+
+    @staticmethod
+    def summarize(llm, first_messages):
+        """Titles for a batch of first messages, from one model call.
+
+        Returns a list aligned with ``first_messages``; entries the model
+        did not answer are None.
+        """
+        # Imported here so importing the app does not load LangChain
+        from langchain_core.messages import HumanMessage
+
+        questions = '\n'.join(
+            f"{i}. {' '.join(message[:MAX_QUESTION_LENGTH].split())}"
+            for i, message in enumerate(first_messages, 1)
+        )
+        response = llm.invoke([HumanMessage(content=TITLE_PROMPT + questions)])
+
+        titles = [None] * len(first_messages)
+        for line in str(response.content).splitlines():
+            match = TITLE_LINE_PATTERN.match(line)
+            if not match:
+                continue
+            index = int(match.group(1)) - 1
+            title = match.group(2).strip('"\'*').strip()
+            if 0 <= index < len(titles) and title:
+                titles[index] = title[:MAX_TITLE_LENGTH]
+        return titles
+
+    @staticmethod
+    def apply_summaries(items, titles):
+        """Store summary titles for (session_id, first_message) items; the job runner commits.
+
+        Sessions renamed or deleted since they were queued are left alone.
+        Returns the number of sessions updated.
+        """
+        wanted = {
+            session_id: (ChatSession.title_from_message(first_message), title)
+            for (session_id, first_message), title in zip(items, titles)
+            if title
+        }
+        if not wanted:
+            return 0
+
+        sessions = ChatSession.query.filter(
+            ChatSession.id.in_(wanted),
+            ChatSession.is_active.is_(True)
+        ).all()
+
+        updated = 0
+        for session in sessions:
+            provisional, title = wanted[session.id]
+            if session.title == provisional:
+                session.title = title
+                ChangeLogService.record(session.user_id, session.id, SessionChange.UPDATED)
+                updated += 1
+        return updated
+
+
+_title_llm = None
+_title_llm_lock = threading.Lock()
+
+
+def _get_title_llm():
+    global _title_llm
+    if _title_llm is None:
+        with _title_llm_lock:
+            if _title_llm is None:
+                from .llm_backends import create_llm
+
+                config = current_app.config
+                _title_llm = create_llm(dict(
+                    config,
+                    MODEL_NAME=config['TITLE_MODEL_NAME'],
+                    MODEL_TEMPERATURE=0.2,
+                    MAX_OUTPUT_TOKENS=32 * config['TITLE_BATCH_SIZE'],
+                    LLM_RECORD_PATH=None
+                ))
+    return _title_llm
+
+
+@register_job('session_title', batch_size=lambda config: config['TITLE_BATCH_SIZE'])
+def generate_summary_titles(payloads):
+    """Job handler: title a batch of sessions with one model call."""
+    items = [(payload['session_id'], payload['first_message']) for payload in payloads]
+    titles = TitleService.summarize(_get_title_llm(), [first_message for _, first_message in items])
+    if TitleService.apply_summaries(items, titles):
+        db.session.commit()
+        notify_session_change()
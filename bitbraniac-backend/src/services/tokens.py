@@ -0,0 +1,11 @@
+"""
+Token estimates for BitBraniac application.
+
+Kept free of LangChain and provider imports so services used by every request
+(memory recall, usage accounting) can count tokens without loading them.
+"""
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
@@ -0,0 +1,160 @@
+"""
+Turn service for BitBraniac application.
+
+A turn is one message being answered. It carries a deadline
+(``CHAT_TURN_TIMEOUT`` seconds, or less if the client asks) and can be
+cancelled:
+
+- explicitly with ``DELETE /api/chat/message/<turn_id>``; the request may
+  reach any worker, so the cancellation is also written to the shared cache,
+  which the worker running the turn checks every
+  ``CHAT_CANCEL_POLL_INTERVAL`` seconds
+- when the client disconnects (tab closed, request aborted), detected on the
+  request's socket
+
+The chatbot checks its turn while waiting for the model and stops the
+upstream call as soon as the turn is cancelled or out of time.
+"""
+
+import re
+import select
+import socket
+import threading
+import time
+import uuid
+from flask import current_app
+from ..cache import get_cache
+
+
+TURN_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+
+CANCELLED = 'cancelled'
+DEADLINE = 'deadline'
+DISCONNECTED = 'disconnected'
+
+
+class TurnCancelled(Exception):
+    """Raised when a turn is cancelled, runs out of time or loses its client."""
+
+    def __init__(self, reason):
+        super().__init__(f"Turn {reason}")
+        self.reason = reason
+
+
+def _client_disconnected(sock):
+    """True if the peer closed the connection; never blocks or consumes data."""
+    try:
+        # A socket with a timeout would wait in recv even with MSG_DONTWAIT,
+        # so only peek once select says there is something to read
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (BlockingIOError, InterruptedError, socket.timeout):
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class Turn:
+    """A message being answered, with its deadline and cancellation state."""
+
+    def __init__(self, turn_id, user_id, timeout, client_socket=None, poll_interval=0.5):
+        self.turn_id = turn_id
+        self.user_id = user_id
+        self.deadline = time.monotonic() + timeout
+        self.client_socket = client_socket
+        self.poll_interval = poll_interval
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._next_poll = 0.0
+
+    def remaining(self):
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def cancel(self, reason=CANCELLED):
+        if self.reason is None:
+            self.reason = reason
+        self._cancelled.set()
+
+    def check(self):
+        """Raise ``TurnCancelled`` if the turn should stop."""
+        if not self._cancelled.is_set():
+            now = time.monotonic()
+            if now >= self.deadline:
+                self.cancel(DEADLINE)
+            elif now >= self._next_poll:
+                self._next_poll = now + self.poll_interval
+                if self.client_socket is not None and _client_disconnected(self.client_socket):
+                    self.cancel(DISCONNECTED)
+                elif self.user_id is not None and \
+                        get_cache().get(TurnService.cancel_key(self.turn_id)) == self.user_id:
+                    self.cancel(CANCELLED)
+
+        if self._cancelled.is_set():
+            raise TurnCancelled(self.reason)
+
+    def wait_interval(self):
+        """How long to block before checking the turn again."""
+        return min(self.poll_interval, self.remaining())
+
+
+_turns = {}  # turn_id -> Turn running in this process
+_turns_lock = threading.Lock()
+
+
+class TurnService:
+    """Service class for starting and cancelling turns."""
+
+    @staticmethod
+    def cancel_key(turn_id):
+        return f'turn-cancel:{turn_id}'
+
+    @staticmethod
+    def start(user_id, turn_id=None, timeout=None, environ=None):
+        """Register a turn for the current request.
+
+        ``timeout`` can only shorten ``CHAT_TURN_TIMEOUT``. ``environ`` is
+        the WSGI environ, used to watch the client connection.
+        """
+        config = current_app.config
+        limit = config['CHAT_TURN_TIMEOUT']
+        timeout = min(timeout, limit) if timeout else limit
+
+        turn = Turn(
+            turn_id or str(uuid.uuid4()),
+            user_id,
+            timeout,
+            client_socket=(environ or {}).get('werkzeug.socket'),
+            poll_interval=config['CHAT_CANCEL_POLL_INTERVAL']
+        )
+        with _turns_lock:
+            _turns[turn.turn_id] = turn
+        return turn
+
+    @staticmethod
+    def finish(turn):
+        with _turns_lock:
+            if _turns.get(turn.turn_id) is turn:
+                del _turns[turn.turn_id]
+
+    @staticmethod
+    def cancel(turn_id, user_id):
+        """Cancel a user's turn, wherever it is running."""
+        with _turns_lock:
+            turn = _turns.get(turn_id)
+
+        if turn is not None and turn.user_id == user_id:
+            turn.cancel(CANCELLED)
+            return {
+                'success': True,
+                'message': 'Turn cancelled'
+            }
+
+        # Possibly running in another worker process
+        get_cache().set(TurnService.cancel_key(turn_id), user_id, ttl=current_app.config['CHAT_TURN_TIMEOUT'])
+        return {
+            'success': True,
+            'pending': True,
+            'message': 'Cancellation requested'
+        }
@@ -0,0 +1,312 @@
+"""
+Usage service for BitBraniac application.
+
+The prompt and completion tokens of every model call are counted per user and
+UTC day in memory. The counters are written to the ``user_usage`` table every
+``USAGE_FLUSH_INTERVAL`` seconds, as one update per user and day rather than a
+write per request. A worker that stops gracefully flushes its counters first.
+
+Before a message reaches the model, the user's usage for today (stored plus
+not yet flushed by this process) is checked against ``USAGE_DAILY_TOKEN_QUOTA``
+and ``USAGE_DAILY_REQUEST_QUOTA``. Counts other workers have not flushed yet
+are not seen, so a quota can be overshot by up to one flush interval of
+traffic.
+
+Calls without a user are counted together in the ``anonymous_usage`` table
+and checked against ``USAGE_ANONYMOUS_DAILY_TOKEN_QUOTA`` and
+``USAGE_ANONYMOUS_DAILY_REQUEST_QUOTA``, a daily budget all guests share.
+"""
+
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from ..metrics import LLM_TOKENS, QUOTA_REJECTIONS
+from ..models import AnonymousUsage, UserUsage, db
+
+
+class QuotaExceeded(Exception):
+    """A user reached a daily quota; carries the ``check_quota`` result."""
+
+    def __init__(self, result):
+        super().__init__(result['message'])
+        self.result = result
+        self.retry_after = result['retry_after']
+
+
+class UsageTracker:
+    """In-memory usage counters of this process and the thread that flushes them."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['USAGE_FLUSH_INTERVAL']
+        self._pending = {}  # (user_id or None for guests, day) -> [prompt_tokens, completion_tokens, requests]
+        self._stored = {}  # (user_id, day) -> (usage, read at), for quota checks
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def add(self, user_id, day, prompt_tokens, completion_tokens, requests=1):
+        with self._lock:
+            counts = self._pending.setdefault((user_id, day), [0, 0, 0])
+            counts[0] += prompt_tokens
+            counts[1] += completion_tokens
+            counts[2] += requests
+        self.ensure_started()
+
+    def pending(self, user_id, day):
+        with self._lock:
+            return tuple(self._pending.get((user_id, day), (0, 0, 0)))
+
+    def drain(self):
+        """Take all pending counts."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, deltas):
+        """Put back counts whose flush failed."""
+        for (user_id, day), (prompt_tokens, completion_tokens, requests) in deltas.items():
+            self.add(user_id, day, prompt_tokens, completion_tokens, requests)
+
+    def stored(self, user_id, day, load):
+        """Stored usage for a user and day, re-read at most once per flush interval."""
+        key = (user_id, day)
+        with self._lock:
+            cached = self._stored.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.interval:
+            return cached[0]
+
+        usage = load()
+        with self._lock:
+            self._stored[key] = (usage, time.monotonic())
+        return usage
+
+    def forget_stored(self, keys):
+        with self._lock:
+            for key in keys:
+                self._stored.pop(key, None)
+            # Old days are never asked for again
+            today = datetime.utcnow().date()
+            for key in [key for key in self._stored if key[1] < today]:
+                del self._stored[key]
+
+    def ensure_started(self):
+        """Start the flush thread once per process (after any fork)."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='usage-flusher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            with self.app.app_context():
+                UsageService.flush()
+
+
+def _tracker():
+    return current_app.extensions['usage_tracker']
+
+
+def _usage_model(user_id):
+    """Table counting a user's usage, or that of all guests without one."""
+    return UserUsage if user_id else AnonymousUsage
+
+
+def _usage_rows(user_id, day):
+    if user_id:
+        return UserUsage.query.filter_by(user_id=user_id, day=day)
+    return AnonymousUsage.query.filter_by(day=day)
+
+
+def _totals(prompt_tokens, completion_tokens, requests):
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+        'requests': requests
+    }
+
+
+class UsageService:
+    """Service class for token accounting and quotas."""
+
+    @staticmethod
+    def record(user_id, prompt_tokens, completion_tokens):
+        """Count one model call for a user (or for guests, without one)."""
+        LLM_TOKENS.inc(prompt_tokens, kind='prompt')
+        LLM_TOKENS.inc(completion_tokens, kind='completion')
+        _tracker().add(user_id or None, datetime.utcnow().date(), prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def today(user_id):
+        """A user's (or all guests') usage today: stored plus not yet flushed by this process."""
+        tracker = _tracker()
+        day = datetime.utcnow().date()
+        user_id = user_id or None
+
+        def load():
+            row = _usage_rows(user_id, day).first()
+            return (row.prompt_tokens, row.completion_tokens, row.requests) if row else (0, 0, 0)
+
+        stored = tracker.stored(user_id, day, load)
+        pending = tracker.pending(user_id, day)
+        return _totals(*(a + b for a, b in zip(stored, pending)))
+
+    @staticmethod
+    def _quota():
+        config = current_app.config
+        tomorrow = datetime.utcnow().date() + timedelta(days=1)
+        return {
+            'daily_tokens': config['USAGE_DAILY_TOKEN_QUOTA'] or None,
+            'daily_requests': config['USAGE_DAILY_REQUEST_QUOTA'] or None,
+            'resets_at': datetime.combine(tomorrow, datetime.min.time()).isoformat() + 'Z'
+        }
+
+    @staticmethod
+    def check_quota(user_id, reserved_tokens=0, reserved_requests=0):
+        """Whether a user (or a guest, without one) may make another model call today.
+
+        ``reserved_*`` are calls of the user already in flight, not counted yet.
+        """
+        config = current_app.config
+        prefix = 'USAGE_DAILY_' if user_id else 'USAGE_ANONYMOUS_DAILY_'
+        token_quota = config[prefix + 'TOKEN_QUOTA']
+        request_quota = config[prefix + 'REQUEST_QUOTA']
+        if not (token_quota or request_quota):
+            return {'success': True}
+
+        usage = UsageService.today(user_id)
+        if token_quota and usage['total_tokens'] + reserved_tokens >= token_quota:
+            exceeded = 'tokens'
+        elif request_quota and usage['requests'] + reserved_requests >= request_quota:
+            exceeded = 'requests'
+        else:
+            return {'success': True, 'usage': usage}
+
+        QUOTA_REJECTIONS.inc(quota=exceeded)
+        now = datetime.utcnow()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return {
+            'success': False,
+            'message': (
+                'Daily usage limit reached. Please try again tomorrow.' if user_id
+                else 'Daily guest usage limit reached. Please sign in or try again tomorrow.'
+            ),
+            'quota': exceeded,
+            'retry_after': int((midnight - now).total_seconds()) + 1,
+            'usage': usage
+        }
+
+    @staticmethod
+    def flush():
+        """Write the pending counters of this process to the usage table."""
+        tracker = _tracker()
+        deltas = tracker.drain()
+        if not deltas:
+            return {
+                'success': True,
+                'rows_written': 0
+            }
+
+        try:
+            for (user_id, day), (prompt_tokens, completion_tokens, requests) in deltas.items():
+                model = _usage_model(user_id)
+                updated = _usage_rows(user_id, day).update({
+                    model.prompt_tokens: model.prompt_tokens + prompt_tokens,
+                    model.completion_tokens: model.completion_tokens + completion_tokens,
+                    model.requests: model.requests + requests,
+                    model.updated_at: datetime.utcnow()
+                }, synchronize_session=False)
+                if not updated:
+                    row = model(
+                        day=day,
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        requests=requests
+                    )
+                    if user_id:
+                        row.user_id = user_id
+                    db.session.add(row)
+            db.session.commit()
+            tracker.forget_stored(deltas)
+
+            return {
+                'success': True,
+                'rows_written': len(deltas)
+            }
+
+        except Exception as e:
+            # Typically another worker inserted the same day first; the next
+            # flush finds its row and updates it
+            db.session.rollback()
+            tracker.restore(deltas)
+            current_app.logger.error(f"Usage flush error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to write usage'
+            }
+
+    @staticmethod
+    def get_usage(user_id, days=30):
+        """Daily usage of a user over the last ``days`` days, with totals and quotas."""
+        try:
+            today = datetime.utcnow().date()
+            since = today - timedelta(days=days - 1)
+
+            rows = UserUsage.query.filter(
+                UserUsage.user_id == user_id,
+                UserUsage.day >= since
+            ).order_by(UserUsage.day.desc()).all()
+            by_day = {row.day: row.to_dict() for row in rows}
+
+            # Today also counts calls this process has not flushed yet
+            by_day[today] = dict(UsageService.today(user_id), day=today.isoformat())
+            daily = [by_day[day] for day in sorted(by_day, reverse=True)]
+
+            all_time = db.session.query(
+                func.coalesce(func.sum(UserUsage.prompt_tokens), 0),
+                func.coalesce(func.sum(UserUsage.completion_tokens), 0),
+                func.coalesce(func.sum(UserUsage.requests), 0)
+            ).filter(UserUsage.user_id == user_id).one()
+            pending = _tracker().pending(user_id, today)
+
+            return {
+                'success': True,
+                'days': daily,
+                'totals': _totals(*(sum(day[key] for day in daily) for key in ('prompt_tokens', 'completion_tokens', 'requests'))),
+                'all_time': _totals(*(int(a) + b for a, b in zip(all_time, pending))),
+                'quota': UsageService._quota()
+            }
+
+        except Exception as e:
+            current_app.logger.error(f"Get usage error: {str(e)}")
+            return {
+                'success': False,
+                'message': 'Failed to get usage'
+            }
+
+
+def flush_usage(app):
+    """Write this process's pending usage before it exits."""
+    tracker = app.extensions.get('usage_tracker')
+    if tracker is not None:
+        tracker.stop()
+        with app.app_context():
+            UsageService.flush()
+
+
+def init_usage(app):
+    """Create the usage tracker; its flush thread starts with the first recorded call."""
+    tracker = UsageTracker(app)
+    app.extensions['usage_tracker'] = tracker
+    # Forked server workers exit without atexit handlers and flush explicitly
+    atexit.register(flush_usage, app)
+    return tracker
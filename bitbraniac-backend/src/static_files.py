@@ -0,0 +1,235 @@
+"""
+Static file serving for BitBraniac application.
+
+At startup the static folder (the React build) is scanned into an in-memory
+manifest: content type, ETag, cache policy and gzip/zstd variants for each
+file. Variants built ahead of time (``app.js.gz``, ``app.js.zst``) are used
+as-is; otherwise compressible files are compressed once while the manifest is
+built. Requests are answered from the manifest without touching the
+filesystem:
+
+- fingerprinted build assets (``assets/index-<hash>.js``) are cached for a
+  year as ``immutable``
+- other files are cached for ``STATIC_MAX_AGE`` seconds
+- ``index.html``, which is also the SPA fallback, is always revalidated
+
+Changes to the static folder are picked up on restart.
+
+Variants can be written to disk as part of a frontend deploy with:
+
+    python -m src.static_files src/static
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import zstandard
+from flask import Response, request, send_file
+
+
+# Vite emits build assets as assets/<name>-<8 character hash>.<ext>
+FINGERPRINT_PATTERN = re.compile(r'-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+INDEX_CACHE_CONTROL = 'no-cache'
+
+# Preferred first
+ENCODINGS = (('zstd', '.zst'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = (
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'application/wasm', 'application/xml', 'image/svg+xml', 'image/x-icon',
+    'image/vnd.microsoft.icon', 'font/ttf', 'font/otf'
+)
+MIN_COMPRESS_BYTES = 256
+
+
+def _is_compressible(content_type):
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def _compress(encoding, data, zstd_level):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=zstd_level).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class StaticAsset:
+    """One file of the manifest and its encoded variants."""
+
+    __slots__ = ('path', 'file_path', 'content_type', 'etag', 'cache_control', 'body', 'variants')
+
+    def __init__(self, path, file_path, content_type, etag, cache_control, body, variants):
+        self.path = path
+        self.file_path = file_path
+        self.content_type = content_type
+        self.etag = etag
+        self.cache_control = cache_control
+        self.body = body  # None for files too large to keep in memory
+        self.variants = variants  # encoding -> bytes
+
+
+class StaticManifest:
+    """In-memory index of the static folder."""
+
+    def __init__(self, root, max_age=3600, max_memory_file_bytes=4 * 1024 * 1024, zstd_level=19):
+        self.root = root
+        self.max_age = max_age
+        self.max_memory_file_bytes = max_memory_file_bytes
+        self.zstd_level = zstd_level
+        self.assets = {}
+        self.index = None
+        self.build()
+
+    def _cache_control(self, path):
+        if path == 'index.html':
+            return INDEX_CACHE_CONTROL
+        if path.startswith('assets/') and FINGERPRINT_PATTERN.search(path):
+            return IMMUTABLE_CACHE_CONTROL
+        return f'public, max-age={self.max_age}'
+
+    def _load_variants(self, file_path, data, content_type):
+        variants = {}
+        mtime = os.path.getmtime(file_path)
+
+        for encoding, suffix in ENCODINGS:
+            prebuilt = file_path + suffix
+            if os.path.exists(prebuilt) and os.path.getmtime(prebuilt) >= mtime:
+                with open(prebuilt, 'rb') as f:
+                    variants[encoding] = f.read()
+            elif _is_compressible(content_type) and len(data) >= MIN_COMPRESS_BYTES:
+                compressed = _compress(encoding, data, self.zstd_level)
+                # Not worth a Content-Encoding unless it saves a tenth
+                if len(compressed) < len(data) * 0.9:
+                    variants[encoding] = compressed
+
+        return variants
+
+    def _load_asset(self, path, file_path):
+        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        etag = digest.hexdigest()[:32]
+
+        body = None
+        variants = {}
+        if os.path.getsize(file_path) <= self.max_memory_file_bytes:
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            variants = self._load_variants(file_path, body, content_type)
+
+        return StaticAsset(path, file_path, content_type, etag, self._cache_control(path), body, variants)
+
+    def build(self):
+        """Scan the static folder; variant files are attached to their source file."""
+        assets = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                file_path = os.path.join(directory, name)
+                base, suffix = os.path.splitext(file_path)
+                if suffix in ('.gz', '.zst') and os.path.exists(base):
+                    continue
+                path = os.path.relpath(file_path, self.root).replace(os.sep, '/')
+                assets[path] = self._load_asset(path, file_path)
+
+        self.assets = assets
+        self.index = assets.get('index.html')
+
+    def lookup(self, path):
+        """Asset for a request path, falling back to index.html for client-side routes."""
+        return self.assets.get(path) or self.index
+
+
+def _negotiate_encoding(asset):
+    for encoding, _ in ENCODINGS:
+        if encoding in asset.variants and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def serve_asset(asset):
+    """Response for an asset, honouring If-None-Match and Accept-Encoding."""
+    if asset.body is None:
+        response = send_file(asset.file_path, mimetype=asset.content_type, etag=asset.etag, conditional=True)
+        response.headers['Cache-Control'] = asset.cache_control
+        return response
+
+    encoding = _negotiate_encoding(asset)
+    etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': asset.cache_control}
+    if asset.variants:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        body = asset.variants[encoding]
+    else:
+        body = asset.body
+    return Response(body, headers=headers, content_type=asset.content_type)
+
+
+def init_static(app):
+    """Build the static manifest and register the frontend routes."""
+    manifest = None
+    if app.static_folder and os.path.isdir(app.static_folder):
+        manifest = StaticManifest(
+            app.static_folder,
+            max_age=app.config['STATIC_MAX_AGE'],
+            max_memory_file_bytes=app.config['STATIC_MEMORY_MAX_FILE_BYTES'],
+            zstd_level=app.config['STATIC_ZSTD_LEVEL']
+        )
+        app.logger.info(f"Static manifest built with {len(manifest.assets)} files")
+    app.extensions['static_manifest'] = manifest
+
+    # Serve React frontend (if built files are present)
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        if manifest is None:
+            return "Static folder not configured", 404
+
+        asset = manifest.lookup(path)
+        if asset is None:
+            return "index.html not found", 404
+        return serve_asset(asset)
+
+
+def precompress(root, zstd_level=19):
+    """Write .gz and .zst variants next to every compressible file under root."""
+    written = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            file_path = os.path.join(directory, name)
+            if name.endswith(('.gz', '.zst')):
+                continue
+            content_type = mimetypes.guess_type(file_path)[0] or ''
+            if not _is_compressible(content_type):
+                continue
+
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            if len(data) < MIN_COMPRESS_BYTES:
+                continue
+
+            for encoding, suffix in ENCODINGS:
+                compressed = _compress(encoding, data, zstd_level)
+                if len(compressed) < len(data) * 0.9:
+                    with open(file_path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'static')
+    print(f"Wrote {precompress(root)} compressed variants under {root}")
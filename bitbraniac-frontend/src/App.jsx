@@ -20,6 +20,7 @@ const ChatInterface = () => {
   const [error, setError] = useState(null);
   const [sidebarOpen, setSidebarOpen] = useState(false);
   const messagesEndRef = useRef(null);
+  const pendingTurnRef = useRef(null);
   
   const { currentSession, updateSessionInList, setError: setChatError } = useChat();
   const { isAuthenticated } = useAuth();
@@ -43,6 +44,19 @@ const ChatInterface = () => {
     }
   }, [currentSession]);
 
+  // Stop generating a reply the user has navigated away from
+  const cancelPendingTurn = () => {
+    const turnId = pendingTurnRef.current;
+    if (turnId) {
+      pendingTurnRef.current = null;
+      if (isAuthenticated) {
+        chatService.cancelMessage(turnId);
+      }
+    }
+  };
+
+  useEffect(() => cancelPendingTurn, [currentSession?.id]);
+
   // Check backend health on mount
   useEffect(() => {
     checkBackendHealth();
@@ -93,8 +107,17 @@ const ChatInterface = () => {
     };
     setMessages(prev => [...prev, userMessage]);
 
+    const turnId = crypto.randomUUID();
+    pendingTurnRef.current = turnId;
+
     try {
-      const result = await chatService.sendMessage(message, currentSession?.id);
+      const result = await chatService.sendMessage(message, currentSession?.id, turnId);
+
+      // Cancelled because the user switched chats; nothing left to show
+      if (pendingTurnRef.current !== turnId) {
+        return;
+      }
+      pendingTurnRef.current = null;
       
       if (result.success) {
         // Add assistant response
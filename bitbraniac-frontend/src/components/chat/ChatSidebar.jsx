@@ -32,7 +32,7 @@ export const ChatSidebar = ({ className = '' }) => {
     loadSession, 
     deleteSession,
     clearAllSessions,
-    loadUserSessions
+    syncSessions
   } = useChat();
   const { user, logout } = useAuth();
   const [deletingSessionId, setDeletingSessionId] = useState(null);
@@ -87,7 +87,7 @@ export const ChatSidebar = ({ className = '' }) => {
               </Button>
             </DropdownMenuTrigger>
             <DropdownMenuContent align="end">
-              <DropdownMenuItem onClick={loadUserSessions}>
+              <DropdownMenuItem onClick={syncSessions}>
                 <RefreshCw className="mr-2 h-4 w-4" />
                 Refresh
               </DropdownMenuItem>
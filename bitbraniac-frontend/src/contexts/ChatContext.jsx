@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef } from 'react';
 import { sessionService } from '../services/sessionService';
 import { useAuth } from './AuthContext';
 
@@ -18,14 +18,19 @@ export const ChatProvider = ({ children }) => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const { isAuthenticated } = useAuth();
+  // Change sequence the session list is current up to
+  const watermark = useRef(null);
 
-  // Load user sessions when authenticated
+  // Load user sessions when authenticated, then follow changes as they happen
   useEffect(() => {
     if (isAuthenticated) {
-      loadUserSessions();
+      const controller = new AbortController();
+      loadUserSessions().then(() => followSessionEvents(controller.signal));
+      return () => controller.abort();
     } else {
       setSessions([]);
       setCurrentSession(null);
+      watermark.current = null;
     }
   }, [isAuthenticated]);
 
@@ -37,6 +42,7 @@ export const ChatProvider = ({ children }) => {
       
       if (result.success) {
         setSessions(result.sessions || []);
+        watermark.current = result.watermark ?? null;
       } else {
         setError(result.message || 'Failed to load chat sessions');
       }
@@ -48,6 +54,73 @@ export const ChatProvider = ({ children }) => {
     }
   };
 
+  // Merge a change set from /sessions/changes or the event stream
+  const applyChanges = (result) => {
+    const deleted = new Set(result.deleted);
+    const changed = new Map(result.sessions.map(session => [session.id, session]));
+    setSessions(prev => [
+      ...result.sessions,
+      ...prev.filter(session => !deleted.has(session.id) && !changed.has(session.id))
+    ].sort((a, b) => b.updated_at.localeCompare(a.updated_at)));
+
+    setCurrentSession(prev => {
+      if (!prev) return prev;
+      if (deleted.has(prev.id)) return null;
+      return changed.has(prev.id) ? { ...prev, ...changed.get(prev.id) } : prev;
+    });
+    // Replayed events can be older than what is already applied
+    watermark.current = Math.max(watermark.current ?? 0, result.watermark);
+  };
+
+  // Keep the event stream open, reconnecting with backoff; every reconnect
+  // resumes from the watermark, so nothing is missed while disconnected
+  const followSessionEvents = async (signal) => {
+    let delay = 1000;
+    const handleEvent = (type, id, data) => {
+      delay = 1000;
+      if (type === 'ready') {
+        watermark.current = watermark.current ?? data.watermark;
+      } else if (type === 'changes') {
+        applyChanges(data);
+      } else if (type === 'reset') {
+        loadUserSessions();
+      }
+    };
+
+    while (!signal.aborted) {
+      try {
+        await sessionService.streamSessionEvents(watermark.current, handleEvent, signal);
+      } catch (error) {
+        if (signal.aborted) return;
+        console.warn('Session event stream interrupted:', error);
+      }
+      await new Promise(resolve => setTimeout(resolve, delay + Math.random() * 1000));
+      delay = Math.min(delay * 2, 30000);
+    }
+  };
+
+  // Apply only what changed since the last load instead of refetching the list
+  const syncSessions = async () => {
+    if (watermark.current === null) {
+      return loadUserSessions();
+    }
+
+    try {
+      setError(null);
+      let result;
+      do {
+        result = await sessionService.getSessionChanges(watermark.current);
+        if (!result.success || result.reset) {
+          return loadUserSessions();
+        }
+        applyChanges(result);
+      } while (result.has_more);
+    } catch (error) {
+      console.error('Failed to sync sessions:', error);
+      setError('Failed to load chat sessions');
+    }
+  };
+
   const createNewSession = async (title = 'New Chat') => {
     try {
       setError(null);
@@ -151,6 +224,7 @@ export const ChatProvider = ({ children }) => {
     loading,
     error,
     loadUserSessions,
+    syncSessions,
     createNewSession,
     loadSession,
     deleteSession,
@@ -36,7 +36,7 @@ class ChatService {
     }
   }
 
-  async sendMessage(message, sessionId = null) {
+  async sendMessage(message, sessionId = null, turnId = null) {
     const endpoint = localStorage.getItem('access_token') 
       ? '/chat/message' 
       : '/chat/message/anonymous';
@@ -45,6 +45,10 @@ class ChatService {
     if (sessionId) {
       body.session_id = sessionId;
     }
+    // Lets the message be cancelled with cancelMessage while it is answered
+    if (turnId) {
+      body.turn_id = turnId;
+    }
 
     return await this.makeRequest(endpoint, {
       method: 'POST',
@@ -52,6 +56,12 @@ class ChatService {
     });
   }
 
+  async cancelMessage(turnId) {
+    return await this.makeRequest(`/chat/message/${encodeURIComponent(turnId)}`, {
+      method: 'DELETE',
+    });
+  }
+
   async getWelcomeMessage() {
     return await this.makeRequest('/chat/welcome');
   }
@@ -40,6 +40,79 @@ class SessionService {
     return await this.makeRequest(`/sessions?limit=${limit}`);
   }
 
+  async getSessionChanges(since) {
+    return await this.makeRequest(`/sessions/changes?since=${since}`);
+  }
+
+  // Follow the session event stream until it ends. Resolves when the server
+  // closes it; rejects on network errors, when the signal aborts, or when no
+  // data (not even a heartbeat) arrives for idleTimeout ms.
+  async streamSessionEvents(lastEventId, onEvent, signal, idleTimeout = 45000) {
+    const headers = { Accept: 'text/event-stream' };
+    const token = localStorage.getItem('access_token');
+    if (token) {
+      headers.Authorization = `Bearer ${token}`;
+    }
+    if (lastEventId !== null && lastEventId !== undefined) {
+      headers['Last-Event-ID'] = String(lastEventId);
+    }
+
+    const controller = new AbortController();
+    const abort = () => controller.abort();
+    signal.addEventListener('abort', abort);
+    let idleTimer = setTimeout(abort, idleTimeout);
+
+    try {
+      const response = await fetch(`${API_BASE_URL}/sessions/events`, { headers, signal: controller.signal });
+
+      if (response.status === 401) {
+        localStorage.removeItem('access_token');
+        localStorage.removeItem('refresh_token');
+        window.location.href = '/login';
+        return;
+      }
+      if (!response.ok) {
+        throw new Error(`Event stream failed with status ${response.status}`);
+      }
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) {
+          return;
+        }
+        clearTimeout(idleTimer);
+        idleTimer = setTimeout(abort, idleTimeout);
+
+        buffer += value;
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+          const block = buffer.slice(0, end);
+          buffer = buffer.slice(end + 2);
+
+          const event = { type: 'message', id: null, data: '' };
+          for (const line of block.split('\n')) {
+            const colon = line.indexOf(':');
+            // Lines starting with ':' are heartbeats
+            if (colon === 0) continue;
+            const field = colon === -1 ? line : line.slice(0, colon);
+            const fieldValue = colon === -1 ? '' : line.slice(colon + 1).replace(/^ /, '');
+            if (field === 'event') event.type = fieldValue;
+            else if (field === 'id') event.id = Number(fieldValue);
+            else if (field === 'data') event.data += fieldValue;
+          }
+          if (event.data) {
+            onEvent(event.type, event.id, JSON.parse(event.data));
+          }
+        }
+      }
+    } finally {
+      clearTimeout(idleTimer);
+      signal.removeEventListener('abort', abort);
+    }
+  }
+
   async createSession(title = 'New Chat') {
     return await this.makeRequest('/sessions', {
       method: 'POST',